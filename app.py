@@ -6,39 +6,59 @@ import json
 import os
 import sys
 from pathlib import Path
-from typing import Any, Dict, List
+from threading import Event
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 # Third-party imports
-import altair as alt
-from slack_bolt import App
+from slack_bolt import App, BoltResponse
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 from slack_sdk import WebClient
-from snowflake.snowpark.session import Session
 
 # Local/application imports
 import handler_tasks.blocks as blocks
-from handler_tasks.cortalyst import Cortlayst
+import handler_tasks.guardrails as guardrails
+from handler_tasks.conversation import (
+    conversation_store,
+    follow_up,
+    in_thread,
+    question_message,
+)
+from handler_tasks.cortalyst import CortlaystRegistry
 from handler_tasks.db_setup import DBSetup
+from handler_tasks.dispatcher import JobRejectedError, job_dispatcher, scheduling_key
+from handler_tasks.http_transport import close_transport
+from handler_tasks.guardrails import QueryRefusedError, scan_guard
+from handler_tasks.idempotency import (
+    delivery_id,
+    idempotency_guard,
+    with_envelope_id,
+)
+from handler_tasks.answer_cache import (
+    normalize_question,
+    normalize_semantic_model_file,
+)
+from handler_tasks.query import (
+    QueryCancelledError,
+    QueryJob,
+    query_preview,
+    query_result,
+    running_queries,
+)
+from handler_tasks.result_cache import result_cache
+from handler_tasks.semantic_cache import semantic_cache
+from handler_tasks.session import BackgroundSession
+from handler_tasks.single_flight import SingleFlight
 from log.logger import get_logger as logger
 
 logger = logger("demo_mate_bot")
 
-try:
-    session = Session.builder.config(
-        "connection_name", os.getenv("SNOWFLAKE_CONNECTION_NAME", "default")
-    ).create()
-    logger.debug(
-        f"Account:{session.conf.get('account')},User:{session.conf.get('user')}"
-    )
-    session.sql("DESC USER")
-except Exception as e:
-    logger.error(f"Error establishing connection,{e}", exc_info=True)
-    sys.exit(1)
+# the Snowpark session opens in the background while the bot connects to Slack
+snowpark_session = BackgroundSession().start()
 
 # Initializes your app with your bot token and socket mode handler
 app = App(token=os.environ.get("SLACK_BOT_TOKEN"))
 
-db_setup: DBSetup = DBSetup(session=session)
+db_setup: DBSetup = DBSetup(session=snowpark_session.get)
 __db_info_file = Path.home().joinpath(".snowflake/.dbinfo")
 if __db_info_file.exists():
     logger.debug(f"Loading db and schema info from file {__db_info_file}")
@@ -52,6 +72,93 @@ if __db_info_file.exists():
 else:
     logger.debug(f"File {__db_info_file} does not exists, using defaults.")
 
+# warm Cortex Analyst clients, invalidated whenever the db setup changes
+cortalyst_registry = CortlaystRegistry()
+# concurrent identical questions share one Cortex Analyst call
+cortalyst_calls = SingleFlight()
+# stream Cortex Analyst answers to show them as soon as they arrive
+cortex_streaming = os.getenv("CORTEX_STREAMING", "false").lower() == "true"
+# columns of the query result shown in the chart
+CHART_COLUMNS = ["SERVICE_TYPE", "TICKET_COUNT"]
+
+
+@app.middleware
+def skip_redelivered(body, next, logger):
+    """
+    Acknowledge the requests Slack redelivers, e.g. after a slow acknowledgement, without
+    handling them again.
+
+    Args:
+        body: Dictionary containing the request payload
+        next: Function to pass the request on to the listeners
+        logger: Logger instance
+
+    Returns:
+        BoltResponse: the acknowledgement of a redelivered request, otherwise None
+    """
+    delivery = delivery_id(body)
+    if delivery is not None and idempotency_guard.seen(delivery):
+        logger.info(f"Skipping redelivered request {delivery}")
+        return BoltResponse(status=200, body="")
+    next()
+
+
+def dispatch(
+    name: str,
+    key: str,
+    respond,
+    fn: Callable[..., Any],
+    *args,
+    operation: Optional[str] = None,
+    **kwargs,
+):
+    """
+    Run a long running handler job on the bounded job dispatcher, so the handler returns
+    right after acknowledging the request. The jobs of the channels take turns, the user
+    is told when the job has to wait and when the bot is too busy to accept it.
+
+    While the job of an operation runs, its duplicates, e.g. repeated clicks on a button,
+    are dropped, the first one is told the job is in progress.
+
+    Args:
+        name (str): Name of the job, used for the latency statistics
+        key (str): Scheduling key of the job, see `scheduling_key`
+        respond: Function to send ephemeral responses to the user
+        fn (Callable[..., Any]): The job, called with the remaining arguments
+        operation (str, optional): Key identifying duplicates of the job. Defaults to None.
+
+    Returns:
+        None
+    """
+
+    def _notify_queued(position: int):
+        respond(
+            text=f":hourglass_flowing_sand: I'm busy right now, you're #{position} in line.",
+            response_type="ephemeral",
+        )
+
+    if operation is not None:
+        duplicates = idempotency_guard.begin(operation)
+        if duplicates:
+            if duplicates == 1:
+                respond(
+                    text=":hourglass_flowing_sand: I'm still working on that, hang on.",
+                    response_type="ephemeral",
+                )
+            return
+
+    try:
+        future = job_dispatcher.submit(
+            name, fn, *args, key=key, on_queued=_notify_queued, **kwargs
+        )
+        future.add_done_callback(lambda _: idempotency_guard.end(operation))
+    except JobRejectedError:
+        idempotency_guard.end(operation)
+        respond(
+            text=":no_entry: Sorry, I'm too busy right now, please try again in a minute.",
+            response_type="ephemeral",
+        )
+
 
 def do_setup(
     client,
@@ -88,6 +195,9 @@ def do_setup(
         global db_setup
         db_setup.db_name = db_name
         db_setup.schema_name = schema_name
+        cortalyst_registry.invalidate()
+        conversation_store.clear()
+        result_cache.invalidate()
         ## call the db setup
         db_setup.do(
             client,
@@ -168,12 +278,17 @@ def setup_handler(ack, client, command, respond):
                 logger.debug(f"Body Text:{command_text}")
                 db_name, schema_name = tuple(command_text.strip().split())
                 channel = command["channel_id"]
-                do_setup(
+                dispatch(
+                    "setup",
+                    scheduling_key(channel, command.get("user_id")),
+                    respond,
+                    do_setup,
                     channel_id=channel,
                     client=client,
                     db_name=db_name,
                     schema_name=schema_name,
                     logger=logger,
+                    operation=f"setup:{channel}:{db_name}.{schema_name}".lower(),
                 )
             except ValueError as e:
                 respond(
@@ -197,7 +312,7 @@ def setup_handler(ack, client, command, respond):
 
 
 @app.action("setup_db")
-def action_setup_db(ack, body, client, logger):
+def action_setup_db(ack, body, client, respond, logger):
     """
     Handle Slack interactive component actions related to database setup.
 
@@ -209,6 +324,7 @@ def action_setup_db(ack, body, client, logger):
             - actions: Array of action objects containing values/selections
             - response_url: URL for sending delayed responses
         client: Slack client instance for making API calls
+        respond: Function to send delayed responses to the action
         logger: Logger instance to track the setup process and any errors
 
     Returns:
@@ -225,12 +341,17 @@ def action_setup_db(ack, body, client, logger):
         "value"
     ]
     channel = body["channel"]["id"]
-    do_setup(
+    dispatch(
+        "setup",
+        scheduling_key(channel, body.get("user", {}).get("id")),
+        respond,
+        do_setup,
         channel_id=channel,
         client=client,
         db_name=db_name,
         schema_name=schema_name,
         logger=logger,
+        operation=f"setup:{channel}:{db_name}.{schema_name}".lower(),
     )
 
 
@@ -254,7 +375,6 @@ def cleanup_handler(ack, client, command, respond):
     """
     logger.debug(f"Received Demo Cleanup Command: {command}")
     ack()
-    global session
     channel_id = command["channel_id"]
     # Send the response with wait message
     client.chat_postMessage(
@@ -266,7 +386,10 @@ def cleanup_handler(ack, client, command, respond):
     try:
         if db_name is not None:
             logger.debug(f"Dropping :command_text:{db_name}")
-            _count = session.sql(f"DROP DATABASE {db_name}").count()
+            _count = snowpark_session.get().sql(f"DROP DATABASE {db_name}").count()
+            cortalyst_registry.invalidate()
+            conversation_store.clear()
+            result_cache.invalidate()
             if _count > 0:
                 client.chat_postMessage(
                     channel=channel_id,
@@ -336,21 +459,35 @@ def handle_cortalyst(ack, client: WebClient, say, command, respond, logger):
                 )
         else:
             logger.debug(f"Question:{command_text}")
-            try:
-                channel_id = command["channel_id"]
-                ask_cortex_analyst(
-                    channel_id=channel_id,
-                    client=client,
-                    say=say,
-                    logger=logger,
-                    question=command_text,
-                )
-            except Exception as e:
-                logger.error(f"Cortalyst error: {e}")
-                respond(
-                    text=f"Error asking Cortex Analyst: {str(e)}",
-                    response_type="ephemeral",
-                )
+
+            def _ask():
+                try:
+                    channel_id = command["channel_id"]
+                    ask_cortex_analyst(
+                        channel_id=channel_id,
+                        client=client,
+                        say=say,
+                        logger=logger,
+                        question=command_text,
+                        user_id=command.get("user_id"),
+                    )
+                except Exception as e:
+                    logger.error(f"Cortalyst error: {e}")
+                    respond(
+                        text=f"Error asking Cortex Analyst: {str(e)}",
+                        response_type="ephemeral",
+                    )
+
+            dispatch(
+                "cortalyst",
+                scheduling_key(command["channel_id"], command.get("user_id")),
+                respond,
+                _ask,
+                operation=(
+                    f"cortalyst:{command['channel_id']}:{command.get('user_id')}:"
+                    f"{normalize_question(command_text)}"
+                ),
+            )
     except Exception as e:
         logger.error(f"Cortalyst::Failed to send response: {e}")
         try:
@@ -394,28 +531,109 @@ def action_ask_cortex_analyst(ack, body, client, respond, say, logger):
             - Response formatting errors
     """
     ack()
-    try:
-        logger.debug(f"Received Message Event: {body}")
-        global db_setup  # make sure we use the global one
 
-        question = body["state"]["values"]["analyst_question_block"]["question"][
-            "value"
-        ]
-        channel_id = body["channel"]["id"]
-        ask_cortex_analyst(channel_id, client, say, logger, question)
+    def _ask():
+        try:
+            logger.debug(f"Received Message Event: {body}")
+            global db_setup  # make sure we use the global one
+
+            question = body["state"]["values"]["analyst_question_block"]["question"][
+                "value"
+            ]
+            channel_id = body["channel"]["id"]
+            thread_ts = body.get("container", {}).get("thread_ts")
+            ask_cortex_analyst(
+                channel_id,
+                client,
+                say,
+                logger,
+                question,
+                thread_ts,
+                user_id=body.get("user", {}).get("id"),
+            )
 
-    except Exception as e:
-        logger.error(f"Failed to send request to Cortex Analyst: {e}")
-        # Fallback response
-        respond(
-            text="Sorry, there was an error askingCortex Analyst .",
-            response_type="ephemeral",
+        except Exception as e:
+            logger.error(f"Failed to send request to Cortex Analyst: {e}")
+            # Fallback response
+            respond(
+                text="Sorry, there was an error askingCortex Analyst .",
+                response_type="ephemeral",
+            )
+
+    user_id = body.get("user", {}).get("id")
+    dispatch(
+        "ask_cortex_analyst",
+        scheduling_key(body["channel"]["id"], user_id),
+        respond,
+        _ask,
+        # clicks on the same question form
+        operation=(
+            f"ask_cortex_analyst:{body['channel']['id']}:{user_id}:"
+            f"{body.get('container', {}).get('message_ts')}"
+        ),
+    )
+
+
+@app.event("message")
+def handle_follow_up(event, client, say, logger):
+    """
+    Answer the replies in the thread of a conversation as follow-up questions, other
+    messages are ignored.
+
+    Args:
+        event: Dictionary containing the message event
+        client: Slack client instance for making API calls
+        say: Function to send messages to the conversation
+        logger: Logger instance for tracking the question processing and errors
+
+    Returns:
+        None
+    """
+    question = follow_up(event, conversation_store)
+    if question is None:
+        return
+    channel_id, thread_ts, user_id = event["channel"], event["thread_ts"], event["user"]
+
+    def _respond(text: str, response_type: Optional[str] = None):
+        client.chat_postEphemeral(
+            channel=channel_id, user=user_id, thread_ts=thread_ts, text=text
         )
 
+    def _ask():
+        try:
+            ask_cortex_analyst(
+                channel_id, client, say, logger, question, thread_ts, user_id=user_id
+            )
+        except Exception as e:
+            logger.error(f"Failed to answer the follow-up question: {e}")
+            _respond(text="Sorry, there was an error asking Cortex Analyst.")
+
+    dispatch(
+        "follow_up",
+        scheduling_key(channel_id, user_id),
+        _respond,
+        _ask,
+        operation=(
+            f"follow_up:{channel_id}:{thread_ts}:{user_id}:"
+            f"{normalize_question(question)}"
+        ),
+    )
+
 
-def ask_cortex_analyst(channel_id: str, client: WebClient, say, logger, question: str):
+def ask_cortex_analyst(
+    channel_id: str,
+    client: WebClient,
+    say,
+    logger,
+    question: str,
+    thread_ts: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
     """
-    Send a question to the Cortex Analyst system and handle the response in a Slack channel.
+    Send a question to the Cortex Analyst system and handle the response in a Slack thread.
+    A question asked outside a thread starts one, the answer and the replies asking
+    follow-up questions go into it. Earlier questions and answers of the thread are sent
+    along, so follow-up questions are answered in context.
 
     Args:
         channel_id (str): The ID of the Slack channel where the response should be posted
@@ -423,6 +641,8 @@ def ask_cortex_analyst(channel_id: str, client: WebClient, say, logger, question
         say: Function to send messages to the conversation
         logger: Logger instance for tracking the question processing and responses
         question (str): The actual question or request to be processed by Cortex Analyst
+        thread_ts (str, optional): The Slack thread of the conversation, None starts one
+        user_id (str, optional): The Slack user who asked, tagged on the generated queries
 
     Returns:
         None
@@ -441,8 +661,16 @@ def ask_cortex_analyst(channel_id: str, client: WebClient, say, logger, question
         logger.debug(f"Question:{sanitized_question}")
         logger.debug(f"Using DB:{db_setup.db_name},Schema:{db_setup.schema_name}")
 
+        if not thread_ts:
+            # the question starts the thread of its conversation
+            thread_ts = client.chat_postMessage(
+                channel=channel_id, text=question_message(sanitized_question, user_id)
+            )["ts"]
+        say = in_thread(say, thread_ts)
+
         client.chat_postMessage(
             channel=channel_id,
+            thread_ts=thread_ts,
             text=f":hourglass_flowing_sand: Wait for a few seconds... while I ask the Cortex Analyst :robot_face:",
         )
 
@@ -451,7 +679,8 @@ def ask_cortex_analyst(channel_id: str, client: WebClient, say, logger, question
                 f"Require PRIVATE_KEY_FILE_PATH to be set. Consult Snowflake documentation https://docs.snowflake.com/user-guide/key-pair-auth#configuring-key-pair-authentication."
             )
 
-        cortalyst = Cortlayst(
+        session = snowpark_session.get()
+        cortalyst = cortalyst_registry.get(
             database=db_setup.db_name,
             schema=db_setup.schema_name,
             account=session.conf.get("account"),
@@ -460,32 +689,213 @@ def ask_cortex_analyst(channel_id: str, client: WebClient, say, logger, question
             private_key_file_path=os.getenv("PRIVATE_KEY_FILE_PATH"),
         )
 
-        ans = cortalyst.answer(question)
+        # prior turns of the conversation in this thread, none at the channel level
+        history = conversation_store.history(channel_id, thread_ts)
+        # paraphrased questions reuse the SQL generated earlier, follow-ups depend
+        # on the conversation and are always sent to Cortex Analyst
+        ans = (
+            None
+            if history
+            else semantic_cache.get(question, cortalyst.semantic_model_file)
+        )
+
+        def _notify_queued(position: int):
+            client.chat_postMessage(
+                channel=channel_id,
+                thread_ts=thread_ts,
+                text=f":traffic_light: Cortex Analyst is busy right now, you're #{position} in line.",
+            )
+
+        if ans is not None:
+            content = ans["message"]["content"]
+        elif cortex_streaming:
+            content = stream_answer(
+                cortalyst, question, history, channel_id, thread_ts, _notify_queued
+            )
+        elif history:
+            ans = cortalyst.answer(question, history=history, on_queued=_notify_queued)
+            content = ans["message"]["content"]
+        else:
+
+            def _answer():
+                _ans = cortalyst.answer(question, on_queued=_notify_queued)
+                semantic_cache.put(question, cortalyst.semantic_model_file, _ans)
+                return _ans
+
+            ans = cortalyst_calls.do(
+                (
+                    normalize_semantic_model_file(cortalyst.semantic_model_file),
+                    normalize_question(question),
+                ),
+                _answer,
+            )
+            content = ans["message"]["content"]
+        if not cortex_streaming or ans is not None:
+            conversation_store.append(channel_id, thread_ts, question, content)
+        logger.debug(f"Semantic cache stats:{semantic_cache.stats()}")
 
-        content = ans["message"]["content"]
         show_response(
             client,
             channel_id,
             content,
             say,
+            guardrails.statement_params(channel_id, user_id, question),
+            thread_ts,
         )
     except Exception as e:
         raise Exception(e)
 
 
-def show_response(client: WebClient, channel_id, content: List[Dict[str, Any]], say):
+def stream_answer(
+    cortalyst,
+    question: str,
+    history: List[Dict[str, Any]],
+    channel_id: str,
+    thread_ts: Optional[str],
+    on_queued: Optional[Callable[[int], None]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the content items of the Cortex Analyst answer, caching the answer and adding it
+    to the conversation once it is complete.
+
+    Args:
+        cortalyst (Cortlayst): Cortex Analyst client
+        question (str): The question to ask Cortex Analyst
+        history (List[Dict[str, Any]]): Prior messages of the conversation
+        channel_id (str): The ID of the Slack channel of the conversation
+        thread_ts (str, optional): The Slack thread of the conversation
+        on_queued (Callable[[int], None], optional): Called with the position in line
+            when Cortex Analyst is busy
+
+    Returns:
+        Iterator[Dict[str, Any]]: the content items as soon as each one is received
+    """
+    content = []
+    for item in cortalyst.answer_stream(question, history=history, on_queued=on_queued):
+        content.append(item)
+        yield item
+    if not history:
+        semantic_cache.put(
+            question,
+            cortalyst.semantic_model_file,
+            {"message": {"role": "analyst", "content": content}},
+        )
+    conversation_store.append(channel_id, thread_ts, question, content)
+
+
+def progress_fetch(
+    client: WebClient, say, statement_params: Optional[Dict[str, str]] = None
+) -> Callable[..., Any]:
+    """
+    A fetch function for `query_preview` and `query_result` running the query as a
+    `QueryJob`. Once the query runs longer than QUERY_PROGRESS_AFTER seconds, a progress
+    message with its query ID, elapsed time and a Cancel button is posted and updated in place.
+    The first query is checked by the `scan_guard` before it runs.
+
+    Args:
+        client (WebClient): Slack WebClient instance for making API calls
+        say: Function to send messages to the conversation
+        statement_params (Dict[str, str], optional): Parameters of the queries, see
+            `guardrails.statement_params`. Defaults to None.
+
+    Returns:
+        Callable[..., pa.Table]: the fetch function
+    """
+
+    checked = []
+
+    def _fetch(session, query: str, columns: Optional[List[str]] = None):
+        if not checked:
+            checked.append(query)
+            estimate = scan_guard.check(session, query, statement_params)
+            if estimate is not None:
+                say(text=guardrails.scan_warning(estimate, scan_guard.max_partitions))
+        job = QueryJob(
+            session, query, columns, statement_params=statement_params
+        ).submit()
+        message = {}
+
+        def _update(state: str = "running"):
+            progress = blocks.query_progress_block(job.query_id, job.elapsed, state)
+            if not message:
+                response = say(blocks=progress, text="Query progress")
+                message.update(channel=response["channel"], ts=response["ts"])
+            else:
+                client.chat_update(
+                    channel=message["channel"],
+                    ts=message["ts"],
+                    blocks=progress,
+                    text="Query progress",
+                )
+
+        state = "failed"
+        try:
+            table = job.wait(on_progress=lambda _job: _update())
+            state = "done"
+            return table
+        except QueryCancelledError:
+            state = "cancelled"
+            raise
+        finally:
+            if message:
+                try:
+                    _update(state)
+                except Exception as e:
+                    logger.warning(f"Error updating the query progress, {e}")
+
+    return _fetch
+
+
+@app.action("cancel_query")
+def action_cancel_query(ack, body, respond, logger):
+    """
+    Handle the Cancel button of a query progress message, aborting the warehouse query.
+
+    Args:
+        ack: Function to acknowledge the action request
+        body (dict): Request payload, the value of the action is the query ID
+        respond: Function to send a response message
+        logger: Logger instance for recording events
+
+    Returns:
+        None
+    """
+    ack()
+    query_id = body["actions"][0]["value"]
+    if not running_queries.cancel(query_id):
+        respond(
+            text=f"Query `{query_id}` is not running anymore.",
+            response_type="ephemeral",
+            replace_original=False,
+        )
+
+
+def show_response(
+    client: WebClient,
+    channel_id,
+    content: Iterable[Dict[str, Any]],
+    say,
+    statement_params: Optional[Dict[str, str]] = None,
+    thread_ts: Optional[str] = None,
+):
     """
     Display Cortex Analyst's JSON response as formatted messages in a Slack channel.
+    Each item is posted as soon as it is available when the content is streamed.
 
     Args:
         client (WebClient): Slack WebClient instance for making API calls
         channel_id: ID of the Slack channel where the analysis should be displayed
-        content (List[Dict[str, Any]]): JSON response from Cortex Analyst containing:
+        content (Iterable[Dict[str, Any]]): JSON response from Cortex Analyst containing:
             - analysis_results: Detailed findings and insights
             - recommendations: Suggested actions or next steps
             - confidence_score: Reliability score of the analysis
+            - text: Cortex Analyst's interpretation of the question
             - sql: Generated SQL queries
         say: Function to send messages to the conversation
+        statement_params (Dict[str, str], optional): Timeout and tag of the generated
+            queries, see `guardrails.statement_params`. Defaults to None.
+        thread_ts (str, optional): The Slack thread of the chart, `say` posts to the
+            thread already. Defaults to None.
 
     Returns:
         None
@@ -500,6 +910,9 @@ def show_response(client: WebClient, channel_id, content: List[Dict[str, Any]],
     try:
         for item in content:
             match item["type"]:
+                case "text":
+                    # Send the interpretation of the question
+                    say(text=item["text"])
                 case "sql":
                     # Send raw generated query for reference
                     logger.debug(f"Generating text block with generated SQL")
@@ -509,19 +922,51 @@ def show_response(client: WebClient, channel_id, content: List[Dict[str, Any]],
                         text="Generated SQL",
                     )
 
-                    # Build and Display Dataframe for Query Results
+                    # Build and Display a preview of the Query Results
                     logger.debug(f"Building query result")
-                    df = session.sql(query).to_pandas()
+                    session = snowpark_session.get()
+                    fetch = progress_fetch(client, say, statement_params)
+                    try:
+                        preview, total_rows = query_preview(
+                            session,
+                            query,
+                            db_setup.db_name,
+                            db_setup.schema_name,
+                            fetch=fetch,
+                        )
+                    except QueryCancelledError:
+                        continue
+                    except QueryRefusedError as e:
+                        say(text=f":no_entry: {e}, try narrowing the question.")
+                        continue
                     say(
-                        blocks=blocks.create_df_block(df),
+                        blocks=blocks.create_df_block(preview, total_rows=total_rows),
                         text="Query Result",
                     )
 
                     # Visualization
-                    # only I have enough columns for building a graph
-                    if len(df.columns) > 1:
+                    # only if the result has the columns of the graph, the whole result
+                    # is fetched for it
+                    if set(CHART_COLUMNS).issubset(preview.column_names):
+                        try:
+                            chart_data = query_result(
+                                session,
+                                query,
+                                db_setup.db_name,
+                                db_setup.schema_name,
+                                preview,
+                                total_rows,
+                                CHART_COLUMNS,
+                                fetch=fetch,
+                            )
+                        except QueryCancelledError:
+                            continue
+                        # altair and its PNG rendering stack load on the first chart
+                        import altair as alt
+
+                        # altair reads the Arrow table through the dataframe interchange protocol
                         chart = (
-                            alt.Chart(df)
+                            alt.Chart(chart_data)
                             .mark_arc()
                             .encode(theta="TICKET_COUNT", color="SERVICE_TYPE")
                         )
@@ -535,6 +980,7 @@ def show_response(client: WebClient, channel_id, content: List[Dict[str, Any]],
                         # Upload image bytes to Slack
                         uploaded_file = client.files_upload_v2(
                             channel=channel_id,
+                            thread_ts=thread_ts,
                             file=image_bytes,
                             filename="chart.png",
                             initial_comment="Generating chart...",
@@ -576,7 +1022,23 @@ def error_handler(error, body, logger):
 
 
 def main():
-    SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"]).start()
+    try:
+        handler = SocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
+        # the envelope ID identifies the deliveries without an event or trigger ID
+        handler.client.socket_mode_request_listeners.insert(0, with_envelope_id)
+        handler.connect()
+        try:
+            snowpark_session.get()
+        except Exception:
+            sys.exit(1)
+        logger.info("Bolt app is running!")
+        Event().wait()
+    finally:
+        # let the running jobs finish, drop the queued ones
+        job_dispatcher.shutdown()
+        logger.info(f"Job stats:{job_dispatcher.stats()}")
+        # release the pooled Cortex Analyst connections
+        close_transport()
 
 
 # Start your app
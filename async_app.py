@@ -0,0 +1,859 @@
+#!/usr/bin/env python3
+
+# Standard library imports
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Third-party imports
+from slack_bolt.adapter.socket_mode.aiohttp import AsyncSocketModeHandler
+from slack_bolt import BoltResponse
+from slack_bolt.async_app import AsyncApp
+from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
+
+# Local/application imports
+import handler_tasks.blocks as blocks
+import handler_tasks.guardrails as guardrails
+from handler_tasks.answer_cache import (
+    normalize_question,
+    normalize_semantic_model_file,
+)
+from handler_tasks.async_cortalyst import AsyncCortlayst
+from handler_tasks.conversation import (
+    conversation_store,
+    follow_up,
+    in_thread,
+    question_message,
+)
+from handler_tasks.cortalyst import CortlaystRegistry
+from handler_tasks.db_setup import DBSetup
+from handler_tasks.http_transport import check_async_mode, close_async_transport
+from handler_tasks.guardrails import QueryRefusedError, scan_guard
+from handler_tasks.idempotency import (
+    delivery_id,
+    idempotency_guard,
+    with_envelope_id,
+)
+from handler_tasks.query import (
+    QueryCancelledError,
+    QueryJob,
+    query_preview_async,
+    query_result_async,
+    running_queries,
+)
+from handler_tasks.result_cache import result_cache
+from handler_tasks.semantic_cache import semantic_cache
+from handler_tasks.session import BackgroundSession
+from handler_tasks.single_flight import AsyncSingleFlight
+from log.logger import get_logger as logger
+
+logger = logger("demo_mate_bot_async")
+
+# the Snowpark session opens in the background while the bot connects to Slack
+snowpark_session = BackgroundSession().start()
+
+# Initializes your app with your bot token, the handlers run on the asyncio event loop
+app = AsyncApp(token=os.environ.get("SLACK_BOT_TOKEN"))
+# DBSetup posts its progress synchronously from the Snowpark executor
+sync_client = WebClient(token=os.environ.get("SLACK_BOT_TOKEN"))
+
+db_setup: DBSetup = DBSetup(session=snowpark_session.get)
+__db_info_file = Path.home().joinpath(".snowflake/.dbinfo")
+if __db_info_file.exists():
+    logger.debug(f"Loading db and schema info from file {__db_info_file}")
+    with __db_info_file.open(mode="r") as file:
+        db_info = json.load(file)
+        db_setup.db_name = db_info["db_name"]
+        db_setup.schema_name = db_info["schema_name"]
+        logger.debug(
+            f"App will use DB: '{db_setup.db_name}' and Schema: '{ db_setup.schema_name}'"
+        )
+else:
+    logger.debug(f"File {__db_info_file} does not exists, using defaults.")
+
+# Snowpark calls, DB setup and chart rendering block, they run on this executor so the
+# event loop keeps serving the other conversations, configured via SNOWPARK_MAX_WORKERS
+snowpark_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("SNOWPARK_MAX_WORKERS", 8)),
+    thread_name_prefix="snowpark",
+)
+# warm asyncio Cortex Analyst clients, invalidated whenever the db setup changes
+cortalyst_registry = CortlaystRegistry(client_class=AsyncCortlayst)
+# concurrent identical questions share one Cortex Analyst call
+cortalyst_calls = AsyncSingleFlight()
+# columns of the query result shown in the chart
+CHART_COLUMNS = ["SERVICE_TYPE", "TICKET_COUNT"]
+
+
+@app.middleware
+async def skip_redelivered(body, next, logger):
+    """
+    Acknowledge the requests Slack redelivers, e.g. after a slow acknowledgement, without
+    handling them again.
+
+    Args:
+        body: Dictionary containing the request payload
+        next: Function to pass the request on to the listeners
+        logger: Logger instance
+
+    Returns:
+        BoltResponse: the acknowledgement of a redelivered request, otherwise None
+    """
+    delivery = delivery_id(body)
+    if delivery is not None and idempotency_guard.seen(delivery):
+        logger.info(f"Skipping redelivered request {delivery}")
+        return BoltResponse(status=200, body="")
+    await next()
+
+
+async def run_once(
+    operation: str, respond, fn: Callable[..., Awaitable[Any]], *args, **kwargs
+) -> None:
+    """
+    Run a long running handler job unless the same operation is running. Its duplicates,
+    e.g. repeated clicks on a button, are dropped, the first one is told the job is in
+    progress.
+
+    Args:
+        operation (str): Key identifying duplicates of the job
+        respond: Function to send ephemeral responses to the user
+        fn (Callable[..., Awaitable[Any]]): The job, awaited with the remaining arguments
+
+    Returns:
+        None
+    """
+    duplicates = idempotency_guard.begin(operation)
+    if duplicates:
+        if duplicates == 1:
+            await respond(
+                text=":hourglass_flowing_sand: I'm still working on that, hang on.",
+                response_type="ephemeral",
+            )
+        return
+    try:
+        await fn(*args, **kwargs)
+    finally:
+        idempotency_guard.end(operation)
+
+
+async def run_blocking(fn: Callable[..., Any], *args) -> Any:
+    """
+    Run a blocking call, e.g. a Snowpark query, on the Snowpark executor.
+
+    Args:
+        fn (Callable[..., Any]): The blocking function, called with the arguments
+
+    Returns:
+        Any: the result of the call
+    """
+    return await asyncio.get_running_loop().run_in_executor(
+        snowpark_executor, fn, *args
+    )
+
+
+async def do_setup(
+    client: AsyncWebClient,
+    channel_id,
+    logger,
+    db_name: str = "demo_db",
+    schema_name: str = "data",
+):
+    """
+    Set up database and schema configurations for a client channel.
+
+    Args:
+        client (AsyncWebClient): Slack client instance for making API calls
+        channel_id: Unique identifier for the channel being configured
+        logger: Logger instance for tracking setup process and errors
+        db_name (str, optional): Name of the database to be used. Defaults to "demo_db"
+        schema_name (str, optional): Name of the schema to be created/used. Defaults to "data"
+
+    Returns:
+        None
+    """
+
+    logger.info("Running Database Setup")
+
+    try:
+        await client.chat_postMessage(
+            channel=channel_id,
+            text=f"Wait for few seconds for the setup to be done :hourglass_flowing_sand:",
+        )
+
+        db_setup.db_name = db_name
+        db_setup.schema_name = schema_name
+        cortalyst_registry.invalidate()
+        conversation_store.clear()
+        result_cache.invalidate()
+        ## call the db setup
+        await run_blocking(db_setup.do, sync_client, channel_id)
+
+        # Send a message with the input value
+        await client.chat_postMessage(
+            channel=channel_id,
+            text=f"""
+*Congratulations!!* Demo setup successful :tada:.
+
+Try this query in *Snowsight* to view the loaded data:
+```
+SELECT * FROM {db_name}.{schema_name}.SUPPORT_TICKETS;
+```""",
+        )
+        ## write to file for persistence
+        with __db_info_file.open(mode="w") as file:
+            logger.info(f"Saved db info to file {__db_info_file}")
+            json.dump(
+                {"db_name": db_name, "schema_name": schema_name},
+                file,
+                indent=2,
+            )
+    except Exception as e:
+        logger.error(f"Error handling db setup: {e}")
+        files = list(Path("src/templates").glob("*.yaml"))
+        for file_path in files:
+            file_path.unlink()
+            logger.info(f"Removed: {file_path}")
+        await client.chat_postMessage(
+            channel=channel_id,
+            text=f"Sorry, error setting up database.{e}",
+        )
+
+
+@app.command("/setup")
+async def setup_handler(ack, client, command, respond):
+    """
+    Handle setup command events from Slack, process the command, and send responses.
+
+    Args:
+        ack: Function to acknowledge receipt of the command to Slack
+        client: Slack client instance used to interact with the Slack API
+        command: Dictionary containing command data
+        respond: Function to send delayed responses to the command
+
+    Returns:
+        None
+    """
+    await ack()
+    command_text = command.get("text", "").strip()
+    logger.debug(f"command_text:{command_text}")
+    try:
+        if not command_text:
+            await respond(
+                blocks=blocks.db_schema_setup,
+                response_type="ephemeral",  # Only visible to the user who triggered the command
+            )
+            return
+        try:
+            db_name, schema_name = tuple(command_text.split())
+        except ValueError:
+            await respond(
+                text="Invalid format. Please provide both database name and schema name.",
+                response_type="ephemeral",
+            )
+            return
+        channel = command["channel_id"]
+        await run_once(
+            f"setup:{channel}:{db_name}.{schema_name}".lower(),
+            respond,
+            do_setup,
+            client,
+            channel,
+            logger,
+            db_name=db_name,
+            schema_name=schema_name,
+        )
+    except Exception as e:
+        logger.error(f"Setup error: {e}")
+        await respond(text=f"Error during setup: {str(e)}", response_type="ephemeral")
+
+
+@app.action("setup_db")
+async def action_setup_db(ack, body, client, respond, logger):
+    """
+    Handle Slack interactive component actions related to database setup.
+
+    Args:
+        ack: Function to acknowledge receipt of the action to Slack
+        body: Dictionary containing the action payload
+        client: Slack client instance for making API calls
+        respond: Function to send delayed responses to the original message
+        logger: Logger instance to track the setup process and any errors
+
+    Returns:
+        None
+    """
+    logger.debug(f"Received Message Event: {body}")
+    await ack()
+
+    values = body["state"]["values"]
+    channel = body["channel"]["id"]
+    db_name = values["db_name_input_block"]["db_name"]["value"]
+    schema_name = values["schema_name_input_block"]["schema_name"]["value"]
+    await run_once(
+        f"setup:{channel}:{db_name}.{schema_name}".lower(),
+        respond,
+        do_setup,
+        client,
+        channel,
+        logger,
+        db_name=db_name,
+        schema_name=schema_name,
+    )
+
+
+@app.command("/cleanup")
+async def cleanup_handler(ack, client, command, respond):
+    """
+    Handle cleanup of demo resources typically a Database.
+
+    Args:
+        ack: Function to acknowledge receipt of the command to Slack
+        client: Slack client instance used to interact with the Slack API
+        command: Dictionary containing command data
+        respond: Function to send delayed responses to the command
+
+    Returns:
+        None
+    """
+    logger.debug(f"Received Demo Cleanup Command: {command}")
+    await ack()
+    channel_id = command["channel_id"]
+    await client.chat_postMessage(
+        channel=channel_id,
+        text=f"Wait for few seconds for the cleanup to be done :hourglass_flowing_sand:",
+    )
+    db_name = command.get("text", "").strip()
+    try:
+        logger.debug(f"Dropping :command_text:{db_name}")
+        _count = await run_blocking(
+            lambda: snowpark_session.get().sql(f"DROP DATABASE {db_name}").count()
+        )
+        cortalyst_registry.invalidate()
+        conversation_store.clear()
+        result_cache.invalidate()
+        if _count > 0:
+            await client.chat_postMessage(
+                channel=channel_id,
+                text=f":white_check_mark: Database `{db_name}` dropped successfully.",
+            )
+        if __db_info_file.exists():
+            logger.info(f"Removing file {__db_info_file}")
+            __db_info_file.unlink(missing_ok=True)
+    except Exception as e:
+        logger.error(f"Failed to cleanup: {e}")
+        await respond(
+            text=f"Sorry, there was an error during cleanup of Database {db_name}.",
+            response_type="ephemeral",
+        )
+
+
+@app.command("/cortalyst")
+async def handle_cortalyst(ack, client: AsyncWebClient, say, command, respond, logger):
+    """
+    Handle Cortex Analyst(cortalyst) Slack commands and process requests.
+
+    Args:
+        ack: Function to acknowledge receipt of the command to Slack
+        client (AsyncWebClient): Slack client instance for making API calls
+        say: Function to send messages to the conversation
+        command: Dictionary containing command data
+        respond: Function to send delayed responses to the command
+        logger: Logger instance for tracking command execution and errors
+
+    Returns:
+        None
+    """
+    await ack()
+    logger.debug(f"Received Command 'cortalyst': {command}")
+    command_text = command.get("text", "").strip()
+    try:
+        if not command_text:
+            await respond(
+                blocks=blocks.cortex_question,
+                response_type="ephemeral",  # Only visible to the user who triggered the command
+            )
+            return
+        await run_once(
+            f"cortalyst:{command['channel_id']}:{command.get('user_id')}:"
+            f"{normalize_question(command_text)}",
+            respond,
+            ask_cortex_analyst,
+            command["channel_id"],
+            client,
+            say,
+            logger,
+            command_text,
+            user_id=command.get("user_id"),
+        )
+    except Exception as e:
+        logger.error(f"Cortalyst error: {e}")
+        await respond(
+            text=f"Error asking Cortex Analyst: {str(e)}",
+            response_type="ephemeral",
+        )
+
+
+@app.action("ask_cortex_analyst")
+async def action_ask_cortex_analyst(ack, body, client, respond, say, logger):
+    """
+    Handle interactive actions related to Cortex Analyst inquiries or requests.
+
+    Args:
+        ack: Function to acknowledge receipt of the action to Slack
+        body: Dictionary containing the action payload
+        client: Slack client instance for making API calls
+        respond: Function to send delayed responses to the original message
+        say: Function to send new messages to the conversation
+        logger: Logger instance for tracking action processing and errors
+
+    Returns:
+        None
+    """
+    await ack()
+    try:
+        logger.debug(f"Received Message Event: {body}")
+        question = body["state"]["values"]["analyst_question_block"]["question"][
+            "value"
+        ]
+        thread_ts = body.get("container", {}).get("thread_ts")
+        user_id = body.get("user", {}).get("id")
+        await run_once(
+            # clicks on the same question form
+            f"ask_cortex_analyst:{body['channel']['id']}:{user_id}:"
+            f"{body.get('container', {}).get('message_ts')}",
+            respond,
+            ask_cortex_analyst,
+            body["channel"]["id"],
+            client,
+            say,
+            logger,
+            question,
+            thread_ts,
+            user_id=user_id,
+        )
+    except Exception as e:
+        logger.error(f"Failed to send request to Cortex Analyst: {e}")
+        await respond(
+            text="Sorry, there was an error asking Cortex Analyst.",
+            response_type="ephemeral",
+        )
+
+
+@app.event("message")
+async def handle_follow_up(event, client, say, logger):
+    """
+    Answer the replies in the thread of a conversation as follow-up questions, other
+    messages are ignored.
+
+    Args:
+        event: Dictionary containing the message event
+        client: Slack client instance for making API calls
+        say: Function to send messages to the conversation
+        logger: Logger instance for tracking the question processing and errors
+
+    Returns:
+        None
+    """
+    question = follow_up(event, conversation_store)
+    if question is None:
+        return
+    channel_id, thread_ts, user_id = event["channel"], event["thread_ts"], event["user"]
+
+    async def _respond(text: str, response_type: Optional[str] = None):
+        await client.chat_postEphemeral(
+            channel=channel_id, user=user_id, thread_ts=thread_ts, text=text
+        )
+
+    try:
+        await run_once(
+            f"follow_up:{channel_id}:{thread_ts}:{user_id}:"
+            f"{normalize_question(question)}",
+            _respond,
+            ask_cortex_analyst,
+            channel_id,
+            client,
+            say,
+            logger,
+            question,
+            thread_ts,
+            user_id=user_id,
+        )
+    except Exception as e:
+        logger.error(f"Failed to answer the follow-up question: {e}")
+        await _respond(text="Sorry, there was an error asking Cortex Analyst.")
+
+
+async def ask_cortex_analyst(
+    channel_id: str,
+    client: AsyncWebClient,
+    say,
+    logger,
+    question: str,
+    thread_ts: Optional[str] = None,
+    user_id: Optional[str] = None,
+):
+    """
+    Send a question to the Cortex Analyst system and handle the response in a Slack thread.
+    A question asked outside a thread starts one, the answer and the replies asking
+    follow-up questions go into it. Earlier questions and answers of the thread are sent
+    along, so follow-up questions are answered in context.
+
+    Args:
+        channel_id (str): The ID of the Slack channel where the response should be posted
+        client (AsyncWebClient): Slack client instance for making API calls
+        say: Function to send messages to the conversation
+        logger: Logger instance for tracking the question processing and responses
+        question (str): The actual question or request to be processed by Cortex Analyst
+        thread_ts (str, optional): The Slack thread of the conversation, None starts one
+        user_id (str, optional): The Slack user who asked, tagged on the generated queries
+
+    Returns:
+        None
+    """
+    sanitized_question = " ".join(question.splitlines())
+    logger.debug(f"Question:{sanitized_question}")
+    logger.debug(f"Using DB:{db_setup.db_name},Schema:{db_setup.schema_name}")
+
+    if not thread_ts:
+        # the question starts the thread of its conversation
+        root = await client.chat_postMessage(
+            channel=channel_id, text=question_message(sanitized_question, user_id)
+        )
+        thread_ts = root["ts"]
+    say = in_thread(say, thread_ts)
+
+    await client.chat_postMessage(
+        channel=channel_id,
+        thread_ts=thread_ts,
+        text=f":hourglass_flowing_sand: Wait for a few seconds... while I ask the Cortex Analyst :robot_face:",
+    )
+
+    if os.getenv("PRIVATE_KEY_FILE_PATH") is None:
+        raise Exception(
+            f"Require PRIVATE_KEY_FILE_PATH to be set. Consult Snowflake documentation https://docs.snowflake.com/user-guide/key-pair-auth#configuring-key-pair-authentication."
+        )
+
+    session = await run_blocking(snowpark_session.get)
+    cortalyst: AsyncCortlayst = cortalyst_registry.get(
+        database=db_setup.db_name,
+        schema=db_setup.schema_name,
+        account=session.conf.get("account"),
+        user=session.conf.get("user"),
+        host=session.conf.get("host"),
+        private_key_file_path=os.getenv("PRIVATE_KEY_FILE_PATH"),
+    )
+
+    # prior turns of the conversation in this thread, none at the channel level
+    history = conversation_store.history(channel_id, thread_ts)
+    # paraphrased questions reuse the SQL generated earlier, follow-ups depend
+    # on the conversation and are always sent to Cortex Analyst
+    ans = (
+        None if history else semantic_cache.get(question, cortalyst.semantic_model_file)
+    )
+
+    async def _notify_queued(position: int):
+        await client.chat_postMessage(
+            channel=channel_id,
+            thread_ts=thread_ts,
+            text=f":traffic_light: Cortex Analyst is busy right now, you're #{position} in line.",
+        )
+
+    async def _answer():
+        # the process wide limiter is taken by every attempt of the client
+        _ans = await cortalyst.answer(
+            question, history=history, on_queued=_notify_queued
+        )
+        if not history:
+            semantic_cache.put(question, cortalyst.semantic_model_file, _ans)
+        return _ans
+
+    if ans is None:
+        ans = (
+            await _answer()
+            if history
+            else await cortalyst_calls.do(
+                (
+                    normalize_semantic_model_file(cortalyst.semantic_model_file),
+                    normalize_question(question),
+                ),
+                _answer,
+            )
+        )
+    content = ans["message"]["content"]
+    conversation_store.append(channel_id, thread_ts, question, content)
+
+    await show_response(
+        client,
+        channel_id,
+        content,
+        say,
+        guardrails.statement_params(channel_id, user_id, question),
+        thread_ts,
+    )
+
+
+def progress_fetch(
+    client: AsyncWebClient, say, statement_params: Optional[Dict[str, str]] = None
+) -> Callable[..., Any]:
+    """
+    A fetch function for `query_preview_async` and `query_result_async` running the query
+    as a `QueryJob` polled from the event loop, so no executor thread waits on the warehouse.
+    Once the query runs longer than QUERY_PROGRESS_AFTER seconds, a progress message with
+    its query ID, elapsed time and a Cancel button is posted and updated in place.
+    The first query is checked by the `scan_guard` before it runs.
+
+    Args:
+        client (AsyncWebClient): Slack client instance for making API calls
+        say: Function to send messages to the conversation
+        statement_params (Dict[str, str], optional): Parameters of the queries, see
+            `guardrails.statement_params`. Defaults to None.
+
+    Returns:
+        Callable[..., Awaitable[pa.Table]]: the fetch function
+    """
+
+    checked = []
+
+    async def _fetch(session, query: str, columns: Optional[List[str]] = None):
+        if not checked:
+            checked.append(query)
+            estimate = await run_blocking(
+                scan_guard.check, session, query, statement_params
+            )
+            if estimate is not None:
+                await say(
+                    text=guardrails.scan_warning(estimate, scan_guard.max_partitions)
+                )
+        job = await run_blocking(
+            QueryJob(session, query, columns, statement_params=statement_params).submit
+        )
+        message = {}
+
+        async def _update(state: str = "running"):
+            progress = blocks.query_progress_block(job.query_id, job.elapsed, state)
+            if not message:
+                response = await say(blocks=progress, text="Query progress")
+                message.update(channel=response["channel"], ts=response["ts"])
+            else:
+                await client.chat_update(
+                    channel=message["channel"],
+                    ts=message["ts"],
+                    blocks=progress,
+                    text="Query progress",
+                )
+
+        async def _progress(_job: QueryJob):
+            await _update()
+
+        state = "failed"
+        try:
+            table = await job.wait_async(run_blocking, on_progress=_progress)
+            state = "done"
+            return table
+        except QueryCancelledError:
+            state = "cancelled"
+            raise
+        finally:
+            if message:
+                try:
+                    await _update(state)
+                except Exception as e:
+                    logger.warning(f"Error updating the query progress, {e}")
+
+    return _fetch
+
+
+@app.action("cancel_query")
+async def action_cancel_query(ack, body, respond, logger):
+    """
+    Handle the Cancel button of a query progress message, aborting the warehouse query.
+
+    Args:
+        ack: Function to acknowledge the action request
+        body (dict): Request payload, the value of the action is the query ID
+        respond: Function to send a response message
+        logger: Logger instance for recording events
+
+    Returns:
+        None
+    """
+    await ack()
+    query_id = body["actions"][0]["value"]
+    if not await run_blocking(running_queries.cancel, query_id):
+        await respond(
+            text=f"Query `{query_id}` is not running anymore.",
+            response_type="ephemeral",
+            replace_original=False,
+        )
+
+
+def render_chart(table) -> bytes:
+    """
+    Render the pie chart of the query result, an Arrow table, as PNG.
+    """
+    # altair and its PNG rendering stack load on the first chart
+    import altair as alt
+
+    # altair reads the Arrow table through the dataframe interchange protocol
+    chart = (
+        alt.Chart(table).mark_arc().encode(theta="TICKET_COUNT", color="SERVICE_TYPE")
+    )
+    buffer = io.BytesIO()
+    chart.save(buffer, format="png")
+    return buffer.getvalue()
+
+
+async def show_response(
+    client: AsyncWebClient,
+    channel_id,
+    content: List[Dict[str, Any]],
+    say,
+    statement_params: Optional[Dict[str, str]] = None,
+    thread_ts: Optional[str] = None,
+):
+    """
+    Display Cortex Analyst's JSON response as formatted messages in a Slack channel.
+    The query and the chart rendering run on the Snowpark executor.
+
+    Args:
+        client (AsyncWebClient): Slack client instance for making API calls
+        channel_id: ID of the Slack channel where the analysis should be displayed
+        content (List[Dict[str, Any]]): The content items of the Cortex Analyst answer
+        say: Function to send messages to the conversation
+        statement_params (Dict[str, str], optional): Timeout and tag of the generated
+            queries, see `guardrails.statement_params`. Defaults to None.
+        thread_ts (str, optional): The Slack thread of the chart, `say` posts to the
+            thread already. Defaults to None.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: Any error during response formatting/display
+    """
+    try:
+        for item in content:
+            match item["type"]:
+                case "text":
+                    # Send the interpretation of the question
+                    await say(text=item["text"])
+                case "sql":
+                    # Send raw generated query for reference
+                    query = item["statement"]
+                    await say(
+                        blocks=blocks.create_sql_block(query),
+                        text="Generated SQL",
+                    )
+
+                    # Build and Display a preview of the Query Results
+                    logger.debug(f"Building query result")
+                    session = await run_blocking(snowpark_session.get)
+                    fetch = progress_fetch(client, say, statement_params)
+                    try:
+                        preview, total_rows = await query_preview_async(
+                            session,
+                            query,
+                            db_setup.db_name,
+                            db_setup.schema_name,
+                            fetch,
+                            run_blocking,
+                        )
+                    except QueryCancelledError:
+                        continue
+                    except QueryRefusedError as e:
+                        await say(text=f":no_entry: {e}, try narrowing the question.")
+                        continue
+                    await say(
+                        blocks=blocks.create_df_block(preview, total_rows=total_rows),
+                        text="Query Result",
+                    )
+
+                    # Visualization
+                    # only if the result has the columns of the graph, the whole result
+                    # is fetched for it
+                    if set(CHART_COLUMNS).issubset(preview.column_names):
+                        try:
+                            chart_data = await query_result_async(
+                                session,
+                                query,
+                                db_setup.db_name,
+                                db_setup.schema_name,
+                                preview,
+                                total_rows,
+                                fetch,
+                                run_blocking,
+                                CHART_COLUMNS,
+                            )
+                        except QueryCancelledError:
+                            continue
+                        image_bytes = await run_blocking(render_chart, chart_data)
+                        uploaded_file = await client.files_upload_v2(
+                            channel=channel_id,
+                            thread_ts=thread_ts,
+                            file=image_bytes,
+                            filename="chart.png",
+                            initial_comment="Generating chart...",
+                        )
+                        logger.info(f"Uploaded File:{uploaded_file}")
+                case _:
+                    pass
+    except Exception as e:
+        logger.error(f"Error sending response {e}", exc_info=True)
+        raise Exception(f"Error sending response {e}")
+
+
+# Error handler
+@app.error
+async def error_handler(error, body, logger):
+    """
+    Handle and log errors that occur during Slack app operations.
+
+    Args:
+        error: Exception object containing error details and traceback
+        body: Dictionary containing the context of the failed operation
+        logger: Logger instance for recording error details and context
+
+    Returns:
+        None
+    """
+    logger.error(f"Error: {error}")
+    logger.error(f"Request body: {body}")
+
+
+async def _with_envelope_id(client, request):
+    with_envelope_id(client, request)
+
+
+async def main():
+    try:
+        # fail before connecting to Slack rather than call the live Cortex Analyst
+        check_async_mode()
+    except RuntimeError as e:
+        logger.error(str(e))
+        sys.exit(1)
+    try:
+        handler = AsyncSocketModeHandler(app, os.environ["SLACK_APP_TOKEN"])
+        # the envelope ID identifies the deliveries without an event or trigger ID
+        handler.client.socket_mode_request_listeners.insert(0, _with_envelope_id)
+        await handler.connect_async()
+        try:
+            await run_blocking(snowpark_session.get)
+        except Exception:
+            sys.exit(1)
+        logger.info("Bolt app is running!")
+        await asyncio.sleep(float("inf"))
+    finally:
+        # release the pooled Cortex Analyst connections of the event loop
+        await close_async_transport()
+        snowpark_executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Start your app
+if __name__ == "__main__":
+    asyncio.run(main())
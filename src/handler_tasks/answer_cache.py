@@ -0,0 +1,146 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from log.logger import get_logger as _logger
+
+logger = _logger("answer_cache")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalize a question so that trivially different spellings of the same question match.
+
+    The question is case folded, runs of whitespace collapsed and trailing punctuation removed.
+
+    Args:
+        question (str): The question asked to Cortex Analyst
+
+    Returns:
+        str: the normalized question
+
+    Examples:
+    >>> normalize_question("  Breakdown of tickets\\n by Service Type? ")
+    "breakdown of tickets by service type"
+    """
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").casefold()
+
+
+def normalize_semantic_model_file(semantic_model_file: str) -> str:
+    """
+    Normalize the semantic model file path `@db.schema.stage/file`, unquoted Snowflake
+    identifiers are case insensitive.
+    """
+    return semantic_model_file.strip().casefold()
+
+
+class AnswerCache:
+    """
+    A thread safe exact-match cache of Cortex Analyst answers with TTL and LRU eviction.
+
+    The answers are keyed by the normalized question text and the semantic model file
+    that was used to answer it.
+
+    Methods:
+        get(question: str, semantic_model_file: str) -> Optional[Dict[str, Any]]:
+            Returns the cached answer, if it exists and has not expired.
+
+        put(question: str, semantic_model_file: str, answer: Dict[str, Any]) -> None:
+            Caches the answer, evicting the least recently used one when full.
+
+        invalidate(semantic_model_file: Optional[str] = None) -> None:
+            Drops the answers of the semantic model file or all the answers.
+    """
+
+    def __init__(self, max_size: int = 128, ttl: float = 3600):
+        """
+        Args:
+            max_size (int, optional): Maximum number of cached answers, 0 disables the cache. Defaults to 128.
+            ttl (float, optional): Number of seconds an answer is valid. Defaults to 3600.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[Tuple[str, str], Tuple[float, Dict[str, Any]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _key(self, question: str, semantic_model_file: str) -> Tuple[str, str]:
+        return (
+            normalize_semantic_model_file(semantic_model_file),
+            normalize_question(question),
+        )
+
+    def get(self, question: str, semantic_model_file: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached answer of the question.
+
+        Args:
+            question (str): The question asked to Cortex Analyst
+            semantic_model_file (str): The semantic model file, `@db.schema.stage/file`
+
+        Returns:
+            Optional[Dict[str, Any]]: the cached answer or None if it is not cached or expired
+        """
+        key = self._key(question, semantic_model_file)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, answer = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            logger.debug(f"Answer cache hit for {key}")
+            return answer
+
+    def put(
+        self, question: str, semantic_model_file: str, answer: Dict[str, Any]
+    ) -> None:
+        """
+        Caches the answer of the question.
+
+        Args:
+            question (str): The question asked to Cortex Analyst
+            semantic_model_file (str): The semantic model file, `@db.schema.stage/file`
+            answer (Dict[str, Any]): The Cortex Analyst answer
+        """
+        if self.max_size <= 0:
+            return
+        key = self._key(question, semantic_model_file)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, answer)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, semantic_model_file: Optional[str] = None) -> None:
+        """
+        Drops the cached answers.
+
+        Args:
+            semantic_model_file (str, optional): Drop only the answers of this semantic model file.
+                Defaults to None i.e. drop all.
+        """
+        with self._lock:
+            if semantic_model_file is None:
+                self._entries.clear()
+            else:
+                model_file = normalize_semantic_model_file(semantic_model_file)
+                for key in [k for k in self._entries if k[0] == model_file]:
+                    del self._entries[key]
+        logger.debug(f"Invalidated answer cache for {semantic_model_file or 'all'}")
+
+
+# process wide answer cache, configured via CORTEX_ANSWER_CACHE_SIZE and CORTEX_ANSWER_CACHE_TTL
+answer_cache = AnswerCache(
+    max_size=int(os.getenv("CORTEX_ANSWER_CACHE_SIZE", 128)),
+    ttl=float(os.getenv("CORTEX_ANSWER_CACHE_TTL", 3600)),
+)
@@ -0,0 +1,132 @@
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import aiohttp
+
+from handler_tasks.cortalyst import Cortlayst
+from handler_tasks.http_transport import get_async_transport
+from handler_tasks.resilience import CortexAnalystError
+
+
+class AsyncCortlayst(Cortlayst):
+    """
+    An asyncio version of Cortlayst to interact with Snowflake Cortex Analyst through REST API.
+
+    It sends the same payload and raises the same errors as Cortlayst, but the requests
+    are made using the `aiohttp` session shared by the running event loop, so many
+    questions can be in flight without blocking a thread per request.
+
+    Methods:
+        answer():
+            Coroutine that makes an API call to Cortex Analyst to perform data analysis.
+            Returns:
+                Response from Cortex Analyst containing analysis results
+    """
+
+    @property
+    def transport(self):
+        """
+        The `aiohttp.ClientSession` used to call Cortex Analyst, unless one was passed it is
+        the pooled session shared by the running event loop.
+        """
+        return self._transport if self._transport is not None else get_async_transport()
+
+    async def answer(
+        self,
+        question,
+        history: Optional[List[Dict[str, Any]]] = None,
+        deadline: Optional[float] = None,
+        on_queued: Optional[Callable[[int], Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Makes an API call to Cortex Analyst to perform data analysis.
+
+        The call can be cancelled like any other asyncio task, the in-flight request is
+        aborted and its connection released back to the pool.
+
+        Args:
+            question (str): The question to ask Cortex Analyst
+            history (List[Dict[str, Any]], optional): Prior messages of the conversation,
+                to answer a follow-up question. Defaults to None.
+            deadline (float, optional): Maximum number of seconds to wait for the answer including
+                the retries. Defaults to None i.e. the total timeout of the client.
+            on_queued (Callable[[int], Any], optional): Called, or awaited, with the position
+                in line when Cortex Analyst is busy. Defaults to None.
+
+        Returns:
+            Response containing analysis results from Cortex Analyst
+
+        Raises:
+            CircuitOpenError: If Cortex Analyst is failing and the circuit breaker is open
+            DeadlineExceededError: If the question could not be answered within the deadline
+            CortexAnalystError: If the request was not successful
+        """
+        self.LOGGER.debug(f"Answering question:{question}")
+        # follow-up answers depend on the conversation, they are never cached
+        cache = self.answer_cache if not history else None
+        if cache is not None:
+            cached = cache.get(question, self.semantic_model_file)
+            if cached is not None:
+                return cached
+
+        payload = self.build_payload(question, history)
+
+        # make sure no underscores are there in host of the URL
+        self.analyst_endpoint = self.sanitize_host_name(self.analyst_endpoint)
+
+        self.LOGGER.debug(f"Analyst Endpoint:{self.analyst_endpoint}")
+        self.LOGGER.debug(f"Request Payload:{payload}")
+
+        deadline_at = time.monotonic() + (
+            deadline if deadline is not None else self.timeouts.total
+        )
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            remaining = self.remaining_time(deadline_at)
+            try:
+                # signing a new JWT takes a few milliseconds, keep it off the event loop
+                headers = await asyncio.to_thread(self.build_headers)
+                # every attempt takes a token and a slot of the limiter
+                async with self.limiter.limit_async(
+                    on_queued if attempt == 0 else None
+                ), self.transport.post(
+                    url=f"{self.analyst_endpoint}",
+                    json=payload,
+                    headers=headers,
+                    timeout=aiohttp.ClientTimeout(
+                        connect=self.timeouts.connect,
+                        total=min(self.timeouts.read, remaining),
+                    ),
+                ) as resp:
+                    text = await resp.text()
+                ans = self.handle_response(
+                    resp.status,
+                    resp.headers.get("X-Snowflake-Request-Id"),
+                    text,
+                    resp.headers.get("Retry-After"),
+                )
+                self.breaker.record_success()
+                break
+            except CortexAnalystError as e:
+                delay = self.handle_failure(e, attempt, deadline_at)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                delay = self.handle_failure(
+                    CortexAnalystError(f"Failed request: {e!r}"), attempt, deadline_at
+                )
+            except Exception:
+                # e.g. the JWT can't be signed or the answer isn't JSON, the attempt
+                # must still be recorded or a half open circuit would wait for it
+                self.breaker.record_failure()
+                raise
+            except BaseException:
+                # cancelled, the outcome is unknown
+                self.breaker.record_cancelled()
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        if cache is not None:
+            cache.put(question, self.semantic_model_file, ans)
+        return ans
@@ -1,9 +1,7 @@
 # Standard library imports
-from typing import Any, Dict, List
-
-# Third-party imports
-import numpy as np
-import pandas as pd
+import math
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
 
 # Dict containing Slack Block Kit elements to prompt user for database and schema configuration:
 #   - Input blocks for database and schema names with default values
@@ -116,34 +114,50 @@ def create_sql_block(sql_query) -> List[Dict[str, Any]]:
     ]
 
 
-def create_df_block(df, title="Answer") -> List[Dict[str, Any]]:
+def create_df_block(
+    df, title="Answer", total_rows: Optional[int] = None
+) -> List[Dict[str, Any]]:
     """
-    Creates Slack block message components to display a pandas DataFrame as a markdown table.
+    Creates Slack block message components to display a query result as a markdown table.
+
+    Only the rows shown are converted to Python values, the rest of the result is not touched.
 
     Args:
-        df (pd.DataFrame): The DataFrame to be converted and displayed as a markdown table.
+        df (pa.Table | pa.RecordBatch | pd.DataFrame): The result to be displayed as a markdown table.
         title (str, optional): The title text to display above the table. Defaults to "Answer".
+        total_rows (int, optional): Number of rows of the result when it is a preview of it.
+            Defaults to the number of rows of the result.
 
     Returns:
-        List[Dict[str, Any]]: Slack block components containing the DataFrame formatted as a markdown table.
+        List[Dict[str, Any]]: Slack block components containing the result formatted as a markdown table.
     """
+    # pyarrow is loaded by the query result already, not at startup
+    import pyarrow as pa
+
+    if not isinstance(df, (pa.Table, pa.RecordBatch)):
+        total_rows = len(df) if total_rows is None else total_rows
+        df = pa.Table.from_pandas(df.head(10), preserve_index=False)
 
     # Function to format a single value properly for display
     def format_value(val):
-        if pd.isna(val):
+        if val is None or (isinstance(val, float) and math.isnan(val)):
             return "N/A"
-        elif isinstance(val, (float, np.floating)):
+        elif isinstance(val, float) or (
+            isinstance(val, Decimal) and val.as_tuple().exponent < 0
+        ):
             return f"{val:.2f}"
         return str(val)
 
     # Create markdown table header
-    headers = df.columns.tolist()
+    headers = df.column_names
     header_row = " | ".join([""] + headers + [""])
     separator_row = " | ".join([""] + ["-" * len(header) for header in headers] + [""])
 
     # Create table rows
     table_rows = []
-    for _, row in df.head(10).iterrows():  # Limiting to 10 rows for Slack readability
+    # Limiting to 10 rows for Slack readability
+    columns = [column.to_pylist() for column in df.slice(0, 10).columns]
+    for row in zip(*columns):
         formatted_row = [format_value(val) for val in row]
         table_rows.append(" | ".join([""] + formatted_row + [""]))
 
@@ -151,11 +165,11 @@ def create_df_block(df, title="Answer") -> List[Dict[str, Any]]:
     markdown_table = "\n".join([header_row, separator_row] + table_rows)
 
     # Create the full table display with summary
-    total_rows = len(df)
-    shown_rows = min(10, total_rows)
+    total_rows = df.num_rows if total_rows is None else total_rows
+    shown_rows = min(10, df.num_rows)
     summary_text = (
         f"Showing {shown_rows} of {total_rows} rows"
-        if total_rows > 10
+        if total_rows > shown_rows
         else f"Total rows: {total_rows}"
     )
     block = [
@@ -209,3 +223,40 @@ def visualization_block(
         },
     ]
     return block
+
+
+def query_progress_block(
+    query_id: str, elapsed: float, state: str = "running"
+) -> List[Dict[str, Any]]:
+    """
+    Creates the Slack block message showing the progress of a warehouse query, updated in
+    place while it runs. A running query has a Cancel button.
+
+    Args:
+        query_id (str): The Snowflake query ID
+        elapsed (float): Seconds since the query was submitted
+        state (str, optional): running, done, cancelled or failed. Defaults to "running".
+
+    Returns:
+        List[Dict[str, Any]]: Slack block components for the query progress.
+    """
+    text = {
+        "running": f":hourglass_flowing_sand: Running query `{query_id}` for {elapsed:.0f}s",
+        "done": f":white_check_mark: Query `{query_id}` finished in {elapsed:.1f}s",
+        "cancelled": f":octagonal_sign: Query `{query_id}` cancelled after {elapsed:.0f}s",
+        "failed": f":x: Query `{query_id}` failed after {elapsed:.0f}s",
+    }[state]
+    section: Dict[str, Any] = {
+        "type": "section",
+        "block_id": "query_progress_block",
+        "text": {"type": "mrkdwn", "text": text},
+    }
+    if state == "running":
+        section["accessory"] = {
+            "type": "button",
+            "text": {"type": "plain_text", "text": "Cancel"},
+            "style": "danger",
+            "action_id": "cancel_query",
+            "value": query_id,
+        }
+    return [section]
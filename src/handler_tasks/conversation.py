@@ -0,0 +1,250 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from log.logger import get_logger as _logger
+
+logger = _logger("conversation")
+
+Message = Dict[str, Any]
+
+# mentions of users or of the bot in a message
+_MENTION = re.compile(r"<@[A-Z0-9]+(?:\|[^>]*)?>")
+
+
+def _message_size(message: Message) -> int:
+    """
+    Approximate size of a message, the characters of its JSON form.
+    """
+    return len(json.dumps(message["content"]))
+
+
+class ConversationStore:
+    """
+    A thread safe, bounded store of Cortex Analyst conversations keyed by Slack channel and thread.
+
+    Every conversation is a list of alternating `user` and `analyst` messages in the format
+    of the Cortex Analyst message API. The least recently used conversations are evicted when
+    the store is full and idle conversations expire after the TTL. Optionally the store is
+    persisted as JSON so conversations survive restarts.
+
+    Only Slack threads hold a conversation. Questions asked at the channel level come from
+    any user of the channel, they are answered on their own and never share a history.
+
+    Methods:
+        history(channel_id: str, thread_ts: Optional[str]) -> List[Message]:
+            Returns the prior messages of the conversation truncated to the size budget.
+
+        append(channel_id: str, thread_ts: Optional[str], question: str, content: List[Dict[str, Any]]) -> None:
+            Adds a question and its answer to the conversation.
+
+        clear(channel_id: Optional[str] = None, thread_ts: Optional[str] = None) -> None:
+            Drops the conversation or all the conversations.
+    """
+
+    def __init__(
+        self,
+        max_conversations: int = 256,
+        ttl: float = 900,
+        max_chars: int = 8000,
+        path: Optional[Union[Path, str]] = None,
+    ):
+        """
+        Args:
+            max_conversations (int, optional): Maximum number of conversations, 0 disables the store. Defaults to 256.
+            ttl (float, optional): Seconds an idle conversation is kept. Defaults to 900.
+            max_chars (int, optional): Size budget of the history sent with a question. Defaults to 8000.
+            path (Path | str, optional): JSON file to persist the conversations. Defaults to None.
+        """
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_chars = max_chars
+        self.path = Path(path) if path is not None else None
+        # conversations are keyed by "channel_id/thread_ts" to be JSON friendly,
+        # the value is the wall clock time of the last update and the messages
+        self._conversations: OrderedDict[str, Tuple[float, List[Message]]] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._load()
+
+    def _key(self, channel_id: str, thread_ts: Optional[str]) -> str:
+        return f"{channel_id}/{thread_ts or ''}"
+
+    def _load(self) -> None:
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with self.path.open(mode="r") as file:
+                for key, (updated_at, messages) in json.load(file).items():
+                    self._conversations[key] = (updated_at, messages)
+            logger.debug(
+                f"Loaded {len(self._conversations)} conversation(s) from {self.path}"
+            )
+        except Exception as e:
+            logger.warning(f"Error loading conversations from {self.path}, {e}")
+
+    def _save(self) -> None:
+        if self.path is None:
+            return
+        try:
+            tmp_file = self.path.with_suffix(f"{self.path.suffix}.tmp")
+            with tmp_file.open(mode="w") as file:
+                json.dump(self._conversations, file)
+            os.replace(tmp_file, self.path)
+        except Exception as e:
+            logger.warning(f"Error saving conversations to {self.path}, {e}")
+
+    def _expire(self) -> None:
+        now = time.time()
+        for key in [
+            k for k, (t, _) in self._conversations.items() if t + self.ttl <= now
+        ]:
+            del self._conversations[key]
+
+    def history(self, channel_id: str, thread_ts: Optional[str]) -> List[Message]:
+        """
+        Returns the prior messages of the conversation, the oldest question and answer
+        pairs are dropped until the messages fit the size budget.
+
+        Args:
+            channel_id (str): Slack channel of the conversation
+            thread_ts (str, optional): Slack thread of the conversation, None at the channel level
+
+        Returns:
+            List[Message]: the messages to send before the new question, empty if there are none
+        """
+        if not thread_ts:
+            return []
+        with self._lock:
+            self._expire()
+            entry = self._conversations.get(self._key(channel_id, thread_ts))
+            if entry is None:
+                return []
+            messages = list(entry[1])
+
+        size = sum(_message_size(m) for m in messages)
+        while messages and size > self.max_chars:
+            # drop the oldest user and analyst messages together to keep them alternating
+            size -= sum(_message_size(m) for m in messages[:2])
+            messages = messages[2:]
+        return messages
+
+    def append(
+        self,
+        channel_id: str,
+        thread_ts: Optional[str],
+        question: str,
+        content: List[Dict[str, Any]],
+    ) -> None:
+        """
+        Adds the question and its answer to the conversation.
+
+        Args:
+            channel_id (str): Slack channel of the conversation
+            thread_ts (str, optional): Slack thread of the conversation, None at the channel level
+            question (str): The question asked to Cortex Analyst
+            content (List[Dict[str, Any]]): The content of the Cortex Analyst answer
+        """
+        if self.max_conversations <= 0 or not thread_ts:
+            return
+        key = self._key(channel_id, thread_ts)
+        with self._lock:
+            self._expire()
+            _, messages = self._conversations.pop(key, (None, []))
+            messages = messages + [
+                {"role": "user", "content": [{"type": "text", "text": question}]},
+                {"role": "analyst", "content": content},
+            ]
+            # never keep more than the budget allows to be sent
+            while (
+                len(messages) > 2
+                and sum(_message_size(m) for m in messages) > self.max_chars
+            ):
+                messages = messages[2:]
+            self._conversations[key] = (time.time(), messages)
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+            self._save()
+
+    def clear(
+        self, channel_id: Optional[str] = None, thread_ts: Optional[str] = None
+    ) -> None:
+        """
+        Drops the conversation of the channel and thread, or all the conversations.
+
+        Args:
+            channel_id (str, optional): Slack channel of the conversation. Defaults to None i.e. all.
+            thread_ts (str, optional): Slack thread of the conversation
+        """
+        with self._lock:
+            if channel_id is None:
+                self._conversations.clear()
+            else:
+                self._conversations.pop(self._key(channel_id, thread_ts), None)
+            self._save()
+
+
+# process wide conversation store, configured via CORTEX_CONVERSATION_SIZE,
+# CORTEX_CONVERSATION_TTL, CORTEX_CONVERSATION_MAX_CHARS and CORTEX_CONVERSATION_FILE
+conversation_store = ConversationStore(
+    max_conversations=int(os.getenv("CORTEX_CONVERSATION_SIZE", 256)),
+    ttl=float(os.getenv("CORTEX_CONVERSATION_TTL", 900)),
+    max_chars=int(os.getenv("CORTEX_CONVERSATION_MAX_CHARS", 8000)),
+    path=os.getenv("CORTEX_CONVERSATION_FILE"),
+)
+
+
+def follow_up(
+    event: Dict[str, Any], store: ConversationStore = conversation_store
+) -> Optional[str]:
+    """
+    The question of a message replying in the thread of a conversation, e.g. "and by
+    priority?" below an answer. Messages of bots, edits and replies in other threads
+    aren't questions.
+
+    Args:
+        event (Dict[str, Any]): The Slack message event
+        store (ConversationStore, optional): The conversations. Defaults to conversation_store.
+
+    Returns:
+        Optional[str]: the question without mentions, None if the message isn't a follow-up
+    """
+    thread_ts = event.get("thread_ts")
+    if (
+        not thread_ts
+        or thread_ts == event.get("ts")
+        or event.get("subtype")
+        or event.get("bot_id")
+    ):
+        return None
+    question = " ".join(_MENTION.sub("", event.get("text") or "").split())
+    if not question or not store.history(event.get("channel"), thread_ts):
+        return None
+    return question
+
+
+def question_message(question: str, user_id: Optional[str] = None) -> str:
+    """
+    The text of the message starting the thread of a question asked outside a thread.
+    """
+    if user_id:
+        return f":speech_balloon: <@{user_id}> asked: {question}"
+    return f":speech_balloon: {question}"
+
+
+def in_thread(say: Callable[..., Any], thread_ts: str) -> Callable[..., Any]:
+    """
+    Bind the `say` of a Slack request, sync or asyncio, to the thread of the conversation.
+    """
+
+    def _say(*args, **kwargs):
+        kwargs.setdefault("thread_ts", thread_ts)
+        return say(*args, **kwargs)
+
+    return _say
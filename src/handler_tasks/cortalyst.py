@@ -1,10 +1,37 @@
+import json
 import logging
 import os
 import re
-from typing import Any, Dict
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Type,
+)
 
 import requests
 
+from handler_tasks.answer_cache import AnswerCache, answer_cache
+from handler_tasks.http_transport import get_transport
+from handler_tasks.rate_limit import CortexLimiter, cortex_limiter
+from handler_tasks.resilience import (
+    CircuitBreaker,
+    CortexAnalystError,
+    DeadlineExceededError,
+    RetryPolicy,
+    Timeouts,
+    circuit_breaker,
+    default_retry_policy,
+    default_timeouts,
+    parse_retry_after,
+)
 from security.jwt_generator import JWTGenerator
 
 
@@ -41,6 +68,13 @@ class Cortlayst:
         schema: str = "data",
         stage: str = "semantic_models",
         file: str = "support_tickets_semantic_model.yaml",
+        transport=None,
+        answer_cache: Optional[AnswerCache] = None,
+        timeouts: Optional[Timeouts] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        base_url: Optional[str] = None,
+        limiter: Optional[CortexLimiter] = None,
     ):
         self.account = account
         self.user = user
@@ -53,7 +87,25 @@ class Cortlayst:
         self.schema = schema
         self.stage = stage
         self.file = file
-        self.analyst_endpoint = f"https://{host}/api/v2/cortex/analyst/message"
+        # CORTEX_ANALYST_BASE_URL points the client to another server e.g. a local mock
+        base_url = base_url or os.getenv("CORTEX_ANALYST_BASE_URL") or f"https://{host}"
+        self.analyst_endpoint = f"{base_url.rstrip('/')}/api/v2/cortex/analyst/message"
+        self._transport = transport
+        self.answer_cache = answer_cache
+        self.timeouts = timeouts if timeouts is not None else default_timeouts()
+        self.retry_policy = (
+            retry_policy if retry_policy is not None else default_retry_policy()
+        )
+        self.breaker = breaker if breaker is not None else circuit_breaker
+        self.limiter = limiter if limiter is not None else cortex_limiter
+
+    @property
+    def transport(self):
+        """
+        The HTTP transport used to call Cortex Analyst, unless one was passed it is
+        the pooled keep-alive transport shared by all the instances in the process.
+        """
+        return self._transport if self._transport is not None else get_transport()
 
     def get_token(self):
         """
@@ -98,48 +150,488 @@ class Cortlayst:
             return re.sub(pattern, replace_host, url)
         return url
 
-    def answer(self, question) -> Dict[str, Any]:
+    @property
+    def semantic_model_file(self) -> str:
         """
-        Makes an API call to Cortex Analyst to perform data analysis.
+        The staged semantic model file used to answer the questions.
 
         Returns:
-            Response containing analysis results from Cortex Analyst
+            str: semantic model file path of the form `@db.schema.stage/file`
         """
-        self.LOGGER.debug(f"Answering question:{question}")
-        jwt_token = self.get_token()
-        self.LOGGER.debug(f"Token:{jwt_token}")
-        payload = {
-            "messages": [
+        return f"@{self.database}.{self.schema}.{self.stage}/{self.file}"
+
+    def build_payload(
+        self, question, history: Optional[List[Dict[str, Any]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Builds the Cortex Analyst message request payload for the question.
+
+        Args:
+            question (str): The question to ask Cortex Analyst
+            history (List[Dict[str, Any]], optional): Prior `user` and `analyst` messages
+                of the conversation. Defaults to None.
+
+        Returns:
+            Dict[str, Any]: the request payload
+        """
+        return {
+            "messages": (history or [])
+            + [
                 {
                     "role": "user",
                     "content": [{"type": "text", "text": question}],
                 }
             ],
-            "semantic_model_file": f"@{self.database}.{self.schema}.{self.stage}/{self.file}",
+            "semantic_model_file": self.semantic_model_file,
         }
 
+    def build_headers(self) -> Dict[str, str]:
+        """
+        Builds the Cortex Analyst request headers with a valid JWT token.
+
+        Returns:
+            Dict[str, str]: the request headers
+        """
+        jwt_token = self.get_token()
+        self.LOGGER.debug(f"Token:{jwt_token}")
+        return {
+            "X-Snowflake-Authorization-Token-Type": "KEYPAIR_JWT",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "Authorization": f"Bearer {jwt_token}",
+        }
+
+    def handle_response(
+        self,
+        status_code: int,
+        request_id: str,
+        text: str,
+        retry_after: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Converts the Cortex Analyst HTTP response to the answer.
+
+        Args:
+            status_code (int): HTTP status code of the response
+            request_id (str): Value of the `X-Snowflake-Request-Id` response header
+            text (str): Response body
+            retry_after (str, optional): Value of the `Retry-After` response header
+
+        Returns:
+            Dict[str, Any]: the response JSON along with its `request_id`
+
+        Raises:
+            CortexAnalystError: If the request was not successful
+        """
+        if status_code == 200:
+            self.LOGGER.debug(f"Response:{text}")
+            return {**json.loads(text), "request_id": request_id}
+        else:
+            raise CortexAnalystError(
+                f"Failed request (id: {request_id}) with status {status_code}: {text}",
+                status_code=status_code,
+                request_id=request_id,
+                retry_after=parse_retry_after(retry_after),
+            )
+
+    def handle_failure(
+        self, error: CortexAnalystError, attempt: int, deadline: float
+    ) -> float:
+        """
+        Records the failed attempt with the circuit breaker and decides whether to retry.
+
+        Args:
+            error (CortexAnalystError): The error of the failed attempt
+            attempt (int): The zero based number of the failed attempt
+            deadline (float): `time.monotonic()` by which the question must be answered
+
+        Returns:
+            float: seconds to wait before the next attempt
+
+        Raises:
+            CortexAnalystError: If the request must not or can not be retried
+        """
+        if self.retry_policy.is_retryable(error.status_code):
+            self.breaker.record_failure()
+        else:
+            # the endpoint is healthy, the request itself is bad
+            self.breaker.record_success()
+            raise error
+
+        if attempt >= self.retry_policy.max_retries:
+            raise error
+
+        delay = self.retry_policy.backoff(attempt, error.retry_after)
+        if time.monotonic() + delay >= deadline:
+            raise DeadlineExceededError(
+                f"No answer within {self.timeouts.total} seconds, last error: {error}",
+                status_code=error.status_code,
+                request_id=error.request_id,
+            ) from error
+
+        self.LOGGER.warning(
+            f"Retrying Cortex Analyst request in {delay:.2f} seconds, attempt {attempt + 1} failed: {error}"
+        )
+        return delay
+
+    def remaining_time(self, deadline: float) -> float:
+        """
+        Seconds left to answer the question.
+
+        Raises:
+            DeadlineExceededError: If the deadline has passed
+        """
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError(
+                f"No answer within {self.timeouts.total} seconds"
+            )
+        return remaining
+
+    def send(
+        self,
+        payload: Dict[str, Any],
+        stream: bool = False,
+        on_queued: Optional[Callable[[int], None]] = None,
+    ):
+        """
+        Sends the request payload to Cortex Analyst.
+
+        Timeouts, 429 and 5xx responses are retried with jittered exponential backoff
+        honouring `Retry-After`, within the total deadline of the question. Every attempt
+        takes a token and a slot of the limiter, the slot is released once the response
+        is received, i.e. before a streamed body is read.
+
+        Args:
+            payload (Dict[str, Any]): The request payload
+            stream (bool, optional): Stream the response body. Defaults to False.
+            on_queued (Callable[[int], None], optional): Called with the position in line
+                when the limiter makes the first attempt wait. Defaults to None.
+
+        Returns:
+            The successful HTTP response
+
+        Raises:
+            CircuitOpenError: If Cortex Analyst is failing and the circuit breaker is open
+            DeadlineExceededError: If the question could not be answered within the deadline
+            CortexAnalystError: If the request was not successful
+        """
         # make sure no underscores are there in host of the URL
         self.analyst_endpoint = self.sanitize_host_name(self.analyst_endpoint)
 
         self.LOGGER.debug(f"Analyst Endpoint:{self.analyst_endpoint}")
         self.LOGGER.debug(f"Request Payload:{payload}")
 
-        resp = requests.post(
-            url=f"{self.analyst_endpoint}",
-            json=payload,
-            headers={
-                "X-Snowflake-Authorization-Token-Type": "KEYPAIR_JWT",
-                "Content-Type": "application/json",
-                "Accept": "application/json",
-                "Authorization": f"Bearer {jwt_token}",
-            },
+        deadline = time.monotonic() + self.timeouts.total
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            remaining = self.remaining_time(deadline)
+            try:
+                with self.limiter.limit(on_queued=on_queued if attempt == 0 else None):
+                    resp = self.transport.post(
+                        url=f"{self.analyst_endpoint}",
+                        json=payload,
+                        headers=self.build_headers(),
+                        timeout=(
+                            self.timeouts.connect,
+                            min(self.timeouts.read, remaining),
+                        ),
+                        stream=stream,
+                    )
+                if resp.status_code != 200:
+                    self.handle_response(
+                        resp.status_code,
+                        resp.headers.get("X-Snowflake-Request-Id"),
+                        resp.text,
+                        resp.headers.get("Retry-After"),
+                    )
+                self.breaker.record_success()
+                return resp
+            except CortexAnalystError as e:
+                delay = self.handle_failure(e, attempt, deadline)
+            except requests.RequestException as e:
+                delay = self.handle_failure(
+                    CortexAnalystError(f"Failed request: {e}"), attempt, deadline
+                )
+            except Exception:
+                # e.g. the JWT can't be signed, the attempt must still be recorded
+                # or a half open circuit would wait for it
+                self.breaker.record_failure()
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+    def answer(
+        self,
+        question,
+        history: Optional[List[Dict[str, Any]]] = None,
+        on_queued: Optional[Callable[[int], None]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Makes an API call to Cortex Analyst to perform data analysis.
+
+        Args:
+            question (str): The question to ask Cortex Analyst
+            history (List[Dict[str, Any]], optional): Prior messages of the conversation,
+                to answer a follow-up question. Defaults to None.
+            on_queued (Callable[[int], None], optional): Called with the position in line
+                when Cortex Analyst is busy. Defaults to None.
+
+        Returns:
+            Response containing analysis results from Cortex Analyst
+
+        Raises:
+            CircuitOpenError: If Cortex Analyst is failing and the circuit breaker is open
+            DeadlineExceededError: If the question could not be answered within the deadline
+            CortexAnalystError: If the request was not successful
+        """
+        self.LOGGER.debug(f"Answering question:{question}")
+        # follow-up answers depend on the conversation, they are never cached
+        cache = self.answer_cache if not history else None
+        if cache is not None:
+            cached = cache.get(question, self.semantic_model_file)
+            if cached is not None:
+                return cached
+
+        resp = self.send(self.build_payload(question, history), on_queued=on_queued)
+        ans = self.handle_response(
+            resp.status_code,
+            resp.headers.get("X-Snowflake-Request-Id"),
+            resp.text,
         )
+        if cache is not None:
+            cache.put(question, self.semantic_model_file, ans)
+        return ans
+
+    def answer_stream(
+        self,
+        question,
+        history: Optional[List[Dict[str, Any]]] = None,
+        on_queued: Optional[Callable[[int], None]] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Makes a streaming API call to Cortex Analyst, yielding every content item of the
+        answer (`text`, `sql`, `suggestions`) as soon as it has been completely received.
+
+        Args:
+            question (str): The question to ask Cortex Analyst
+            history (List[Dict[str, Any]], optional): Prior messages of the conversation,
+                to answer a follow-up question. Defaults to None.
+            on_queued (Callable[[int], None], optional): Called with the position in line
+                when Cortex Analyst is busy. Defaults to None.
+
+        Returns:
+            Iterator[Dict[str, Any]]: the content items of the answer
 
+        Raises:
+            CircuitOpenError: If Cortex Analyst is failing and the circuit breaker is open
+            DeadlineExceededError: If the question could not be answered within the deadline
+            CortexAnalystError: If the request or the stream was not successful
+        """
+        self.LOGGER.debug(f"Streaming answer to question:{question}")
+        # follow-up answers depend on the conversation, they are never cached
+        cache = self.answer_cache if not history else None
+        if cache is not None:
+            cached = cache.get(question, self.semantic_model_file)
+            if cached is not None:
+                yield from cached["message"]["content"]
+                return
+
+        resp = self.send(
+            {**self.build_payload(question, history), "stream": True},
+            stream=True,
+            on_queued=on_queued,
+        )
         request_id = resp.headers.get("X-Snowflake-Request-Id")
-        if resp.status_code == 200:
-            self.LOGGER.debug(f"Response:{resp.text}")
-            return {**resp.json(), "request_id": request_id}
-        else:
-            raise Exception(
-                f"Failed request (id: {request_id}) with status {resp.status_code}: {resp.text}"
+        content: List[Dict[str, Any]] = []
+        try:
+            for item in iter_content_items(iter_sse_events(resp.iter_lines())):
+                content.append(item)
+                yield item
+        except CortexAnalystError as e:
+            e.request_id = e.request_id or request_id
+            raise
+        except requests.RequestException as e:
+            raise CortexAnalystError(
+                f"Failed streaming response (id: {request_id}): {e}",
+                request_id=request_id,
             )
+        finally:
+            resp.close()
+
+        if cache is not None:
+            cache.put(
+                question,
+                self.semantic_model_file,
+                {
+                    "message": {"role": "analyst", "content": content},
+                    "request_id": request_id,
+                },
+            )
+
+
+def iter_sse_events(lines: Iterable) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Parses the server-sent events of a streaming Cortex Analyst response.
+
+    Args:
+        lines (Iterable): The lines (str or bytes) of the response body
+
+    Returns:
+        Iterator[Tuple[str, Dict[str, Any]]]: the event name and its JSON data
+    """
+    event, data = "message", []
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:") :].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:") :].strip())
+    if data:
+        yield event, json.loads("\n".join(data))
+
+
+def iter_content_items(
+    events: Iterable[Tuple[str, Dict[str, Any]]],
+) -> Iterator[Dict[str, Any]]:
+    """
+    Assembles the `message.content.delta` events into content items, an item is yielded
+    as soon as the next item starts or the stream is done.
+
+    Args:
+        events (Iterable[Tuple[str, Dict[str, Any]]]): The server-sent events
+
+    Returns:
+        Iterator[Dict[str, Any]]: the completed content items
+
+    Raises:
+        CortexAnalystError: If the stream reports an error
+    """
+    item: Optional[Dict[str, Any]] = None
+    index = None
+    for event, data in events:
+        match event:
+            case "message.content.delta":
+                if data["index"] != index:
+                    if item is not None:
+                        yield item
+                    index = data["index"]
+                    item = {"type": data["type"]}
+                match data["type"]:
+                    case "text":
+                        item["text"] = item.get("text", "") + data["text_delta"]
+                    case "sql":
+                        item["statement"] = (
+                            item.get("statement", "") + data["statement_delta"]
+                        )
+                        if "confidence" in data:
+                            item["confidence"] = data["confidence"]
+                    case "suggestions":
+                        delta = data["suggestions_delta"]
+                        suggestions = item.setdefault("suggestions", [])
+                        while len(suggestions) <= delta["index"]:
+                            suggestions.append("")
+                        suggestions[delta["index"]] += delta["suggestion_delta"]
+            case "error":
+                raise CortexAnalystError(
+                    f"Failed request (id: {data.get('request_id')}): {data.get('message')}",
+                    request_id=data.get("request_id"),
+                )
+            case "done":
+                break
+            case _:
+                pass
+    if item is not None:
+        yield item
+
+
+class CortlaystRegistry:
+    """
+    A process wide registry of warm Cortlayst clients.
+
+    Building a Cortlayst loads and parses the private key and starts with an empty
+    JWT cache, the registry hands back the same client for the same account, user,
+    host and semantic model so that work is done only once per process.
+
+    Methods:
+        get():
+            Returns the cached Cortlayst for the given arguments, creating it if needed.
+
+        invalidate():
+            Drops all the cached clients e.g. when database or schema changes.
+    """
+
+    LOGGER = logging.getLogger(__name__)
+    LOGGER.setLevel(os.getenv("APP_LOG_LEVEL", logging.WARNING))
+
+    def __init__(self, client_class: Optional[Type[Cortlayst]] = None):
+        """
+        Args:
+            client_class (Type[Cortlayst], optional): The class of the clients e.g. AsyncCortlayst.
+                Defaults to Cortlayst.
+        """
+        self.client_class = client_class or Cortlayst
+        self._clients: Dict[Tuple[str, ...], Cortlayst] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        account: str,
+        user: str,
+        private_key_file_path: str,
+        host: str,
+        database: str = "slack_demo",
+        schema: str = "data",
+        stage: str = "semantic_models",
+        file: str = "support_tickets_semantic_model.yaml",
+    ) -> Cortlayst:
+        """
+        Returns a warm Cortlayst client keyed by account, user, host, database, schema, stage and file.
+
+        Args:
+            account (str): Snowflake account identifier
+            user (str): Snowflake user
+            private_key_file_path (str): Path to the private key used to sign the JWT
+            host (str): Snowflake host
+            database (str, optional): Database of the semantic model stage. Defaults to "slack_demo".
+            schema (str, optional): Schema of the semantic model stage. Defaults to "data".
+            stage (str, optional): Stage of the semantic model. Defaults to "semantic_models".
+            file (str, optional): Semantic model file. Defaults to "support_tickets_semantic_model.yaml".
+
+        Returns:
+            Cortlayst: the cached or newly created client
+        """
+        key = (account, user, host, database, schema, stage, file)
+        cortalyst = self._clients.get(key)
+        if cortalyst is None:
+            with self._lock:
+                cortalyst = self._clients.get(key)
+                if cortalyst is None:
+                    self.LOGGER.debug(f"Creating Cortlayst client for {key}")
+                    cortalyst = self.client_class(
+                        account=account,
+                        user=user,
+                        private_key_file_path=private_key_file_path,
+                        host=host,
+                        database=database,
+                        schema=schema,
+                        stage=stage,
+                        file=file,
+                        answer_cache=answer_cache,
+                    )
+                    self._clients[key] = cortalyst
+        return cortalyst
+
+    def invalidate(self) -> None:
+        """
+        Drops all the cached Cortlayst clients.
+        """
+        with self._lock:
+            self.LOGGER.debug(f"Invalidating {len(self._clients)} Cortlayst client(s)")
+            self._clients.clear()
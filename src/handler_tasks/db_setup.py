@@ -1,18 +1,20 @@
 import logging
 import os
 from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING
 
 from jinja2 import Environment, FileSystemLoader
-from snowflake.core import CreateMode, Root
-from snowflake.core.database import Database
-from snowflake.core.pipe import Pipe
-from snowflake.core.schema import Schema
-from snowflake.core.stage import Stage, StageDirectoryTable, StageEncryption
-from snowflake.core.table import Table, TableColumn
-from snowflake.core.warehouse import Warehouse
 
 from slack_sdk import WebClient
 
+# snowflake.core takes seconds to import, it is only imported once the setup runs
+if TYPE_CHECKING:
+    from snowflake.core import Root
+    from snowflake.core.database import Database
+
+from handler_tasks.answer_cache import answer_cache
+from handler_tasks.semantic_cache import semantic_cache
+
 
 class DBSetup:
     """
@@ -41,7 +43,6 @@ class DBSetup:
 
     LOGGER = logging.getLogger(__name__)
     LOGGER.setLevel(logging.DEBUG)
-    _mode = CreateMode.if_not_exists
 
     def __init__(
         self,
@@ -52,14 +53,38 @@ class DBSetup:
         semantic_model_file: str = "support_tickets_semantic_model.yaml",
         warehouse_name: str = "compute_wh",
     ):
-        self.session = session
-        self.root = Root(session)
+        self._session = session
+        self._root = None
         self._db_name = db_name
         self._schema_name = schema_name
         self._warehouse_name = warehouse_name
         self._semantic_models_stage = semantic_models_stage
         self._semantic_model_file = semantic_model_file
 
+    @property
+    def session(self):
+        """
+        The Snowpark session, a callable returning it is called on first use,
+        e.g. to wait for a session opened in the background.
+        """
+        if callable(self._session):
+            self._session = self._session()
+        return self._session
+
+    @property
+    def root(self) -> "Root":
+        if self._root is None:
+            from snowflake.core import Root
+
+            self._root = Root(self.session)
+        return self._root
+
+    @property
+    def _mode(self):
+        from snowflake.core import CreateMode
+
+        return CreateMode.if_not_exists
+
     @property
     def db_name(self):
         return self._db_name
@@ -107,6 +132,8 @@ class DBSetup:
         Raises:
             Exception: for any errors
         """
+        from snowflake.core.warehouse import Warehouse
+
         self.LOGGER.debug(f"Creating Warehouse {self.warehouse_name}")
         wh = Warehouse(name=self.warehouse_name, comment="created by slack bot setup")
         try:
@@ -125,6 +152,7 @@ class DBSetup:
         Raises:
             Exception: for any errors
         """
+        from snowflake.core.database import Database
 
         self.LOGGER.debug(f"Creating database {db_name}")
         database = Database(db_name, comment="created by slack bot setup")
@@ -134,7 +162,7 @@ class DBSetup:
             self.LOGGER.error(e)
             raise f"Error creating database {db_name},{e}"
 
-    def create_schema(self, schema_name: str, db_name: Database) -> None:
+    def create_schema(self, schema_name: str, db_name: "Database") -> None:
         """
         Create the Schema for the demo.
 
@@ -145,6 +173,8 @@ class DBSetup:
         Raises:
             Exception: for any errors
         """
+        from snowflake.core.schema import Schema
+
         self.LOGGER.debug(f"Creating Schema {schema_name}")
         schema = Schema(schema_name, comment="created by slack bot setup")
         try:
@@ -205,6 +235,8 @@ COMMENT = 'created by slack bot setup';
         Raises:
             Exception: for any errors
         """
+        from snowflake.core.stage import Stage, StageDirectoryTable, StageEncryption
+
         try:
             stages = [
                 Stage(
@@ -277,6 +309,10 @@ COMMENT = 'created by slack bot setup';
                 auto_compress=False,
                 overwrite=True,
             )
+            # answers of the previously uploaded semantic model are stale now
+            _model_file_path = f"@{db_name}.{schema_name}.{self.semantic_models_stage}/{self.semantic_model_file}"
+            answer_cache.invalidate(_model_file_path)
+            semantic_cache.invalidate(_model_file_path)
         except Exception as e:
             self.LOGGER.error(e, exc_info=True)
             raise Exception(f"Error creating stages,{e}")
@@ -298,6 +334,8 @@ COMMENT = 'created by slack bot setup';
         Raises:
             Exception: for any errors
         """
+        from snowflake.core.table import Table, TableColumn
+
         try:
             table_columns = [
                 TableColumn(
@@ -402,6 +440,8 @@ COMMENT = 'created by slack bot setup';
             - The pipe will automatically handle file loading once created
             - Ensure the stage and file format are properly configured before creating the pipe
         """
+        from snowflake.core.pipe import Pipe
+
         try:
             self.LOGGER.debug("Pipe and Load")
 
@@ -0,0 +1,397 @@
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from log.logger import get_logger as _logger
+
+logger = _logger("dispatcher")
+
+
+class JobRejectedError(Exception):
+    """
+    Raised when a job is submitted while the job queue is full.
+    """
+
+
+class LatencyStats:
+    """
+    Thread safe latency statistics of the most recent jobs, per job name.
+
+    Methods:
+        record(name: str, waited: float, ran: float, failed: bool = False) -> None:
+            Records the seconds a job waited in the queue and ran.
+
+        summary() -> Dict[str, Dict[str, float]]:
+            Count, errors and the p50, p95 and max total latency of every job name.
+    """
+
+    def __init__(self, window: int = 512):
+        """
+        Args:
+            window (int, optional): Number of recent jobs kept per job name. Defaults to 512.
+        """
+        self.window = window
+        self._latencies: Dict[str, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=self.window)
+        )
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, name: str, waited: float, ran: float, failed: bool = False):
+        with self._lock:
+            self._latencies[name].append(waited + ran)
+            self._counts[name] += 1
+            if failed:
+                self._errors[name] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            latencies = {name: sorted(l) for name, l in self._latencies.items()}
+            counts, errors = dict(self._counts), dict(self._errors)
+        return {
+            name: {
+                "count": counts[name],
+                "errors": errors.get(name, 0),
+                "p50": l[int(0.5 * (len(l) - 1))],
+                "p95": l[int(0.95 * (len(l) - 1))],
+                "max": l[-1],
+            }
+            for name, l in latencies.items()
+            if l
+        }
+
+
+def parse_weights(value: Optional[str]) -> Dict[str, int]:
+    """
+    Parse the weights of the scheduling keys, e.g. `C0123=3,C0456=2`.
+
+    Args:
+        value (str): Comma separated `key=weight` pairs
+
+    Returns:
+        Dict[str, int]: the weight of every key
+    """
+    weights = {}
+    for pair in (value or "").split(","):
+        key, _, weight = pair.partition("=")
+        if key.strip() and weight.strip():
+            weights[key.strip()] = max(1, int(weight))
+    return weights
+
+
+class FairQueue:
+    """
+    A thread safe job queue per scheduling key (e.g. Slack channel), served with weighted
+    round robin so one busy key can't starve the others.
+
+    Keys take turns, a key is served up to its weight jobs in a row before the next key's turn.
+    A key already running `max_running_per_key` jobs is skipped until one of them is done.
+
+    Methods:
+        put(key: Hashable, job: Any) -> int:
+            Queues the job, returns its position in the queue of its key.
+
+        get() -> Optional[Tuple[Hashable, Any]]:
+            Waits for the next job that may run, None once the queue is closed.
+
+        done(key: Hashable) -> None:
+            Records that a job of the key finished running.
+
+        can_run(key: Hashable) -> bool:
+            Whether the key runs less than `max_running_per_key` jobs.
+
+        queued(key: Hashable) -> int:
+            The number of queued jobs of the key.
+
+        close() -> List[Any]:
+            Wakes up the waiting workers and returns the jobs left in the queue.
+    """
+
+    def __init__(
+        self,
+        weights: Optional[Dict[Hashable, int]] = None,
+        max_running_per_key: int = 0,
+    ):
+        """
+        Args:
+            weights (Dict[Hashable, int], optional): Weight of the keys, the others have a weight of 1.
+            max_running_per_key (int, optional): Maximum jobs running per key, 0 disables the limit. Defaults to 0.
+        """
+        self.weights = weights or {}
+        self.max_running_per_key = max_running_per_key
+        # keys with queued jobs, in their turn order
+        self._queues: OrderedDict[Hashable, Deque[Any]] = OrderedDict()
+        self._running: Dict[Hashable, int] = defaultdict(int)
+        # jobs served to the key at the head of the turn order in its current turn
+        self._served = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def __len__(self) -> int:
+        return sum(len(q) for q in self._queues.values())
+
+    def can_run(self, key: Hashable) -> bool:
+        return (
+            self.max_running_per_key <= 0
+            or self._running.get(key, 0) < self.max_running_per_key
+        )
+
+    def queued(self, key: Hashable) -> int:
+        return len(self._queues.get(key, ()))
+
+    def put(self, key: Hashable, job: Any) -> int:
+        with self._cond:
+            queue = self._queues.setdefault(key, deque())
+            queue.append(job)
+            self._cond.notify()
+            return len(queue)
+
+    def _next(self) -> Optional[Tuple[Hashable, Any]]:
+        for key, queue in self._queues.items():
+            if not self.can_run(key):
+                continue
+            if key != next(iter(self._queues)):
+                # the keys ahead can't run, this one takes the turn
+                self._queues.move_to_end(key, last=False)
+                self._served = 0
+            job = queue.popleft()
+            self._running[key] += 1
+            self._served += 1
+            if not queue:
+                del self._queues[key]
+                self._served = 0
+            elif self._served >= self.weights.get(key, 1):
+                self._queues.move_to_end(key)
+                self._served = 0
+            return key, job
+        return None
+
+    def get(self) -> Optional[Tuple[Hashable, Any]]:
+        with self._cond:
+            while not self._closed:
+                entry = self._next()
+                if entry is not None:
+                    return entry
+                self._cond.wait()
+            return None
+
+    def done(self, key: Hashable) -> None:
+        with self._cond:
+            self._running[key] -= 1
+            if self._running[key] <= 0:
+                del self._running[key]
+            # a job of the key may have been waiting for it
+            self._cond.notify_all()
+
+    def close(self) -> List[Any]:
+        with self._cond:
+            self._closed = True
+            jobs = [job for queue in self._queues.values() for job in queue]
+            self._queues.clear()
+            self._cond.notify_all()
+            return jobs
+
+    def stats(self) -> Dict[Hashable, Dict[str, int]]:
+        """
+        The number of queued and running jobs of every key.
+        """
+        with self._cond:
+            return {
+                key: {
+                    "queued": len(self._queues.get(key, ())),
+                    "running": self._running.get(key, 0),
+                }
+                for key in set(self._queues) | set(self._running)
+            }
+
+
+class JobDispatcher:
+    """
+    Runs long running Slack handler jobs (Cortex Analyst calls, queries, charts, uploads)
+    on a bounded pool of worker threads, so the Socket Mode listener only acknowledges
+    the requests and stays responsive under bursts.
+
+    Jobs are queued per scheduling key, typically the Slack channel, and the workers serve
+    the keys with weighted round robin, so every channel sees predictable latency even when
+    one of them floods the bot. A job submitted while the queue is full is rejected.
+
+    Methods:
+        submit(name: str, fn: Callable, *args, key: Hashable = "", on_queued: Optional[Callable[[int], None]] = None, **kwargs) -> Future:
+            Queues the job of the key, `on_queued` is called with its position in the line of
+            the key when it can't run right away. Raises JobRejectedError if the queue is full.
+
+        stats() -> Dict[str, Any]:
+            The number of running and queued jobs, per key, and the latency statistics.
+
+        shutdown(wait: bool = True) -> None:
+            Cancels the queued jobs and stops the workers.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_queue: int = 32,
+        max_queue_per_key: int = 0,
+        max_running_per_key: int = 0,
+        weights: Optional[Dict[Hashable, int]] = None,
+    ):
+        """
+        Args:
+            max_workers (int, optional): Number of worker threads. Defaults to 4.
+            max_queue (int, optional): Maximum number of jobs waiting for a worker. Defaults to 32.
+            max_queue_per_key (int, optional): Maximum number of jobs of a key waiting, 0 disables the limit. Defaults to 0.
+            max_running_per_key (int, optional): Maximum number of jobs of a key running, 0 disables the limit. Defaults to 0.
+            weights (Dict[Hashable, int], optional): Jobs served per turn of the keys, defaults to 1.
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self.max_queue_per_key = max(0, max_queue_per_key)
+        self.latency = LatencyStats()
+        self._queue = FairQueue(
+            weights=weights, max_running_per_key=max_running_per_key
+        )
+        # submitted jobs not done yet, in total and per key
+        self._pending = 0
+        self._pending_per_key: Dict[Hashable, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"job_{i}", daemon=True)
+            for i in range(self.max_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    @property
+    def running(self) -> int:
+        return self._pending - len(self._queue)
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _release(self, key: Hashable):
+        with self._lock:
+            self._pending -= 1
+            self._pending_per_key[key] -= 1
+            if self._pending_per_key[key] <= 0:
+                del self._pending_per_key[key]
+
+    def _work(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            key, (_, _, run) = entry
+            try:
+                run()
+            finally:
+                self._queue.done(key)
+
+    def submit(
+        self,
+        name: str,
+        fn: Callable[..., Any],
+        *args,
+        key: Hashable = "",
+        on_queued: Optional[Callable[[int], None]] = None,
+        **kwargs,
+    ) -> Future:
+        # number of jobs the key may run at once
+        slots = min(
+            self._queue.max_running_per_key or self.max_workers, self.max_workers
+        )
+        with self._lock:
+            waiting = max(0, self._pending - self.max_workers)
+            waiting_for_key = max(0, self._pending_per_key.get(key, 0) - slots)
+            if waiting >= self.max_queue or (
+                self.max_queue_per_key and waiting_for_key >= self.max_queue_per_key
+            ):
+                logger.warning(f"Rejected job {name} of {key}, {waiting} job(s) queued")
+                raise JobRejectedError(f"Too many jobs queued, rejected {name}")
+            # the job waits if the workers are all busy or its key can't run more jobs
+            pending_for_key = self._pending_per_key.get(key, 0)
+            waits = self._pending >= self.max_workers or pending_for_key >= slots
+            self._pending += 1
+            self._pending_per_key[key] += 1
+
+        future = Future()
+        submitted_at = time.monotonic()
+
+        def run():
+            if not future.set_running_or_notify_cancel():
+                self._release(key)
+                return
+            started_at = time.monotonic()
+            failed = False
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                logger.error(f"Job {name} failed, {e}", exc_info=True)
+                future.set_exception(e)
+            finally:
+                self._release(key)
+                waited, ran = started_at - submitted_at, time.monotonic() - started_at
+                self.latency.record(name, waited, ran, failed)
+                logger.debug(
+                    f"Job {name} of {key} waited {waited:.3f}s and ran {ran:.3f}s"
+                )
+            if not failed:
+                future.set_result(result)
+
+        self._queue.put(key, (key, future, run))
+        if waits and on_queued is not None:
+            try:
+                on_queued(waiting_for_key + 1)
+            except Exception as e:
+                logger.warning(f"Error notifying queued job {name}, {e}")
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "queued": self.queued,
+            "keys": self._queue.stats(),
+            "latency": self.latency.summary(),
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        for key, future, _ in self._queue.close():
+            future.cancel()
+            self._release(key)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+
+
+def scheduling_key(channel_id: str, user_id: Optional[str] = None) -> str:
+    """
+    The key the jobs of a Slack request are scheduled by, the channel or, when JOB_FAIR_KEY
+    is `channel_user`, the channel and the user, so users sharing a busy channel take turns too.
+
+    Args:
+        channel_id (str): ID of the Slack channel
+        user_id (str, optional): ID of the Slack user
+
+    Returns:
+        str: the scheduling key
+    """
+    if user_id and os.getenv("JOB_FAIR_KEY", "channel").lower() == "channel_user":
+        return f"{channel_id}:{user_id}"
+    return channel_id
+
+
+# process wide dispatcher of the Slack handler jobs, configured via JOB_MAX_WORKERS,
+# JOB_MAX_QUEUE, JOB_MAX_QUEUE_PER_CHANNEL, JOB_MAX_RUNNING_PER_CHANNEL and
+# JOB_CHANNEL_WEIGHTS (e.g. `C0123=3,C0456=2`)
+job_dispatcher = JobDispatcher(
+    max_workers=int(os.getenv("JOB_MAX_WORKERS", 4)),
+    max_queue=int(os.getenv("JOB_MAX_QUEUE", 32)),
+    max_queue_per_key=int(os.getenv("JOB_MAX_QUEUE_PER_CHANNEL", 8)),
+    max_running_per_key=int(os.getenv("JOB_MAX_RUNNING_PER_CHANNEL", 2)),
+    weights=parse_weights(os.getenv("JOB_CHANNEL_WEIGHTS")),
+)
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import re
+from typing import Dict, NamedTuple, Optional
+
+from handler_tasks.answer_cache import normalize_question
+from log.logger import get_logger as _logger
+
+logger = _logger("guardrails")
+
+# seconds a generated query may run before Snowflake cancels it, 0 keeps the timeout of
+# the user or warehouse, configured via QUERY_STATEMENT_TIMEOUT
+STATEMENT_TIMEOUT = int(os.getenv("QUERY_STATEMENT_TIMEOUT", 120))
+
+
+def question_hash(question: str) -> str:
+    """
+    A short hash of the normalized question, to correlate queries without logging the question.
+    """
+    return hashlib.sha256(normalize_question(question).encode("utf-8")).hexdigest()[:16]
+
+
+def query_tag(channel_id: str, user_id: Optional[str], question: str) -> str:
+    """
+    The `QUERY_TAG` of a generated query, a JSON object with the Slack channel, user and
+    question hash, e.g. to find the queries of a channel in `QUERY_HISTORY`.
+
+    Args:
+        channel_id (str): The Slack channel the question was asked in
+        user_id (str, optional): The Slack user who asked the question
+        question (str): The question asked to Cortex Analyst
+
+    Returns:
+        str: the query tag
+    """
+    return json.dumps(
+        {
+            "app": "cortalyst",
+            "channel": channel_id,
+            "user": user_id,
+            "question": question_hash(question),
+        },
+        separators=(",", ":"),
+    )
+
+
+def statement_params(
+    channel_id: str,
+    user_id: Optional[str],
+    question: str,
+    timeout: int = STATEMENT_TIMEOUT,
+) -> Dict[str, str]:
+    """
+    The Snowpark statement parameters of a generated query, setting its timeout and tag
+    for the query only, the session is shared by all the users.
+
+    Args:
+        channel_id (str): The Slack channel the question was asked in
+        user_id (str, optional): The Slack user who asked the question
+        question (str): The question asked to Cortex Analyst
+        timeout (int, optional): Seconds the query may run, 0 for no timeout. Defaults to STATEMENT_TIMEOUT.
+
+    Returns:
+        Dict[str, str]: the statement parameters
+    """
+    params = {"QUERY_TAG": query_tag(channel_id, user_id, question)}
+    if timeout > 0:
+        params["STATEMENT_TIMEOUT_IN_SECONDS"] = str(int(timeout))
+    return params
+
+
+class QueryRefusedError(Exception):
+    """
+    Raised when a generated query would scan more partitions than allowed.
+    """
+
+
+class ScanEstimate(NamedTuple):
+    """
+    The partitions and bytes a query is estimated to scan, from its `EXPLAIN` plan.
+    """
+
+    partitions_total: int
+    partitions_assigned: int
+    bytes_assigned: int
+
+
+def explain(
+    session, query: str, params: Optional[Dict[str, str]] = None
+) -> ScanEstimate:
+    """
+    Estimate the scan of a query with `EXPLAIN USING JSON`, which compiles the query
+    without running it on the warehouse.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        params (Dict[str, str], optional): The statement parameters. Defaults to None.
+
+    Returns:
+        ScanEstimate: the partitions and bytes the query scans after pruning
+    """
+    statement = re.sub(r"[\s;]+$", "", query)
+    rows = session.sql(f"EXPLAIN USING JSON\n{statement}").collect(
+        statement_params=params
+    )
+    stats = json.loads(rows[0][0]).get("GlobalStats", {})
+    return ScanEstimate(
+        int(stats.get("partitionsTotal", 0)),
+        int(stats.get("partitionsAssigned", 0)),
+        int(stats.get("bytesAssigned", 0)),
+    )
+
+
+class ScanGuard:
+    """
+    Checks the `EXPLAIN` estimate of the generated queries before they run, to keep
+    accidental large scans off the shared warehouse.
+
+    Methods:
+        check(session, query: str, params: Optional[Dict[str, str]] = None) -> Optional[ScanEstimate]:
+            Returns the estimate of a query over the threshold, raises QueryRefusedError
+            instead when refusing.
+    """
+
+    MODES = ("warn", "refuse")
+
+    def __init__(self, max_partitions: int = 0, mode: str = "warn"):
+        """
+        Args:
+            max_partitions (int, optional): Partitions a query may scan, 0 disables the check. Defaults to 0.
+            mode (str, optional): warn or refuse the queries over the threshold. Defaults to "warn".
+        """
+        if mode not in self.MODES:
+            raise ValueError(
+                f"Unknown scan guard mode {mode}, expected one of {self.MODES}"
+            )
+        self.max_partitions = max_partitions
+        self.mode = mode
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_partitions > 0
+
+    def check(
+        self, session, query: str, params: Optional[Dict[str, str]] = None
+    ) -> Optional[ScanEstimate]:
+        """
+        Check the scan of the query. A query that can't be explained is let through.
+
+        Args:
+            session: The Snowpark session
+            query (str): The SQL statement
+            params (Dict[str, str], optional): The statement parameters. Defaults to None.
+
+        Returns:
+            Optional[ScanEstimate]: the estimate if it exceeds the threshold, else None
+
+        Raises:
+            QueryRefusedError: If the estimate exceeds the threshold in refuse mode
+        """
+        if not self.enabled:
+            return None
+        try:
+            estimate = explain(session, query, params)
+        except Exception as e:
+            logger.warning(f"Error explaining the query, not checking its scan, {e}")
+            return None
+        logger.debug(f"Scan estimate {estimate}")
+        if estimate.partitions_assigned <= self.max_partitions:
+            return None
+        if self.mode == "refuse":
+            raise QueryRefusedError(
+                f"The query would scan {estimate.partitions_assigned} of "
+                f"{estimate.partitions_total} partitions, more than the "
+                f"{self.max_partitions} allowed"
+            )
+        return estimate
+
+
+def scan_warning(estimate: ScanEstimate, max_partitions: int) -> str:
+    """
+    The Slack message warning about a query scanning more partitions than the threshold.
+    """
+    return (
+        f":warning: This query scans {estimate.partitions_assigned:,} of "
+        f"{estimate.partitions_total:,} partitions "
+        f"({estimate.bytes_assigned / 1024**3:.1f} GiB), over the {max_partitions:,} "
+        "expected. Consider narrowing the question, e.g. to a date range."
+    )
+
+
+# process wide scan guard, configured via QUERY_MAX_PARTITIONS and QUERY_SCAN_GUARD
+scan_guard = ScanGuard(
+    max_partitions=int(os.getenv("QUERY_MAX_PARTITIONS", 0)),
+    mode=os.getenv("QUERY_SCAN_GUARD", "warn"),
+)
@@ -0,0 +1,254 @@
+import asyncio
+import os
+import threading
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from handler_tasks.traffic_log import RecordingTransport, ReplayTransport, TrafficLog
+from log.logger import get_logger as _logger
+
+logger = _logger("http_transport")
+
+try:
+    # httpx is optional, it is only needed when HTTP/2 is enabled
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    # aiohttp is only needed by the asyncio Cortex Analyst client
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Number of keep-alive connections kept open per host
+DEFAULT_POOL_SIZE = 10
+
+_lock = threading.Lock()
+_transport = None
+# aiohttp sessions are bound to the event loop they were created on, each one is kept
+# with the task closing it when its loop shuts down
+_async_transports = {}
+
+
+class HTTP2Transport:
+    """
+    Wraps an `httpx.Client` to behave like `requests.Session` for the calls made by Cortlayst,
+    a `(connect, read)` timeout tuple and `stream` are accepted and transport errors are
+    raised as `requests.ConnectionError` or `requests.Timeout`.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            timeout = httpx.Timeout(read, connect=connect)
+        try:
+            request = self.client.build_request(
+                "POST", url, json=json, headers=headers, timeout=timeout
+            )
+            resp = self.client.send(request, stream=stream)
+            if stream and resp.status_code != 200:
+                resp.read()
+            return resp
+        except httpx.TimeoutException as e:
+            raise requests.Timeout(e)
+        except httpx.TransportError as e:
+            raise requests.ConnectionError(e)
+
+    def close(self):
+        self.client.close()
+
+
+def _is_truthy(value: Optional[str]) -> bool:
+    return value is not None and value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def create_transport(pool_size: int = DEFAULT_POOL_SIZE, http2: bool = False):
+    """
+    Create a connection-pooled HTTP transport with keep-alive enabled.
+
+    Args:
+        pool_size (int, optional): Maximum number of pooled connections per host. Defaults to 10.
+        http2 (bool, optional): Use HTTP/2 via `httpx`, if it is installed. Defaults to False.
+
+    Returns:
+        A `requests.Session` or, when HTTP/2 is enabled, an HTTP2Transport. Both expose
+        the same `post(url, json=..., headers=..., timeout=...)` call used by Cortlayst.
+    """
+    if http2:
+        if httpx is not None:
+            logger.debug(f"Creating HTTP/2 transport with pool size {pool_size}")
+            return HTTP2Transport(
+                httpx.Client(
+                    http2=True,
+                    limits=httpx.Limits(
+                        max_connections=pool_size,
+                        max_keepalive_connections=pool_size,
+                    ),
+                )
+            )
+        logger.warning("HTTP/2 requested but 'httpx' is not installed, using HTTP/1.1")
+
+    logger.debug(f"Creating HTTP/1.1 transport with pool size {pool_size}")
+    transport = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    transport.mount("https://", adapter)
+    transport.mount("http://", adapter)
+    transport.headers.update({"Connection": "keep-alive"})
+    return transport
+
+
+def analyst_mode() -> str:
+    """
+    The Cortex Analyst traffic mode, `live`, `record` or `replay`, configured via
+    CORTEX_ANALYST_MODE.
+    """
+    return os.getenv("CORTEX_ANALYST_MODE", "live").strip().lower()
+
+
+def check_async_mode() -> None:
+    """
+    Check the traffic mode is supported by the asyncio transport, which only calls the
+    live Cortex Analyst. Recording is skipped with a warning.
+
+    Raises:
+        RuntimeError: If the traffic is to be replayed, which would call Cortex Analyst
+    """
+    mode = analyst_mode()
+    if mode == "replay":
+        raise RuntimeError(
+            "CORTEX_ANALYST_MODE=replay isn't supported by the asyncio bot, "
+            "run app.py to replay the Cortex Analyst traffic"
+        )
+    if mode == "record":
+        logger.warning(
+            "CORTEX_ANALYST_MODE=record isn't supported by the asyncio bot, "
+            "the Cortex Analyst traffic isn't recorded"
+        )
+
+
+def _pool_size() -> int:
+    return int(os.getenv("CORTEX_HTTP_POOL_SIZE", DEFAULT_POOL_SIZE))
+
+
+def get_transport():
+    """
+    Return the process wide HTTP transport, creating it on first use.
+
+    The transport is configured using the environment variables:
+        - CORTEX_HTTP_POOL_SIZE: number of pooled connections, defaults to 10
+        - CORTEX_HTTP2: set to `true` to use HTTP/2 (requires `httpx[http2]`)
+        - CORTEX_ANALYST_MODE: `live` (default), `record` to record the Cortex Analyst
+          traffic or `replay` to serve the recorded traffic without calling Cortex Analyst
+        - CORTEX_ANALYST_TRAFFIC_LOG: the recorded traffic, defaults to `cortex_traffic.jsonl`
+        - CORTEX_REPLAY_REALTIME: set to `true` to replay the recorded latencies
+
+    Returns:
+        The shared HTTP transport
+    """
+    global _transport
+    if _transport is None:
+        with _lock:
+            if _transport is None:
+                mode = analyst_mode()
+                log = TrafficLog(
+                    os.getenv("CORTEX_ANALYST_TRAFFIC_LOG", "cortex_traffic.jsonl")
+                )
+                if mode == "replay":
+                    logger.info(f"Replaying Cortex Analyst traffic from {log.path}")
+                    _transport = ReplayTransport(
+                        log, realtime=_is_truthy(os.getenv("CORTEX_REPLAY_REALTIME"))
+                    )
+                else:
+                    _transport = create_transport(
+                        pool_size=_pool_size(),
+                        http2=_is_truthy(os.getenv("CORTEX_HTTP2")),
+                    )
+                    if mode == "record":
+                        logger.info(f"Recording Cortex Analyst traffic to {log.path}")
+                        _transport = RecordingTransport(_transport, log)
+    return _transport
+
+
+def close_transport() -> None:
+    """
+    Close the process wide HTTP transport and release its pooled connections.
+    """
+    global _transport
+    with _lock:
+        if _transport is not None:
+            logger.debug("Closing HTTP transport")
+            _transport.close()
+            _transport = None
+
+
+async def _close_on_shutdown(loop, transport) -> None:
+    # asyncio.run cancels the remaining tasks of the loop before closing it
+    try:
+        await asyncio.Event().wait()
+    except asyncio.CancelledError:
+        if _async_transports.get(loop, (None,))[0] is transport:
+            del _async_transports[loop]
+        if not transport.closed:
+            logger.debug("Closing asyncio HTTP transport of the shutting down loop")
+            await transport.close()
+        raise
+
+
+def _forget_closed_loops() -> None:
+    # the transports of loops closed without shutting down can't be closed anymore
+    for loop in [loop for loop in _async_transports if loop.is_closed()]:
+        logger.warning("Dropping the asyncio HTTP transport of a closed event loop")
+        del _async_transports[loop]
+
+
+def get_async_transport():
+    """
+    Return the `aiohttp.ClientSession` shared by all the coroutines of the running event loop,
+    creating it on first use, see `check_async_mode`. The session is closed when the loop shuts down, e.g. at the
+    end of `asyncio.run`, or by `close_async_transport`. The pool size is configured using
+    CORTEX_HTTP_POOL_SIZE.
+
+    Returns:
+        aiohttp.ClientSession: The shared asyncio HTTP transport
+
+    Raises:
+        RuntimeError: If 'aiohttp' is not installed, there is no running event loop or the
+            traffic is to be replayed
+    """
+    if aiohttp is None:
+        raise RuntimeError("The asyncio transport requires 'aiohttp' to be installed")
+    loop = asyncio.get_running_loop()
+    transport, closer = _async_transports.get(loop, (None, None))
+    if transport is None or transport.closed:
+        if closer is not None:
+            closer.cancel()
+        _forget_closed_loops()
+        check_async_mode()
+        pool_size = _pool_size()
+        logger.debug(f"Creating asyncio transport with pool size {pool_size}")
+        transport = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=pool_size, limit_per_host=pool_size),
+        )
+        _async_transports[loop] = (
+            transport,
+            loop.create_task(_close_on_shutdown(loop, transport)),
+        )
+    return transport
+
+
+async def close_async_transport() -> None:
+    """
+    Close the asyncio HTTP transport of the running event loop.
+    """
+    transport, closer = _async_transports.pop(asyncio.get_running_loop(), (None, None))
+    if closer is not None:
+        closer.cancel()
+    if transport is not None and not transport.closed:
+        logger.debug("Closing asyncio HTTP transport")
+        await transport.close()
@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("idempotency")
+
+# payload key the Socket Mode envelope ID is copied to, see `with_envelope_id`
+ENVELOPE_ID = "envelope_id"
+
+
+def delivery_id(body: Dict[str, Any]) -> Optional[str]:
+    """
+    The ID of a Slack delivery, identical when Slack redelivers a request it considers
+    unacknowledged or failed.
+
+    Events are identified by their `event_id`, commands and interactions by their `trigger_id`,
+    block actions also by the `action_ts` of their actions. Other payloads fall back to the
+    Socket Mode envelope ID, see `with_envelope_id`.
+
+    Args:
+        body (Dict[str, Any]): The request payload
+
+    Returns:
+        Optional[str]: the delivery ID or None if the payload has none
+    """
+    if body.get("event_id"):
+        return f"event:{body['event_id']}"
+    trigger_id = body.get("trigger_id")
+    if not trigger_id:
+        return f"envelope:{body[ENVELOPE_ID]}" if body.get(ENVELOPE_ID) else None
+    action_ts: List[str] = [
+        action["action_ts"]
+        for action in body.get("actions", [])
+        if "action_ts" in action
+    ]
+    return ":".join(["trigger", trigger_id, *action_ts])
+
+
+def with_envelope_id(client, request) -> None:
+    """
+    A Socket Mode request listener copying the envelope ID of the request into its payload,
+    Bolt passes only the payload on to the middleware. Register it before the Bolt handler.
+
+    Args:
+        client: The Socket Mode client
+        request (SocketModeRequest): The request received
+    """
+    if request.envelope_id and isinstance(request.payload, dict):
+        request.payload.setdefault(ENVELOPE_ID, request.envelope_id)
+
+
+class IdempotencyGuard:
+    """
+    A thread safe guard against handling a Slack request twice.
+
+    Redelivered requests are recognized by their delivery ID, kept in a bounded map for
+    `ttl` seconds. Duplicate requests of an operation, e.g. a user clicking "Ask me!" twice,
+    are recognized by an operation key while the first one runs.
+
+    Methods:
+        seen(delivery_id: str) -> bool:
+            Records the delivery, returns whether it was already seen.
+
+        begin(operation: str) -> int:
+            Starts the operation, returns 0 or the number of duplicates if it is running.
+
+        end(operation: Optional[str]) -> None:
+            Marks the operation as done.
+    """
+
+    def __init__(
+        self, max_size: int = 4096, ttl: float = 600, operation_ttl: float = 900
+    ):
+        """
+        Args:
+            max_size (int, optional): Maximum number of deliveries remembered. Defaults to 4096.
+            ttl (float, optional): Seconds a delivery is remembered, Slack retries within minutes. Defaults to 600.
+            operation_ttl (float, optional): Seconds after which a running operation is assumed
+                lost and may start again. Defaults to 900.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.operation_ttl = operation_ttl
+        self._deliveries: OrderedDict[str, float] = OrderedDict()
+        # running operations, their expiry time and number of duplicates
+        self._operations: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._deliveries)
+
+    def seen(self, delivery_id: str) -> bool:
+        """
+        Records the delivery.
+
+        Args:
+            delivery_id (str): The delivery ID, see `delivery_id`
+
+        Returns:
+            bool: True if the delivery was seen in the last `ttl` seconds
+        """
+        now = time.monotonic()
+        with self._lock:
+            # the oldest deliveries come first
+            while self._deliveries and next(iter(self._deliveries.values())) <= now:
+                self._deliveries.popitem(last=False)
+            if delivery_id in self._deliveries:
+                logger.debug(f"Redelivered {delivery_id}")
+                return True
+            self._deliveries[delivery_id] = now + self.ttl
+            while len(self._deliveries) > self.max_size:
+                self._deliveries.popitem(last=False)
+            return False
+
+    def begin(self, operation: str) -> int:
+        """
+        Starts the operation unless it is running.
+
+        Args:
+            operation (str): Key of the operation, e.g. the command, channel, user and question
+
+        Returns:
+            int: 0 if the operation started, otherwise the number of duplicates of the running
+                operation including this one, so that only the first duplicate is answered
+        """
+        now = time.monotonic()
+        with self._lock:
+            running = self._operations.get(operation)
+            if running is None or running[0] <= now:
+                self._operations[operation] = [now + self.operation_ttl, 0]
+                return 0
+            running[1] += 1
+            logger.debug(f"Duplicate #{running[1]} of running {operation}")
+            return int(running[1])
+
+    def end(self, operation: Optional[str]) -> None:
+        if operation is None:
+            return
+        with self._lock:
+            self._operations.pop(operation, None)
+
+
+# process wide idempotency guard, configured via IDEMPOTENCY_CACHE_SIZE, IDEMPOTENCY_TTL
+# and IDEMPOTENCY_OPERATION_TTL
+idempotency_guard = IdempotencyGuard(
+    max_size=int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 4096)),
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", 600)),
+    operation_ttl=float(os.getenv("IDEMPOTENCY_OPERATION_TTL", 900)),
+)
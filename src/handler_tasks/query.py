@@ -0,0 +1,463 @@
+import asyncio
+import os
+import re
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from handler_tasks.result_cache import (
+    fetch_arrow,
+    query_to_arrow,
+    query_to_arrow_async,
+    select_columns,
+    sql_tokens,
+)
+from log.logger import get_logger as _logger
+
+logger = _logger("query")
+
+# column of the preview holding the number of rows of the whole result
+TOTAL_ROWS_COLUMN = "__TOTAL_ROWS__"
+
+# number of rows fetched to preview a result, configured via QUERY_PREVIEW_ROWS
+PREVIEW_ROWS = int(os.getenv("QUERY_PREVIEW_ROWS", 10))
+
+# Snowflake error code of an invalid identifier
+INVALID_IDENTIFIER = 904
+
+# longest pause between two status checks of a running query, configured via
+# QUERY_POLL_INTERVAL
+POLL_INTERVAL = float(os.getenv("QUERY_POLL_INTERVAL", 1))
+
+# seconds a query runs before its progress is posted, and between two updates of the
+# progress, configured via QUERY_PROGRESS_AFTER and QUERY_PROGRESS_INTERVAL
+PROGRESS_AFTER = float(os.getenv("QUERY_PROGRESS_AFTER", 2))
+PROGRESS_INTERVAL = float(os.getenv("QUERY_PROGRESS_INTERVAL", 5))
+
+
+class QueryCancelledError(Exception):
+    """
+    Raised when the result of a cancelled query is fetched.
+    """
+
+
+class QueryJob:
+    """
+    A warehouse query submitted with Snowpark's `collect_nowait`, so that no thread waits on
+    the warehouse while it runs. Its status is polled by query ID and its result fetched as
+    Arrow once it is done. Running jobs are registered in `running_queries` to be cancelled.
+
+    Methods:
+        submit() -> QueryJob:
+            Submits the query without waiting for it.
+
+        done() -> bool:
+            Whether the query finished, a status request to Snowflake.
+
+        cancel() -> None:
+            Aborts the query in the warehouse.
+
+        fetch() -> pa.Table:
+            The result of the finished query.
+
+        wait(on_progress: Optional[Callable[[QueryJob], None]] = None) -> pa.Table:
+            Polls the query until it finished and fetches its result.
+
+        wait_async(run_blocking, on_progress=None) -> pa.Table:
+            The asyncio variant of wait, sleeping on the event loop between the polls.
+    """
+
+    def __init__(
+        self,
+        session,
+        query: str,
+        columns: Optional[List[str]] = None,
+        poll_interval: float = POLL_INTERVAL,
+        progress_after: float = PROGRESS_AFTER,
+        progress_interval: float = PROGRESS_INTERVAL,
+        statement_params: Optional[Dict[str, str]] = None,
+    ):
+        """
+        Args:
+            session: The Snowpark session
+            query (str): The SQL statement
+            columns (List[str], optional): The columns needed. Defaults to None i.e. all.
+            poll_interval (float, optional): Longest pause between two polls. Defaults to POLL_INTERVAL.
+            progress_after (float, optional): Seconds before the first progress. Defaults to PROGRESS_AFTER.
+            progress_interval (float, optional): Seconds between two progresses. Defaults to PROGRESS_INTERVAL.
+            statement_params (Dict[str, str], optional): Parameters of the query, e.g. its
+                timeout and tag, see `guardrails.statement_params`. Defaults to None.
+        """
+        self.session = session
+        self.query = query
+        self.columns = columns
+        self.poll_interval = poll_interval
+        self.progress_after = progress_after
+        self.progress_interval = progress_interval
+        self.statement_params = statement_params
+        self.cancelled = False
+        self._job = None
+        self._submitted_at = time.monotonic()
+
+    @property
+    def query_id(self) -> Optional[str]:
+        return self._job.query_id if self._job is not None else None
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self._submitted_at
+
+    def submit(self) -> "QueryJob":
+        self._submitted_at = time.monotonic()
+        self._job = self.session.sql(self.query).collect_nowait(
+            statement_params=self.statement_params
+        )
+        running_queries.add(self)
+        logger.debug(f"Submitted query {self.query_id}")
+        return self
+
+    def done(self) -> bool:
+        return self._job.is_done()
+
+    def cancel(self) -> None:
+        self.cancelled = True
+        self._job.cancel()
+        logger.info(f"Cancelled query {self.query_id} after {self.elapsed:.1f}s")
+
+    def fetch(self) -> Any:
+        """
+        The result of the finished query, read by its query ID.
+
+        Returns:
+            pa.Table: the result
+
+        Raises:
+            QueryCancelledError: If the query was cancelled
+        """
+        try:
+            if self.cancelled:
+                raise QueryCancelledError(f"Query {self.query_id} was cancelled")
+            cursor = self.session.connection.cursor()
+            try:
+                cursor.get_results_from_sfqid(self.query_id)
+                if self.columns is None:
+                    return cursor.fetch_arrow_all(force_return_table=True)
+                return select_columns(cursor.fetch_arrow_batches(), self.columns)
+            finally:
+                cursor.close()
+        finally:
+            running_queries.remove(self)
+            logger.debug(f"Query {self.query_id} took {self.elapsed:.2f}s")
+
+    def wait(self, on_progress: Optional[Callable[["QueryJob"], None]] = None) -> Any:
+        """
+        Polls the query until it finished, with a growing pause up to `poll_interval`.
+
+        Args:
+            on_progress (Callable[[QueryJob], None], optional): Called every `progress_interval`
+                seconds once the query runs longer than `progress_after`. Defaults to None.
+
+        Returns:
+            pa.Table: the result
+        """
+        pause, next_progress = 0.05, self.progress_after
+        try:
+            while not self.done():
+                if on_progress is not None and self.elapsed >= next_progress:
+                    next_progress = self.elapsed + self.progress_interval
+                    try:
+                        on_progress(self)
+                    except Exception as e:
+                        logger.warning(f"Error reporting the query progress, {e}")
+                time.sleep(pause)
+                pause = min(pause * 2, self.poll_interval)
+        except BaseException:
+            running_queries.remove(self)
+            raise
+        return self.fetch()
+
+    async def wait_async(
+        self,
+        run_blocking: Callable[..., Awaitable[Any]],
+        on_progress: Optional[Callable[["QueryJob"], Awaitable[None]]] = None,
+    ) -> Any:
+        """
+        The asyncio variant of `wait`, only the status requests and the fetch of the
+        result run on the executor.
+
+        Args:
+            run_blocking (Callable[..., Awaitable[Any]]): Runs a blocking call on the executor
+            on_progress (Callable[[QueryJob], Awaitable[None]], optional): Awaited like the
+                progress callback of `wait`. Defaults to None.
+
+        Returns:
+            pa.Table: the result
+        """
+        pause, next_progress = 0.05, self.progress_after
+        try:
+            while not await run_blocking(self.done):
+                if on_progress is not None and self.elapsed >= next_progress:
+                    next_progress = self.elapsed + self.progress_interval
+                    try:
+                        await on_progress(self)
+                    except Exception as e:
+                        logger.warning(f"Error reporting the query progress, {e}")
+                await asyncio.sleep(pause)
+                pause = min(pause * 2, self.poll_interval)
+        except BaseException:
+            running_queries.remove(self)
+            raise
+        return await run_blocking(self.fetch)
+
+
+class RunningQueries:
+    """
+    A thread safe registry of the running query jobs by query ID, e.g. for the Cancel button
+    of the progress message.
+
+    Methods:
+        add(job: QueryJob) -> None:
+            Registers the job.
+
+        remove(job: QueryJob) -> None:
+            Unregisters the job.
+
+        cancel(query_id: str) -> bool:
+            Cancels the running job, False if it is not running.
+    """
+
+    def __init__(self):
+        self._jobs: Dict[str, QueryJob] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def add(self, job: QueryJob) -> None:
+        with self._lock:
+            self._jobs[job.query_id] = job
+
+    def remove(self, job: QueryJob) -> None:
+        with self._lock:
+            self._jobs.pop(job.query_id, None)
+
+    def cancel(self, query_id: str) -> bool:
+        with self._lock:
+            job = self._jobs.pop(query_id, None)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+
+# process wide registry of the running queries
+running_queries = RunningQueries()
+
+
+def order_by_clause(query: str) -> Optional[str]:
+    """
+    The top level `ORDER BY` clause of the statement, without its `LIMIT`, `OFFSET` or
+    `FETCH`. The qualifiers of the columns are dropped, so the clause applies to the
+    result of the statement.
+
+    Args:
+        query (str): The SQL statement
+
+    Returns:
+        Optional[str]: the expressions of the clause, None if the statement isn't ordered
+
+    Examples:
+    >>> order_by_clause("SELECT t.a, COUNT(*) AS n FROM t GROUP BY t.a ORDER BY n DESC, t.a LIMIT 5")
+    "n DESC, a"
+    """
+    tokens = [t for t in sql_tokens(query) if t.lastgroup not in ("space", "comment")]
+    depth, start, end = 0, None, None
+    for i, token in enumerate(tokens):
+        text = token.group().casefold()
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth > 0:
+            continue
+        elif text == ";" and start is not None:
+            end = end if end is not None else i
+        elif token.lastgroup != "word":
+            continue
+        elif text == "order" and i + 1 < len(tokens):
+            if tokens[i + 1].group().casefold() == "by":
+                start, end = i + 2, None
+        elif text in ("limit", "offset", "fetch") and start is not None:
+            end = end if end is not None else i
+        elif text in ("union", "intersect", "except", "minus"):
+            start, end = None, None
+    if start is None:
+        return None
+
+    clause, gap, tokens = [], False, tokens[start:end]
+    for i, token in enumerate(tokens):
+        gap = gap or (i > 0 and token.start() > tokens[i - 1].end())
+        if (
+            token.lastgroup in ("word", "quoted")
+            and i + 2 < len(tokens)
+            and tokens[i + 1].group() == "."
+        ) or token.group() == ".":
+            # drop the qualifier and its dot, keeping the space before it
+            continue
+        if clause and gap:
+            clause.append(" ")
+        clause.append(token.group())
+        gap = False
+    return "".join(clause) or None
+
+
+def preview_sql(query: str, limit: int = PREVIEW_ROWS, ordered: bool = True) -> str:
+    """
+    Wrap the query to fetch its first rows and the number of rows of the whole result in
+    one statement. The order of an ordered statement is applied to the preview as well,
+    the order of a subquery is not guaranteed to carry over.
+
+    Args:
+        query (str): The SQL statement, e.g. generated by Cortex Analyst
+        limit (int, optional): Number of rows fetched. Defaults to PREVIEW_ROWS.
+        ordered (bool, optional): Order the preview like the statement. Defaults to True.
+
+    Returns:
+        str: the preview statement
+    """
+    # a trailing comment would swallow the closing parenthesis, hence the new lines
+    statement = re.sub(r"[\s;]+$", "", query)
+    order_by = order_by_clause(statement) if ordered else None
+    return (
+        f'SELECT *, COUNT(*) OVER () AS "{TOTAL_ROWS_COLUMN}" FROM (\n{statement}\n)'
+        f"{f' ORDER BY {order_by}' if order_by else ''} LIMIT {int(limit)}"
+    )
+
+
+def _invalid_identifier(error: Exception) -> bool:
+    # the ordering of the statement may use columns its result doesn't have
+    codes = (getattr(error, "sql_error_code", None), getattr(error, "errno", None))
+    return INVALID_IDENTIFIER in codes
+
+
+def _preview(table: Any) -> Tuple[Any, int]:
+    total_rows = int(table[TOTAL_ROWS_COLUMN][0].as_py()) if table.num_rows else 0
+    logger.debug(f"Previewing {table.num_rows} of {total_rows} rows")
+    return table.drop_columns([TOTAL_ROWS_COLUMN]), total_rows
+
+
+def query_preview(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    limit: int = PREVIEW_ROWS,
+    fetch: Callable[..., Any] = fetch_arrow,
+) -> Tuple[Any, int]:
+    """
+    Fetch the first rows of the query result and its number of rows as Arrow, without
+    transferring the whole result.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        database (str): The database the statement runs in
+        schema (str): The schema the statement runs in
+        limit (int, optional): Number of rows fetched. Defaults to PREVIEW_ROWS.
+        fetch (Callable[..., pa.Table], optional): Runs the query on a cache miss, see
+            `query_to_arrow`. Defaults to `fetch_arrow`.
+
+    Returns:
+        Tuple[pa.Table, int]: the first rows and the number of rows of the result
+    """
+    statement = preview_sql(query, limit)
+    try:
+        table = query_to_arrow(session, statement, database, schema, fetch=fetch)
+    except Exception as e:
+        unordered = preview_sql(query, limit, ordered=False)
+        if statement == unordered or not _invalid_identifier(e):
+            raise
+        logger.warning(f"Error ordering the preview, previewing it unordered, {e}")
+        table = query_to_arrow(session, unordered, database, schema, fetch=fetch)
+    return _preview(table)
+
+
+async def query_preview_async(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    fetch: Callable[..., Awaitable[Any]],
+    run_blocking: Callable[..., Awaitable[Any]],
+    limit: int = PREVIEW_ROWS,
+) -> Tuple[Any, int]:
+    """
+    The asyncio variant of `query_preview`, see `query_to_arrow_async`.
+    """
+    statement = preview_sql(query, limit)
+    try:
+        table = await query_to_arrow_async(
+            session, statement, database, schema, fetch, run_blocking
+        )
+    except Exception as e:
+        unordered = preview_sql(query, limit, ordered=False)
+        if statement == unordered or not _invalid_identifier(e):
+            raise
+        logger.warning(f"Error ordering the preview, previewing it unordered, {e}")
+        table = await query_to_arrow_async(
+            session, unordered, database, schema, fetch, run_blocking
+        )
+    return _preview(table)
+
+
+def query_result(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    preview: Any,
+    total_rows: int,
+    columns: Optional[List[str]] = None,
+    fetch: Callable[..., Any] = fetch_arrow,
+) -> Any:
+    """
+    The whole query result as Arrow, fetched only if the preview doesn't hold all of its rows.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        database (str): The database the statement runs in
+        schema (str): The schema the statement runs in
+        preview (pa.Table): The preview of the result, see `query_preview`
+        total_rows (int): The number of rows of the result
+        columns (List[str], optional): The columns needed. Defaults to None i.e. all.
+        fetch (Callable[..., pa.Table], optional): Runs the query on a cache miss, see
+            `query_to_arrow`. Defaults to `fetch_arrow`.
+
+    Returns:
+        pa.Table: the result
+    """
+    if preview.num_rows >= total_rows:
+        return preview if columns is None else preview.select(columns)
+    return query_to_arrow(session, query, database, schema, columns, fetch=fetch)
+
+
+async def query_result_async(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    preview: Any,
+    total_rows: int,
+    fetch: Callable[..., Awaitable[Any]],
+    run_blocking: Callable[..., Awaitable[Any]],
+    columns: Optional[List[str]] = None,
+) -> Any:
+    """
+    The asyncio variant of `query_result`, see `query_to_arrow_async`.
+    """
+    if preview.num_rows >= total_rows:
+        return preview if columns is None else preview.select(columns)
+    return await query_to_arrow_async(
+        session, query, database, schema, fetch, run_blocking, columns
+    )
@@ -0,0 +1,283 @@
+import asyncio
+import inspect
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Callable, Iterator, Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("rate_limit")
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket rate limiter.
+
+    Tokens are added at `rate` per second up to `burst`, every request takes one token
+    and waits for it when the bucket is empty.
+
+    Methods:
+        acquire() -> float:
+            Takes a token, waiting until one is available. Returns the seconds waited.
+
+        acquire_async() -> float:
+            Coroutine that takes a token, sleeping on the event loop until one is available.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate (float): Tokens added per second, 0 disables the rate limit.
+            burst (int, optional): Maximum number of tokens in the bucket. Defaults to 1.
+        """
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """
+        Takes a token, possibly in advance, and returns the seconds until it is available.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+    def acquire(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self) -> float:
+        if self.rate <= 0:
+            return 0.0
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+
+class ConcurrencyGovernor:
+    """
+    Limits the number of requests in flight, the requests that have to wait are let in
+    first come, first served.
+
+    Methods:
+        acquire(on_queued: Optional[Callable[[int], None]] = None) -> None:
+            Waits for a free slot, `on_queued` is called with the position in the queue when waiting.
+
+        release() -> None:
+            Frees the slot.
+
+        in_flight: Number of requests in flight.
+
+        queued: Number of requests waiting.
+    """
+
+    def __init__(self, max_in_flight: int):
+        """
+        Args:
+            max_in_flight (int): Maximum number of requests in flight, 0 disables the limit.
+        """
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._queue = deque()
+        self._cond = threading.Condition()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def _has_room(self) -> bool:
+        return self.max_in_flight <= 0 or self._in_flight < self.max_in_flight
+
+    def acquire(self, on_queued: Optional[Callable[[int], None]] = None) -> None:
+        with self._cond:
+            if self._has_room() and not self._queue:
+                self._in_flight += 1
+                return
+            ticket = object()
+            self._queue.append(ticket)
+            position = len(self._queue)
+
+        logger.debug(f"Request queued at position {position}")
+        try:
+            if on_queued is not None:
+                try:
+                    on_queued(position)
+                except Exception as e:
+                    logger.warning(f"Error notifying queued request, {e}")
+
+            with self._cond:
+                while self._queue[0] is not ticket or not self._has_room():
+                    self._cond.wait()
+                self._queue.popleft()
+                self._in_flight += 1
+                # let the next one in line check for room
+                self._cond.notify_all()
+        except BaseException:
+            # e.g. interrupted while waiting, the ones behind move up
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+            raise
+
+    def release(self) -> None:
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+
+class AsyncConcurrencyGovernor:
+    """
+    The asyncio version of ConcurrencyGovernor, the requests wait on the event loop.
+    A freed slot is handed over to the first request in line.
+
+    Methods:
+        acquire(on_queued: Optional[Callable[[int], Any]] = None) -> None:
+            Coroutine waiting for a free slot, `on_queued` is called, and awaited if it
+            is a coroutine function, with the position in the queue when waiting.
+
+        release() -> None:
+            Frees the slot.
+
+        in_flight: Number of requests in flight.
+
+        queued: Number of requests waiting.
+    """
+
+    def __init__(self, max_in_flight: int):
+        """
+        Args:
+            max_in_flight (int): Maximum number of requests in flight, 0 disables the limit.
+        """
+        self.max_in_flight = max_in_flight
+        self._in_flight = 0
+        self._queue: deque = deque()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    async def acquire(
+        self, on_queued: Optional[Callable[[int], object]] = None
+    ) -> None:
+        if not self._queue and (
+            self.max_in_flight <= 0 or self._in_flight < self.max_in_flight
+        ):
+            self._in_flight += 1
+            return
+        ticket = asyncio.get_running_loop().create_future()
+        self._queue.append(ticket)
+        position = len(self._queue)
+
+        logger.debug(f"Request queued at position {position}")
+        try:
+            if on_queued is not None:
+                try:
+                    notified = on_queued(position)
+                    if inspect.isawaitable(notified):
+                        await notified
+                except Exception as e:
+                    logger.warning(f"Error notifying queued request, {e}")
+            await ticket
+        except BaseException:
+            # cancelled while notified or waiting
+            if ticket.done() and not ticket.cancelled():
+                # the slot was handed over as the request was cancelled
+                self.release()
+            else:
+                self._queue.remove(ticket)
+            raise
+
+    def release(self) -> None:
+        while self._queue:
+            ticket = self._queue.popleft()
+            if not ticket.done():
+                # hand the slot over, the number in flight stays the same
+                ticket.set_result(None)
+                return
+        self._in_flight -= 1
+
+
+class CortexLimiter:
+    """
+    Client side rate limiter and concurrency governor for Cortex Analyst calls.
+
+    The sync and the asyncio calls share the rate limit, each has its own concurrency limit
+    of `max_in_flight` as a process runs either the sync or the asyncio bot.
+
+    Methods:
+        limit(on_queued: Optional[Callable[[int], None]] = None):
+            Context manager that holds a slot and a rate limit token for the duration of a call.
+
+        limit_async(on_queued: Optional[Callable[[int], Any]] = None):
+            The asynchronous context manager version of limit.
+    """
+
+    def __init__(self, rate: float = 0, burst: int = 1, max_in_flight: int = 0):
+        """
+        Args:
+            rate (float, optional): Calls per second, 0 disables the rate limit. Defaults to 0.
+            burst (int, optional): Calls allowed in a burst. Defaults to 1.
+            max_in_flight (int, optional): Maximum concurrent calls, 0 disables the limit. Defaults to 0.
+        """
+        self.bucket = TokenBucket(rate=rate, burst=burst)
+        self.governor = ConcurrencyGovernor(max_in_flight=max_in_flight)
+        self.async_governor = AsyncConcurrencyGovernor(max_in_flight=max_in_flight)
+
+    @contextmanager
+    def limit(
+        self, on_queued: Optional[Callable[[int], None]] = None
+    ) -> Iterator[None]:
+        self.governor.acquire(on_queued)
+        try:
+            waited = self.bucket.acquire()
+            if waited > 0:
+                logger.debug(f"Rate limited, waited {waited:.2f} seconds")
+            yield
+        finally:
+            self.governor.release()
+
+    @asynccontextmanager
+    async def limit_async(
+        self, on_queued: Optional[Callable[[int], object]] = None
+    ) -> AsyncIterator[None]:
+        await self.async_governor.acquire(on_queued)
+        try:
+            waited = await self.bucket.acquire_async()
+            if waited > 0:
+                logger.debug(f"Rate limited, waited {waited:.2f} seconds")
+            yield
+        finally:
+            self.async_governor.release()
+
+
+# process wide limiter of Cortex Analyst calls, configured via CORTEX_RATE_LIMIT
+# (calls per second), CORTEX_RATE_BURST and CORTEX_MAX_IN_FLIGHT
+cortex_limiter = CortexLimiter(
+    rate=float(os.getenv("CORTEX_RATE_LIMIT", 0)),
+    burst=int(os.getenv("CORTEX_RATE_BURST", 1)),
+    max_in_flight=int(os.getenv("CORTEX_MAX_IN_FLIGHT", 8)),
+)
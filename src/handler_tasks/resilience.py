@@ -0,0 +1,258 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("resilience")
+
+
+class CortexAnalystError(Exception):
+    """
+    Raised when a Cortex Analyst request fails.
+
+    Attributes:
+        status_code: HTTP status code of the failed response, None if no response was received
+        request_id: Value of the `X-Snowflake-Request-Id` response header
+        retry_after: Seconds to wait before retrying as advised by the `Retry-After` header
+    """
+
+    def __init__(
+        self,
+        *args,
+        status_code: Optional[int] = None,
+        request_id: Optional[str] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(*args)
+        self.status_code = status_code
+        self.request_id = request_id
+        self.retry_after = retry_after
+
+
+class CircuitOpenError(CortexAnalystError):
+    """
+    Raised without calling Cortex Analyst while the circuit breaker is open.
+    """
+
+
+class DeadlineExceededError(CortexAnalystError):
+    """
+    Raised when a question could not be answered within its total deadline.
+    """
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse the `Retry-After` header, either a number of seconds or an HTTP date.
+
+    Args:
+        value (str): The header value
+
+    Returns:
+        Optional[float]: number of seconds to wait, None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter for retryable Cortex Analyst failures.
+
+    Methods:
+        is_retryable(status_code: Optional[int]) -> bool:
+            Whether a failure with the status code (None for no response) should be retried.
+
+        backoff(attempt: int, retry_after: Optional[float] = None) -> float:
+            Seconds to wait before the next attempt.
+    """
+
+    RETRYABLE_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+    def __init__(
+        self,
+        max_retries: int = 3,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+    ):
+        """
+        Args:
+            max_retries (int, optional): Number of retries after the first attempt. Defaults to 3.
+            base_delay (float, optional): Backoff of the first retry in seconds. Defaults to 0.5.
+            max_delay (float, optional): Maximum backoff in seconds. Defaults to 8.0.
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def is_retryable(self, status_code: Optional[int]) -> bool:
+        return status_code is None or status_code in self.RETRYABLE_STATUSES
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Seconds to wait before the next attempt, the server advised `Retry-After` takes precedence.
+
+        Args:
+            attempt (int): The zero based number of the attempt that failed
+            retry_after (float, optional): Seconds advised by the `Retry-After` header
+
+        Returns:
+            float: the backoff in seconds
+        """
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+class CircuitBreaker:
+    """
+    A thread safe circuit breaker that fails fast while Cortex Analyst is unhealthy.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls fail with
+    CircuitOpenError. After `reset_timeout` seconds one trial call is let through (half open),
+    its success closes the circuit and its failure opens it again. A cancelled trial lets
+    the next call through as the trial, a trial that reports nothing lets another one
+    through after `reset_timeout` seconds.
+
+    Methods:
+        before_call() -> None:
+            Raises CircuitOpenError if the call is not allowed.
+
+        record_success() -> None:
+            Records a successful call.
+
+        record_failure() -> None:
+            Records a failed call.
+
+        record_cancelled() -> None:
+            Records a call cancelled before its outcome was known.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """
+        Args:
+            failure_threshold (int, optional): Consecutive failures that open the circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds the circuit stays open. Defaults to 30.
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if now - self._opened_at >= self.reset_timeout:
+                if self._state == self.OPEN:
+                    logger.info(
+                        "Circuit half open, allowing a trial call to Cortex Analyst"
+                    )
+                else:
+                    logger.warning(
+                        "Trial call to Cortex Analyst never reported, allowing another one"
+                    )
+                self._state = self.HALF_OPEN
+                # a trial that never reports times out like an open circuit
+                self._opened_at = now
+                return
+            raise CircuitOpenError(
+                "Cortex Analyst is unavailable, please try again in a few seconds."
+            )
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info("Circuit closed, Cortex Analyst is healthy again")
+            self._state = self.CLOSED
+            self._failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                if self._state != self.OPEN:
+                    logger.warning(
+                        f"Circuit open after {self._failures} consecutive Cortex Analyst failure(s)"
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_cancelled(self) -> None:
+        with self._lock:
+            # a cancelled call says nothing about Cortex Analyst, but a cancelled trial
+            # must not keep the others waiting, the next call is the trial
+            if self._state == self.HALF_OPEN:
+                logger.info("Trial call to Cortex Analyst cancelled")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+
+class Timeouts:
+    """
+    Timeouts of a Cortex Analyst question, configured via CORTEX_CONNECT_TIMEOUT,
+    CORTEX_READ_TIMEOUT and CORTEX_DEADLINE (all in seconds).
+
+    Attributes:
+        connect: Seconds to establish the connection
+        read: Seconds to wait for the response of one attempt
+        total: Seconds to answer the question including all the retries
+    """
+
+    def __init__(
+        self,
+        connect: float = 5.0,
+        read: float = 60.0,
+        total: float = 90.0,
+    ):
+        self.connect = connect
+        self.read = read
+        self.total = total
+
+
+def default_timeouts() -> Timeouts:
+    return Timeouts(
+        connect=float(os.getenv("CORTEX_CONNECT_TIMEOUT", 5)),
+        read=float(os.getenv("CORTEX_READ_TIMEOUT", 60)),
+        total=float(os.getenv("CORTEX_DEADLINE", 90)),
+    )
+
+
+def default_retry_policy() -> RetryPolicy:
+    return RetryPolicy(max_retries=int(os.getenv("CORTEX_MAX_RETRIES", 3)))
+
+
+# process wide circuit breaker of the Cortex Analyst endpoint, configured via
+# CORTEX_BREAKER_THRESHOLD and CORTEX_BREAKER_RESET (seconds)
+circuit_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv("CORTEX_BREAKER_THRESHOLD", 5)),
+    reset_timeout=float(os.getenv("CORTEX_BREAKER_RESET", 30)),
+)
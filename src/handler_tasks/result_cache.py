@@ -0,0 +1,442 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
+
+from log.logger import get_logger as _logger
+
+logger = _logger("result_cache")
+
+# string literals and quoted identifiers are kept verbatim, comments are dropped
+_SQL_TOKENS = re.compile(
+    r"""
+    (?P<string>'(?:[^'\\]|\\.|'')*')
+    | (?P<quoted>"(?:[^"]|"")*")
+    | (?P<comment>--[^\n]*|//[^\n]*|/\*.*?\*/)
+    | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<word>[^\W\d][\w$]*)
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+
+def _normalize_number(number: str) -> str:
+    mantissa, _, exponent = number.lower().partition("e")
+    if "." in mantissa:
+        mantissa = mantissa.rstrip("0").rstrip(".") or "0"
+    mantissa = mantissa.lstrip("0") or "0"
+    if mantissa.startswith("."):
+        mantissa = f"0{mantissa}"
+    return f"{mantissa}e{int(exponent)}" if exponent else mantissa
+
+
+def sql_tokens(sql: str) -> Iterator[re.Match]:
+    """
+    The tokens of a SQL statement, the kind of a token is the `lastgroup` of its match:
+    string, quoted, comment, number, word, space or other.
+    """
+    return _SQL_TOKENS.finditer(sql)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalize a SQL statement so that trivially different spellings of the same query match.
+
+    Comments are removed, whitespace collapsed, keywords and unquoted identifiers case folded,
+    numeric literals written canonically and a trailing semicolon dropped. String literals and
+    quoted identifiers are case sensitive and kept as is.
+
+    Args:
+        sql (str): The SQL statement
+
+    Returns:
+        str: the normalized statement
+
+    Examples:
+    >>> normalize_sql("SELECT  Service_Type, COUNT(*) -- per type\\n FROM t WHERE x = 1.50;")
+    "select service_type , count ( * ) from t where x = 1.5"
+    """
+    tokens = []
+    for match in sql_tokens(sql):
+        kind, token = match.lastgroup, match.group()
+        match kind:
+            case "space" | "comment":
+                continue
+            case "word":
+                tokens.append(token.casefold())
+            case "number":
+                tokens.append(_normalize_number(token))
+            case _:
+                tokens.append(token)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return " ".join(tokens)
+
+
+def sql_fingerprint(sql: str) -> str:
+    """
+    The SHA256 fingerprint of the normalized SQL statement.
+    """
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+class _Entry(NamedTuple):
+    table: Any
+    nbytes: int
+    marker: str
+    expires_at: float
+
+
+class ResultCache:
+    """
+    A thread safe cache of warehouse query results, stored as Arrow tables under a memory
+    budget with LRU eviction.
+
+    The results are keyed by the SQL fingerprint and a namespace, e.g. the database and schema
+    the statement ran in. Every result carries the change marker of the tables it was read
+    from, a result is stale once the marker changed.
+
+    Methods:
+        get(sql: str, marker: str, namespace: str = "") -> Optional[pa.Table]:
+            Returns the cached result if its marker is current and it has not expired.
+
+        put(sql: str, table: pa.Table, marker: str, namespace: str = "") -> None:
+            Caches the result, evicting the least recently used ones over the budget.
+
+        invalidate() -> None:
+            Drops all the results.
+
+        stats() -> Dict[str, Any]:
+            Size, bytes, hits, misses and hit ratio of the cache.
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600):
+        """
+        Args:
+            max_bytes (int, optional): Memory budget of the Arrow tables, 0 disables the cache. Defaults to 64 MiB.
+            ttl (float, optional): Number of seconds a result is valid. Defaults to 3600.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Tuple[str, str], _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, sql: str, marker: str, namespace: str = "") -> Optional[Any]:
+        """
+        Returns the cached result of the statement.
+
+        Args:
+            sql (str): The SQL statement
+            marker (str): The current change marker of the tables read by the statement
+            namespace (str, optional): The namespace the statement runs in. Defaults to "".
+
+        Returns:
+            Optional[pa.Table]: the cached result or None if it is not cached, stale or expired
+        """
+        key = (namespace, sql_fingerprint(sql))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (
+                entry.marker != marker or entry.expires_at <= time.monotonic()
+            ):
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            logger.debug(f"Result cache hit for {key}")
+            return entry.table
+
+    def put(self, sql: str, table: Any, marker: str, namespace: str = "") -> None:
+        """
+        Caches the result of the statement.
+
+        Args:
+            sql (str): The SQL statement
+            table (pa.Table): The result
+            marker (str): The change marker of the tables read by the statement
+            namespace (str, optional): The namespace the statement ran in. Defaults to "".
+        """
+        nbytes = table.nbytes
+        if nbytes > self.max_bytes:
+            logger.debug(f"Result of {nbytes} bytes exceeds the result cache budget")
+            return
+        key = (namespace, sql_fingerprint(sql))
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = _Entry(
+                table, nbytes, marker, time.monotonic() + self.ttl
+            )
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, str]):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.nbytes -= entry.nbytes
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        logger.debug("Invalidated result cache")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Statistics of the cache.
+
+        Returns:
+            Dict[str, Any]: size, bytes, hits, misses and hit ratio of the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else math.nan,
+        }
+
+
+class ChangeMarkers:
+    """
+    Thread safe change markers of the tables the bot queries, the last load time of the
+    tables from `COPY_HISTORY` and their last DML or DDL time.
+
+    A marker is read from Snowflake at most once per `interval` seconds per schema.
+
+    Methods:
+        current(session, database: str, schema: str) -> Optional[str]:
+            The marker of the tables in the schema, None if it can't be read.
+    """
+
+    def __init__(self, tables: List[str], interval: float = 30):
+        """
+        Args:
+            tables (List[str]): Names of the tables in the schema
+            interval (float, optional): Seconds a marker is reused. Defaults to 30.
+        """
+        self.tables = [t.strip().upper() for t in tables if t.strip()]
+        self.interval = interval
+        self._markers: Dict[Tuple[str, str], Tuple[float, Optional[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _query(self, database: str, schema: str) -> str:
+        tables = ", ".join(f"'{t}'" for t in self.tables)
+        copy_history = " UNION ALL ".join(
+            f"""SELECT '{t}' AS table_name, MAX(last_load_time) AS changed_at
+            FROM TABLE({database}.information_schema.copy_history(
+                table_name => '{database}.{schema}.{t}',
+                start_time => DATEADD(days, -14, CURRENT_TIMESTAMP())))"""
+            for t in self.tables
+        )
+        return f"""SELECT table_name, changed_at FROM ({copy_history})
+        UNION ALL
+        SELECT table_name, last_altered FROM {database}.information_schema.tables
+        WHERE table_schema = UPPER('{schema}') AND table_name IN ({tables})
+        ORDER BY 1, 2"""
+
+    def current(self, session, database: str, schema: str) -> Optional[str]:
+        """
+        The change marker of the tables.
+
+        Args:
+            session: The Snowpark session
+            database (str): The database of the tables
+            schema (str): The schema of the tables
+
+        Returns:
+            Optional[str]: the marker, None if the tables or their history can't be read
+        """
+        key = (database.upper(), schema.upper())
+        now = time.monotonic()
+        with self._lock:
+            read_at, marker = self._markers.get(key, (-math.inf, None))
+        if now - read_at < self.interval:
+            return marker
+        try:
+            rows = session.sql(self._query(database, schema)).collect()
+            marker = "|".join(f"{row[0]}={row[1]}" for row in rows)
+        except Exception as e:
+            logger.warning(f"Error reading the change marker of {key}, {e}")
+            marker = None
+        with self._lock:
+            self._markers[key] = (now, marker)
+        return marker
+
+
+def select_columns(tables: Iterable[Any], columns: List[str]):
+    """
+    Reduce every Arrow batch of a result to the columns and concatenate them.
+
+    Args:
+        tables (Iterable[pa.Table]): The result, in batches
+        columns (List[str]): The columns needed
+
+    Returns:
+        pa.Table: the columns of the result
+    """
+    # pyarrow comes with the pandas extra of the connector, load it on first use
+    import pyarrow as pa
+
+    batches = [table.select(columns) for table in tables]
+    if not batches:
+        return pa.table({column: pa.array([]) for column in columns})
+    return pa.concat_tables(batches)
+
+
+def fetch_arrow(session, query: str, columns: Optional[List[str]] = None):
+    """
+    Run the query and fetch its result as Arrow, without converting it to pandas.
+
+    When only some columns are needed, the result is streamed in Arrow batches and every
+    batch is reduced to the columns, so the other columns are never held in full.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        columns (List[str], optional): The columns needed. Defaults to None i.e. all.
+
+    Returns:
+        pa.Table: the result
+    """
+    if columns is None:
+        return session.sql(query).to_arrow()
+    return select_columns(session.sql(query).to_arrow_batches(), columns)
+
+
+def _cache_lookup(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    columns: Optional[List[str]],
+    cache: Optional[ResultCache],
+    markers: Optional[ChangeMarkers],
+) -> Tuple[Optional[Any], Callable[[Any], None]]:
+    cache = result_cache if cache is None else cache
+    markers = change_markers if markers is None else markers
+    namespace = f"{database}.{schema}".upper()
+    if columns is not None:
+        namespace = f"{namespace}:{','.join(columns)}"
+    marker = markers.current(session, database, schema) if cache.max_bytes else None
+    if marker is None:
+        return None, lambda table: None
+    return cache.get(query, marker, namespace), lambda table: cache.put(
+        query, table, marker, namespace
+    )
+
+
+def query_to_arrow(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    columns: Optional[List[str]] = None,
+    cache: Optional[ResultCache] = None,
+    markers: Optional[ChangeMarkers] = None,
+    fetch: Callable[..., Any] = fetch_arrow,
+):
+    """
+    Run the query and return its result as an Arrow table, reusing the cached result of the
+    same query as long as the tables of the schema did not change. Queries of other tables
+    are only bounded by the TTL of the cache.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        database (str): The database the statement runs in
+        schema (str): The schema the statement runs in
+        columns (List[str], optional): The columns needed. Defaults to None i.e. all.
+        cache (ResultCache, optional): Defaults to the process wide `result_cache`.
+        markers (ChangeMarkers, optional): Defaults to the process wide `change_markers`.
+        fetch (Callable[..., pa.Table], optional): Runs the query on a cache miss, called
+            with the session, query and columns. Defaults to `fetch_arrow`.
+
+    Returns:
+        pa.Table: the result, shared with the cache
+    """
+    table, store = _cache_lookup(
+        session, query, database, schema, columns, cache, markers
+    )
+    if table is None:
+        table = fetch(session, query, columns)
+        store(table)
+    return table
+
+
+async def query_to_arrow_async(
+    session,
+    query: str,
+    database: str,
+    schema: str,
+    fetch: Callable[..., Awaitable[Any]],
+    run_blocking: Callable[..., Awaitable[Any]],
+    columns: Optional[List[str]] = None,
+    cache: Optional[ResultCache] = None,
+    markers: Optional[ChangeMarkers] = None,
+):
+    """
+    The asyncio variant of `query_to_arrow`, the query runs in the awaited `fetch`.
+
+    Args:
+        session: The Snowpark session
+        query (str): The SQL statement
+        database (str): The database the statement runs in
+        schema (str): The schema the statement runs in
+        fetch (Callable[..., Awaitable[pa.Table]]): Runs the query on a cache miss, called
+            with the session, query and columns
+        run_blocking (Callable[..., Awaitable[Any]]): Runs the blocking change marker read
+        columns (List[str], optional): The columns needed. Defaults to None i.e. all.
+        cache (ResultCache, optional): Defaults to the process wide `result_cache`.
+        markers (ChangeMarkers, optional): Defaults to the process wide `change_markers`.
+
+    Returns:
+        pa.Table: the result, shared with the cache
+    """
+    table, store = await run_blocking(
+        _cache_lookup, session, query, database, schema, columns, cache, markers
+    )
+    if table is None:
+        table = await fetch(session, query, columns)
+        store(table)
+    return table
+
+
+# process wide query result cache, configured via QUERY_RESULT_CACHE_MB and QUERY_RESULT_CACHE_TTL
+result_cache = ResultCache(
+    max_bytes=int(float(os.getenv("QUERY_RESULT_CACHE_MB", 64)) * 1024 * 1024),
+    ttl=float(os.getenv("QUERY_RESULT_CACHE_TTL", 3600)),
+)
+# process wide change markers, configured via QUERY_RESULT_CACHE_TABLES and
+# QUERY_RESULT_MARKER_INTERVAL
+change_markers = ChangeMarkers(
+    tables=os.getenv("QUERY_RESULT_CACHE_TABLES", "support_tickets").split(","),
+    interval=float(os.getenv("QUERY_RESULT_MARKER_INTERVAL", 30)),
+)
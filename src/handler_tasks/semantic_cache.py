@@ -0,0 +1,331 @@
+import math
+import os
+import re
+import threading
+import time
+import zlib
+from decimal import Decimal
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional
+
+import numpy as np
+
+from handler_tasks.answer_cache import (
+    normalize_question,
+    normalize_semantic_model_file,
+)
+from log.logger import get_logger as _logger
+
+logger = _logger("semantic_cache")
+
+# words that carry no meaning for matching questions
+STOP_WORDS = frozenset(
+    [
+        "a", "an", "and", "are", "as", "by", "can", "could", "do", "for", "from",
+        "give", "i", "in", "is", "it", "me", "my", "of", "on", "or", "please",
+        "show", "tell", "the", "to", "us", "we", "what", "whats", "with", "you",
+    ]
+)  # fmt: skip
+
+
+# terms that change the SQL of an otherwise similar question, the dimension values of the
+# demo semantic model and the words picking the rows or the measure
+KEY_TERMS = [
+    "cellular", "business internet", "home internet", "email", "text message",
+    "opened", "closed", "created", "resolved", "raised", "cancelled", "pending",
+    "before", "after", "since", "until", "between", "not", "without", "except",
+    "more", "less", "most", "least", "top", "bottom", "highest", "lowest",
+    "first", "last", "average", "total", "unique", "distinct", "minimum", "maximum",
+    "day", "week", "month", "quarter", "year",
+]  # fmt: skip
+
+# quoted strings, a quote within a word such as "customer's" doesn't start a string
+_QUOTED = re.compile(r"""(?<!\w)(?:'([^']+)'|"([^"]+)")(?!\w)""")
+
+
+def _stem(word: str) -> str:
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _words(question: str) -> List[str]:
+    return [_stem(w) for w in re.findall(r"[a-z0-9_]+", normalize_question(question))]
+
+
+def key_terms(question: str, vocabulary: Iterable[str] = KEY_TERMS) -> FrozenSet[str]:
+    """
+    The literals of the question and the terms of the vocabulary it mentions, two questions
+    only share their SQL if these match exactly.
+
+    Args:
+        question (str): The question asked to Cortex Analyst
+        vocabulary (Iterable[str], optional): The key terms, e.g. dimension values. Defaults to KEY_TERMS.
+
+    Returns:
+        FrozenSet[str]: the numbers, quoted strings and key terms of the question
+
+    Examples:
+    >>> sorted(key_terms("Tickets closed in 2023 with 'Email' contact"))
+    ["'email'", "closed", "email", "n:2023"]
+    """
+    terms = {
+        f"'{(single or double).casefold()}'"
+        for single, double in _QUOTED.findall(question)
+    }
+    terms.update(
+        f"n:{Decimal(n).normalize()}" for n in re.findall(r"\d+(?:\.\d+)?", question)
+    )
+    words = f" {' '.join(_words(question))} "
+    terms.update(term for term in vocabulary if f" {' '.join(_words(term))} " in words)
+    return frozenset(terms)
+
+
+def _tokens(question: str) -> List[str]:
+    """
+    Split the normalized question into features, word stems and character trigrams
+    of each word to be tolerant to plurals and typos.
+    """
+    words = [
+        _stem(w)
+        for w in re.findall(r"[a-z0-9_]+", normalize_question(question))
+        if w not in STOP_WORDS
+    ]
+    features = [f"w:{w}" for w in words]
+    for w in words:
+        padded = f" {w} "
+        features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+class SemanticCache:
+    """
+    A thread safe similarity cache that matches paraphrased questions to earlier Cortex Analyst answers.
+
+    The questions are vectorized locally as TF-IDF vectors of hashed word and character trigram
+    features, the nearest cached question of the same semantic model is found with one
+    matrix-vector product. Only the generated SQL of the matched answer is returned, so only
+    the warehouse query runs again.
+
+    A similar question only matches if its numbers, quoted strings and key terms, e.g. the
+    dimension values of the semantic model, are the same, since its SQL is run as is.
+
+    Methods:
+        get(question: str, semantic_model_file: str) -> Optional[Dict[str, Any]]:
+            Returns the SQL of the most similar cached answer above the threshold.
+
+        put(question: str, semantic_model_file: str, answer: Dict[str, Any]) -> None:
+            Caches the answer, evicting the least recently used one when full.
+
+        invalidate(semantic_model_file: Optional[str] = None) -> None:
+            Drops the answers of the semantic model file or all the answers.
+
+        stats() -> Dict[str, Any]:
+            Returns the hit/miss counters used to tune the threshold.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        max_size: int = 256,
+        ttl: float = 3600,
+        dimensions: int = 4096,
+        vocabulary: Iterable[str] = KEY_TERMS,
+    ):
+        """
+        Args:
+            threshold (float, optional): Minimum cosine similarity of a match. Defaults to 0.8.
+            max_size (int, optional): Maximum number of cached answers, 0 disables the cache. Defaults to 256.
+            ttl (float, optional): Number of seconds an answer is valid. Defaults to 3600.
+            dimensions (int, optional): Number of hashed features. Defaults to 4096.
+            vocabulary (Iterable[str], optional): Key terms that must match. Defaults to KEY_TERMS.
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.dimensions = dimensions
+        self.vocabulary = [t.strip() for t in vocabulary if t.strip()]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._model_files: List[str] = []
+        self._questions: List[str] = []
+        self._key_terms: List[FrozenSet[str]] = []
+        self._answers: List[Dict[str, Any]] = []
+        self._expires_at: List[float] = []
+        self._last_used: List[float] = []
+        self._tf = np.zeros((0, dimensions), dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._questions)
+
+    def _term_frequencies(self, question: str) -> np.ndarray:
+        tf = np.zeros(self.dimensions, dtype=np.float32)
+        for feature in _tokens(question):
+            tf[zlib.crc32(feature.encode()) % self.dimensions] += 1.0
+        return tf
+
+    def _remove(self, indices: List[int]) -> None:
+        removed = set(indices)
+        keep = [i for i in range(len(self._questions)) if i not in removed]
+        self._model_files = [self._model_files[i] for i in keep]
+        self._questions = [self._questions[i] for i in keep]
+        self._key_terms = [self._key_terms[i] for i in keep]
+        self._answers = [self._answers[i] for i in keep]
+        self._expires_at = [self._expires_at[i] for i in keep]
+        self._last_used = [self._last_used[i] for i in keep]
+        self._tf = self._tf[keep]
+
+    def _similarities(self, tf: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarities between the question and all the cached questions,
+        weighing the features by their inverse document frequency.
+        """
+        n = self._tf.shape[0]
+        df = np.count_nonzero(self._tf, axis=0)
+        idf = np.log((1.0 + n) / (1.0 + df)) + 1.0
+        matrix = self._tf * idf
+        vector = tf * idf
+        norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(vector)
+        return np.divide(
+            matrix @ vector, norms, out=np.zeros(n, dtype=np.float32), where=norms > 0
+        )
+
+    def get(self, question: str, semantic_model_file: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the generated SQL of the most similar cached question.
+
+        Args:
+            question (str): The question asked to Cortex Analyst
+            semantic_model_file (str): The semantic model file, `@db.schema.stage/file`
+
+        Returns:
+            Optional[Dict[str, Any]]: the cached answer with only its `sql` content,
+                or None if no cached question is similar enough
+        """
+        model_file = normalize_semantic_model_file(semantic_model_file)
+        tf = self._term_frequencies(question)
+        terms = key_terms(question, self.vocabulary)
+        with self._lock:
+            now = time.monotonic()
+            expired = [i for i, t in enumerate(self._expires_at) if t <= now]
+            if expired:
+                self._remove(expired)
+
+            candidates = np.array(
+                [
+                    m == model_file and k == terms
+                    for m, k in zip(self._model_files, self._key_terms)
+                ],
+                dtype=bool,
+            )
+            if not candidates.any() or not tf.any():
+                self.misses += 1
+                return None
+
+            similarities = np.where(candidates, self._similarities(tf), -1.0)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                logger.debug(
+                    f"Semantic cache miss, best similarity {similarities[best]:.3f} for '{self._questions[best]}'"
+                )
+                self.misses += 1
+                return None
+
+            logger.debug(
+                f"Semantic cache hit, similarity {similarities[best]:.3f} for '{self._questions[best]}'"
+            )
+            self.hits += 1
+            self._last_used[best] = now
+            answer = self._answers[best]
+            if self._questions[best] == normalize_question(question):
+                # same question, the whole answer is still valid
+                return answer
+
+        content = [c for c in answer["message"]["content"] if c["type"] == "sql"]
+        return {
+            **answer,
+            "message": {**answer["message"], "content": content},
+        }
+
+    def put(
+        self, question: str, semantic_model_file: str, answer: Dict[str, Any]
+    ) -> None:
+        """
+        Caches the answer of the question, answers without generated SQL are not cached.
+
+        Args:
+            question (str): The question asked to Cortex Analyst
+            semantic_model_file (str): The semantic model file, `@db.schema.stage/file`
+            answer (Dict[str, Any]): The Cortex Analyst answer
+        """
+        if self.max_size <= 0:
+            return
+        if not any(c["type"] == "sql" for c in answer["message"]["content"]):
+            return
+        tf = self._term_frequencies(question)
+        terms = key_terms(question, self.vocabulary)
+        model_file = normalize_semantic_model_file(semantic_model_file)
+        question = normalize_question(question)
+        with self._lock:
+            self._remove(
+                [
+                    i
+                    for i, (m, q) in enumerate(zip(self._model_files, self._questions))
+                    if m == model_file and q == question
+                ]
+            )
+            if len(self._questions) >= self.max_size:
+                self._remove([int(np.argmin(self._last_used))])
+            now = time.monotonic()
+            self._model_files.append(model_file)
+            self._questions.append(question)
+            self._key_terms.append(terms)
+            self._answers.append(answer)
+            self._expires_at.append(now + self.ttl)
+            self._last_used.append(now)
+            self._tf = np.vstack([self._tf, tf])
+
+    def invalidate(self, semantic_model_file: Optional[str] = None) -> None:
+        """
+        Drops the cached answers.
+
+        Args:
+            semantic_model_file (str, optional): Drop only the answers of this semantic model file.
+                Defaults to None i.e. drop all.
+        """
+        with self._lock:
+            if semantic_model_file is None:
+                self._remove(list(range(len(self._questions))))
+            else:
+                model_file = normalize_semantic_model_file(semantic_model_file)
+                self._remove(
+                    [i for i, m in enumerate(self._model_files) if m == model_file]
+                )
+        logger.debug(f"Invalidated semantic cache for {semantic_model_file or 'all'}")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Returns the cache counters.
+
+        Returns:
+            Dict[str, Any]: size, hits, misses and hit ratio of the cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else math.nan,
+        }
+
+
+# process wide semantic cache, configured via CORTEX_SEMANTIC_CACHE_THRESHOLD,
+# CORTEX_SEMANTIC_CACHE_SIZE, CORTEX_SEMANTIC_CACHE_TTL and CORTEX_SEMANTIC_CACHE_KEY_TERMS
+semantic_cache = SemanticCache(
+    threshold=float(os.getenv("CORTEX_SEMANTIC_CACHE_THRESHOLD", 0.8)),
+    max_size=int(os.getenv("CORTEX_SEMANTIC_CACHE_SIZE", 256)),
+    ttl=float(os.getenv("CORTEX_SEMANTIC_CACHE_TTL", 3600)),
+    vocabulary=(
+        os.getenv("CORTEX_SEMANTIC_CACHE_KEY_TERMS").split(",")
+        if os.getenv("CORTEX_SEMANTIC_CACHE_KEY_TERMS")
+        else KEY_TERMS
+    ),
+)
@@ -0,0 +1,101 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("session")
+
+
+def create_session(connection_name: Optional[str] = None) -> Any:
+    """
+    Open a Snowpark session using a connection of `connections.toml`.
+
+    Args:
+        connection_name (str, optional): Name of the connection. Defaults to
+            SNOWFLAKE_CONNECTION_NAME or `default`.
+
+    Returns:
+        Session: the Snowpark session
+    """
+    # Snowpark takes more than a second to import, keep it off the startup path
+    from snowflake.snowpark.session import Session
+
+    session = Session.builder.config(
+        "connection_name",
+        connection_name or os.getenv("SNOWFLAKE_CONNECTION_NAME", "default"),
+    ).create()
+    logger.debug(
+        f"Account:{session.conf.get('account')},User:{session.conf.get('user')}"
+    )
+    session.sql("DESC USER")
+    return session
+
+
+class BackgroundSession:
+    """
+    Opens the Snowpark session on a background thread, so that the bot connects to Slack
+    in the meantime. The handlers needing the session wait for it.
+
+    Methods:
+        start() -> BackgroundSession:
+            Starts opening the session, once.
+
+        get(timeout: Optional[float] = None) -> Session:
+            Waits for the session, raises the error that occurred opening it.
+
+        ready -> bool:
+            Whether the session is open.
+    """
+
+    def __init__(self, factory: Callable[[], Any] = create_session):
+        """
+        Args:
+            factory (Callable[[], Any], optional): Opens the session. Defaults to `create_session`.
+        """
+        self.factory = factory
+        self._future: Future = Future()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self._future.done() and self._future.exception() is None
+
+    def start(self) -> "BackgroundSession":
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._open, name="snowpark_session", daemon=True
+                )
+                self._thread.start()
+        return self
+
+    def _open(self):
+        started_at = time.monotonic()
+        try:
+            session = self.factory()
+        except Exception as e:
+            logger.error(f"Error establishing connection,{e}", exc_info=True)
+            self._future.set_exception(e)
+            return
+        logger.info(f"Opened Snowpark session in {time.monotonic() - started_at:.2f}s")
+        self._future.set_result(session)
+
+    def get(self, timeout: Optional[float] = None) -> Any:
+        """
+        Waits for the session.
+
+        Args:
+            timeout (float, optional): Seconds to wait. Defaults to None i.e. forever.
+
+        Returns:
+            Session: the Snowpark session
+
+        Raises:
+            TimeoutError: If the session is not open within the timeout
+            Exception: The error that occurred opening the session
+        """
+        return self.start()._future.result(timeout)
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from log.logger import get_logger as _logger
+
+logger = _logger("single_flight")
+
+
+class _Call:
+    """
+    An in-flight call whose result is shared with all the callers waiting on it.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key, only the first caller runs the function
+    and the callers that arrive while it is in flight wait for and receive its result or error.
+
+    Methods:
+        do(key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+            Runs the function once for all the concurrent callers of the same key.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Runs `fn(*args, **kwargs)` unless a call with the same key is already in flight,
+        in that case waits for it and returns its result.
+
+        Args:
+            key (Hashable): Identifies identical calls
+            fn (Callable): The function to call
+
+        Returns:
+            Any: the result of the call
+
+        Raises:
+            Exception: The error raised by the call, raised to every caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                leader = True
+
+        if not leader:
+            logger.debug(f"Joining in-flight call for {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        except BaseException as e:
+            # e.g. interrupted, the waiters must not take the missing result for None
+            call.error = RuntimeError(f"The shared call for {key} was interrupted")
+            call.error.__cause__ = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.debug(f"Shared call for {key} with {call.waiters} caller(s)")
+            call.done.set()
+
+
+class _AsyncCall:
+    """
+    An in-flight coroutine, run as its own task, and the number of callers awaiting it.
+    """
+
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """
+    The asyncio version of SingleFlight, the callers that arrive while a coroutine with the
+    same key is in flight await its result instead of running their own.
+
+    The coroutine runs as its own task, so a caller being cancelled, the first one
+    included, doesn't cancel it for the others. It is cancelled once all its callers are.
+
+    Methods:
+        do(key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs) -> Any:
+            Coroutine awaiting the function once for all the concurrent callers of the same key.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _AsyncCall] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable[Any]], *args, **kwargs
+    ) -> Any:
+        """
+        Awaits `fn(*args, **kwargs)` unless a call with the same key is already in flight,
+        in that case awaits its result.
+
+        Args:
+            key (Hashable): Identifies identical calls
+            fn (Callable[..., Awaitable]): The coroutine function to call
+
+        Returns:
+            Any: the result of the call
+
+        Raises:
+            Exception: The error raised by the call, raised to every caller
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            logger.debug(f"Joining in-flight call for {key}")
+        else:
+            call = _AsyncCall(asyncio.ensure_future(fn(*args, **kwargs)))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._done(key, call))
+
+        call.waiters += 1
+        try:
+            # a caller being cancelled must not cancel the shared call
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                logger.debug(f"All the callers of {key} left, cancelling the call")
+                call.task.cancel()
+
+    def _done(self, key: Hashable, call: _AsyncCall) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if not call.task.cancelled() and call.task.exception() is not None:
+            # the error is raised to the callers, don't warn if none awaited it
+            logger.debug(f"Shared call for {key} failed, {call.task.exception()}")
@@ -0,0 +1,233 @@
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple, Union
+
+from log.logger import get_logger as _logger
+
+logger = _logger("traffic_log")
+
+# response headers worth keeping, the request headers (and the JWT) are never recorded
+RECORDED_HEADERS = ("X-Snowflake-Request-Id", "Retry-After", "Content-Type")
+
+
+def payload_key(payload: Dict[str, Any]) -> str:
+    """
+    Canonical form of a request payload, used to match a request with its recording.
+    """
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"))
+
+
+class TrafficLog:
+    """
+    A thread safe, append only JSON lines log of Cortex Analyst requests and responses.
+
+    Every line is one exchange: the request payload, the response status, the recorded
+    headers (including `X-Snowflake-Request-Id`), the body (or the lines of a streamed
+    body) and the latency in seconds.
+
+    Methods:
+        write(record: Dict[str, Any]) -> None:
+            Appends the record to the log.
+
+        read() -> List[Dict[str, Any]]:
+            Returns all the records of the log.
+    """
+
+    def __init__(self, path: Union[Path, str]):
+        """
+        Args:
+            path (Path | str): The JSON lines file of the log
+        """
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, separators=(",", ":"))
+        with self._lock:
+            try:
+                with self.path.open(mode="a") as file:
+                    file.write(f"{line}\n")
+            except Exception as e:
+                logger.warning(f"Error recording Cortex Analyst traffic, {e}")
+
+    def read(self) -> List[Dict[str, Any]]:
+        with self.path.open(mode="r") as file:
+            return [json.loads(line) for line in file if line.strip()]
+
+
+class RecordedResponse:
+    """
+    A response replayed from the traffic log, it exposes the parts of `requests.Response`
+    used by Cortlayst.
+    """
+
+    def __init__(
+        self,
+        status_code: int,
+        headers: Dict[str, str],
+        text: str = "",
+        lines: Optional[List[str]] = None,
+    ):
+        self.status_code = status_code
+        self.headers = headers
+        self.lines = lines
+        self.text = text if lines is None else "\n".join(lines)
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+    def iter_lines(self) -> Iterator[bytes]:
+        for line in self.lines if self.lines is not None else self.text.splitlines():
+            yield line.encode("utf-8")
+
+    def close(self) -> None:
+        pass
+
+
+class RecordingStreamResponse:
+    """
+    Wraps a streamed response, the lines are recorded as they are read and the exchange
+    is written to the log when the response is closed.
+    """
+
+    def __init__(self, resp, log: TrafficLog, record: Dict[str, Any], started: float):
+        self._resp = resp
+        self._log = log
+        self._record = record
+        self._started = started
+        self._lines: List[str] = []
+        self._written = False
+
+    def __getattr__(self, name: str):
+        return getattr(self._resp, name)
+
+    def iter_lines(self) -> Iterator[bytes]:
+        for line in self._resp.iter_lines():
+            self._lines.append(
+                line.decode("utf-8") if isinstance(line, bytes) else line
+            )
+            yield line
+
+    def close(self) -> None:
+        try:
+            self._resp.close()
+        finally:
+            if not self._written:
+                self._written = True
+                self._log.write(
+                    {
+                        **self._record,
+                        "lines": self._lines,
+                        "latency": round(time.monotonic() - self._started, 4),
+                    }
+                )
+
+
+class RecordingTransport:
+    """
+    Wraps an HTTP transport and records every Cortex Analyst exchange to a TrafficLog.
+
+    Methods:
+        post(url, json=None, headers=None, timeout=None, stream=False):
+            Sends the request using the wrapped transport and records the exchange.
+
+        close() -> None:
+            Closes the wrapped transport.
+    """
+
+    def __init__(self, transport, log: TrafficLog):
+        """
+        Args:
+            transport: The wrapped transport, e.g. a `requests.Session`
+            log (TrafficLog): The log the exchanges are recorded to
+        """
+        self.transport = transport
+        self.log = log
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        started = time.monotonic()
+        resp = self.transport.post(
+            url, json=json, headers=headers, timeout=timeout, stream=stream
+        )
+        record = {
+            "ts": time.time(),
+            "payload": json,
+            "status_code": resp.status_code,
+            "headers": {
+                h: resp.headers[h] for h in RECORDED_HEADERS if h in resp.headers
+            },
+        }
+        if stream and resp.status_code == 200:
+            return RecordingStreamResponse(resp, self.log, record, started)
+        self.log.write(
+            {
+                **record,
+                "text": resp.text,
+                "latency": round(time.monotonic() - started, 4),
+            }
+        )
+        return resp
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class ReplayTransport:
+    """
+    Serves the Cortex Analyst responses of a TrafficLog instead of calling Cortex Analyst.
+
+    The requests are matched on their payload, the responses recorded for the same payload
+    are served in the recorded order and start over when exhausted. A request that was
+    not recorded gets a 404 response.
+
+    Methods:
+        post(url, json=None, headers=None, timeout=None, stream=False) -> RecordedResponse:
+            Returns the next recorded response of the payload.
+
+        close() -> None:
+            Does nothing, nothing is held open.
+    """
+
+    def __init__(self, log: TrafficLog, realtime: bool = False):
+        """
+        Args:
+            log (TrafficLog): The recorded traffic
+            realtime (bool, optional): Wait for the recorded latency before responding. Defaults to False.
+        """
+        self.realtime = realtime
+        self._responses: Dict[Tuple[str, bool], Deque[Dict[str, Any]]] = defaultdict(
+            deque
+        )
+        for record in log.read():
+            payload = record["payload"] or {}
+            self._responses[(payload_key(payload), bool(payload.get("stream")))].append(
+                record
+            )
+        self._lock = threading.Lock()
+        logger.debug(
+            f"Loaded {len(self._responses)} recorded request(s) from {log.path}"
+        )
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        key = (payload_key(json or {}), bool(stream))
+        with self._lock:
+            records = self._responses.get(key)
+            if not records:
+                logger.warning("No recorded Cortex Analyst response for the request")
+                return RecordedResponse(404, {}, "No recorded response")
+            record = records[0]
+            records.rotate(-1)
+        if self.realtime:
+            time.sleep(record.get("latency", 0))
+        return RecordedResponse(
+            record["status_code"],
+            record["headers"],
+            record.get("text", ""),
+            record.get("lines"),
+        )
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,339 @@
+"""
+A local stand-in for the Cortex Analyst message API, `/api/v2/cortex/analyst/message`,
+to load test the bot without network access or Snowflake credits.
+
+Point the bot to it using `CORTEX_ANALYST_BASE_URL=http://localhost:8080` and run:
+
+    python -m loadtest.mock_analyst_server --port 8080 --latency lognormal:-0.5,0.4 --error-rate 0.05
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("mock_analyst_server")
+
+ANALYST_PATH = "/api/v2/cortex/analyst/message"
+
+# Default answer, `{question}`, `{database}` and `{schema}` are replaced from the request
+DEFAULT_RESPONSES: List[Dict[str, Any]] = [
+    {
+        "content": [
+            {
+                "type": "text",
+                "text": "This is our interpretation of your question:\n\n__{question}__",
+            },
+            {
+                "type": "sql",
+                "statement": "SELECT service_type, COUNT(*) AS ticket_count FROM {database}.{schema}.support_tickets GROUP BY service_type",
+            },
+        ]
+    }
+]
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """
+    Parse a latency distribution, all values are in seconds.
+
+    Args:
+        spec (str): One of `fixed:<seconds>`, `uniform:<low>,<high>`, `exponential:<mean>`
+            or `lognormal:<mu>,<sigma>`
+
+    Returns:
+        Callable[[random.Random], float]: samples a latency using the given random generator
+
+    Raises:
+        ValueError: If the distribution is unknown or its parameters are invalid
+    """
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    match name, len(values):
+        case "fixed", 1:
+            return lambda rng: values[0]
+        case "uniform", 2:
+            return lambda rng: rng.uniform(values[0], values[1])
+        case "exponential", 1:
+            return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0
+        case "lognormal", 2:
+            return lambda rng: rng.lognormvariate(values[0], values[1])
+        case _:
+            raise ValueError(f"Invalid latency distribution '{spec}'")
+
+
+def _b64_json(segment: str) -> Dict[str, Any]:
+    return json.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))
+
+
+def validate_jwt(token: str) -> Optional[str]:
+    """
+    Check the format of a key pair JWT as minted by JWTGenerator, the signature is not verified.
+
+    Args:
+        token (str): The JWT
+
+    Returns:
+        Optional[str]: the reason the token is invalid, None if it is valid
+    """
+    segments = token.split(".")
+    if len(segments) != 3:
+        return "JWT must have 3 segments"
+    try:
+        header, claims = _b64_json(segments[0]), _b64_json(segments[1])
+    except Exception:
+        return "JWT header or claims are not base64 encoded JSON"
+    if header.get("alg") != "RS256":
+        return "JWT must be signed using RS256"
+    issuer, subject = claims.get("iss", ""), claims.get("sub", "")
+    if not subject or not issuer.startswith(f"{subject}.SHA256:"):
+        return (
+            "JWT issuer must be '<ACCOUNT>.<USER>.SHA256:<fingerprint>' of the subject"
+        )
+    if claims.get("exp", 0) <= time.time():
+        return "JWT has expired"
+    return None
+
+
+class MockAnalystServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server that answers Cortex Analyst message requests with canned answers.
+
+    Attributes:
+        responses: Canned answers picked round robin, their strings are templates
+        latency: Latency distribution of the answers
+        error_rate: Fraction of requests failed with a 429, 500 or 503
+        requests_served: Number of requests handled
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address=("127.0.0.1", 8080),
+        responses: Optional[List[Dict[str, Any]]] = None,
+        latency: str = "fixed:0",
+        error_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(address, MockAnalystHandler)
+        self.responses = responses or DEFAULT_RESPONSES
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.requests_served = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def next_response(self) -> Dict[str, Any]:
+        """
+        Picks the next canned answer along with its latency and whether it fails.
+        """
+        with self._lock:
+            response = self.responses[self.requests_served % len(self.responses)]
+            self.requests_served += 1
+            return {
+                "response": response,
+                "latency": max(0.0, self.latency(self._rng)),
+                "error": (
+                    self._rng.choice([429, 500, 503])
+                    if self._rng.random() < self.error_rate
+                    else None
+                ),
+            }
+
+
+def render(template: Any, values: Dict[str, str]) -> Any:
+    """
+    Replace the `{name}` placeholders of all the strings in the template.
+    """
+    if isinstance(template, str):
+        for name, value in values.items():
+            template = template.replace(f"{{{name}}}", value)
+        return template
+    if isinstance(template, list):
+        return [render(t, values) for t in template]
+    if isinstance(template, dict):
+        return {k: render(v, values) for k, v in template.items()}
+    return template
+
+
+class MockAnalystHandler(BaseHTTPRequestHandler):
+    """
+    Handles the Cortex Analyst message requests of MockAnalystServer.
+    """
+
+    server: MockAnalystServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def _send_json(
+        self,
+        status: int,
+        body: Dict[str, Any],
+        request_id: str,
+        headers: Optional[Dict[str, str]] = None,
+    ):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Snowflake-Request-Id", request_id)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, content: List[Dict[str, Any]], request_id: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("X-Snowflake-Request-Id", request_id)
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(name: str, data: Dict[str, Any]):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+        event("status", {"status": "interpreting_question"})
+        for index, item in enumerate(content):
+            match item["type"]:
+                case "text":
+                    for word in item["text"].split(" "):
+                        event(
+                            "message.content.delta",
+                            {"index": index, "type": "text", "text_delta": f"{word} "},
+                        )
+                case "sql":
+                    event(
+                        "message.content.delta",
+                        {
+                            "index": index,
+                            "type": "sql",
+                            "statement_delta": item["statement"],
+                        },
+                    )
+                case "suggestions":
+                    for i, suggestion in enumerate(item["suggestions"]):
+                        event(
+                            "message.content.delta",
+                            {
+                                "index": index,
+                                "type": "suggestions",
+                                "suggestions_delta": {
+                                    "index": i,
+                                    "suggestion_delta": suggestion,
+                                },
+                            },
+                        )
+        event("status", {"status": "done"})
+        event("done", {})
+
+    def do_POST(self):
+        request_id = str(uuid.uuid4())
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if self.path != ANALYST_PATH:
+            return self._send_json(404, {"message": "Not Found"}, request_id)
+
+        if self.headers.get("X-Snowflake-Authorization-Token-Type") != "KEYPAIR_JWT":
+            return self._send_json(
+                401,
+                {"message": "X-Snowflake-Authorization-Token-Type must be KEYPAIR_JWT"},
+                request_id,
+            )
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer "):
+            return self._send_json(401, {"message": "Missing bearer token"}, request_id)
+        invalid = validate_jwt(authorization[len("Bearer ") :])
+        if invalid is not None:
+            return self._send_json(401, {"message": invalid}, request_id)
+
+        try:
+            payload = json.loads(body)
+            question = payload["messages"][-1]["content"][0]["text"]
+            database, schema = payload["semantic_model_file"][1:].split(".")[:2]
+        except Exception as e:
+            return self._send_json(
+                400, {"message": f"Invalid request payload, {e}"}, request_id
+            )
+
+        answer = self.server.next_response()
+        time.sleep(answer["latency"])
+        if answer["error"] is not None:
+            return self._send_json(
+                answer["error"],
+                {"message": "Injected failure", "request_id": request_id},
+                request_id,
+                {"Retry-After": "1"} if answer["error"] == 429 else None,
+            )
+
+        content = render(
+            answer["response"]["content"],
+            {"question": question, "database": database, "schema": schema},
+        )
+        if payload.get("stream"):
+            return self._send_stream(content, request_id)
+        self._send_json(
+            200,
+            {"message": {"role": "analyst", "content": content}},
+            request_id,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock Cortex Analyst server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--responses",
+        type=Path,
+        help="JSON file with a list of canned answers, each with a 'content' list",
+    )
+    parser.add_argument(
+        "--latency",
+        default="fixed:0",
+        help="fixed:<s>, uniform:<low>,<high>, exponential:<mean> or lognormal:<mu>,<sigma>",
+    )
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    responses = None
+    if args.responses is not None:
+        with args.responses.open(mode="r") as file:
+            responses = json.load(file)
+
+    server = MockAnalystServer(
+        (args.host, args.port),
+        responses=responses,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        seed=args.seed,
+    )
+    print(f"Mock Cortex Analyst listening on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+"""
+Measures the import time of the bot at startup using `python -X importtime`, to keep
+heavy, rarely used modules such as altair or snowflake.core off the startup path.
+
+By default the imports of the bot script are measured, without running it:
+
+    python -m loadtest.startup_benchmark ../app.py --repeat 5 --top 15
+
+Use `--run` to import the script as a whole, which needs SLACK_BOT_TOKEN and the
+Snowflake connection.
+"""
+
+import argparse
+import ast
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional
+
+from log.logger import get_logger as _logger
+
+logger = _logger("startup_benchmark")
+
+_IMPORT_TIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+# modules expected to load lazily, reported when they are imported at startup
+LAZY_MODULES = ["altair", "snowflake.core", "snowflake.snowpark", "pandas"]
+
+
+class ImportTime(NamedTuple):
+    """
+    The import time of a module, in microseconds.
+    """
+
+    module: str
+    self_us: int
+    cumulative_us: int
+    level: int
+
+
+def parse_importtime(output: str) -> List[ImportTime]:
+    """
+    Parse the `-X importtime` report written to stderr.
+
+    Args:
+        output (str): The stderr of the Python process
+
+    Returns:
+        List[ImportTime]: the import time of every module, in import order
+    """
+    times = []
+    for line in output.splitlines():
+        match = _IMPORT_TIME.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            times.append(
+                ImportTime(
+                    module, int(self_us), int(cumulative_us), (len(indent) - 1) // 2
+                )
+            )
+    return times
+
+
+def script_imports(script: Path) -> str:
+    """
+    The module level import statements of a script, as code to import them only.
+
+    Args:
+        script (Path): The bot script, e.g. `app.py`
+
+    Returns:
+        str: the import statements
+    """
+    tree = ast.parse(script.read_text(), filename=str(script))
+    return "\n".join(
+        ast.unparse(node)
+        for node in tree.body
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    )
+
+
+def measure(code: str, paths: List[str]) -> List[ImportTime]:
+    """
+    Run the code in a new interpreter with `-X importtime`.
+
+    Args:
+        code (str): The code to run
+        paths (List[str]): Directories prepended to PYTHONPATH
+
+    Returns:
+        List[ImportTime]: the import time of every module
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        paths + [env["PYTHONPATH"]] if env.get("PYTHONPATH") else paths
+    )
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode != 0:
+        logger.warning(
+            f"Startup exited with {process.returncode}, the report is partial:\n"
+            + "\n".join(
+                line
+                for line in process.stderr.splitlines()
+                if not line.startswith("import time:")
+            )
+        )
+    return parse_importtime(process.stderr)
+
+
+def summarize(runs: List[List[ImportTime]], top: int = 10) -> Dict[str, object]:
+    """
+    Summarize the runs, using the median of every measure.
+
+    Args:
+        runs (List[List[ImportTime]]): The import times of every run
+        top (int, optional): Number of slowest top level imports reported. Defaults to 10.
+
+    Returns:
+        Dict[str, object]: the total import seconds, the slowest top level imports and
+            the lazy modules that were imported
+    """
+    totals = [sum(t.cumulative_us for t in run if t.level == 0) for run in runs]
+    cumulative: Dict[str, List[int]] = {}
+    for run in runs:
+        for t in run:
+            if t.level == 0:
+                cumulative.setdefault(t.module, []).append(t.cumulative_us)
+    slowest = sorted(
+        ((m, statistics.median(us) / 1e6) for m, us in cumulative.items()),
+        key=lambda item: item[1],
+        reverse=True,
+    )[:top]
+    imported = {t.module for run in runs for t in run}
+    return {
+        "total_seconds": statistics.median(totals) / 1e6 if totals else 0.0,
+        "slowest": slowest,
+        "eager_lazy_modules": [m for m in LAZY_MODULES if m in imported],
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Bot startup import benchmark")
+    parser.add_argument(
+        "script",
+        nargs="?",
+        default=str(Path(__file__).resolve().parents[2].joinpath("app.py")),
+        help="The bot script, defaults to app.py",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Number of runs")
+    parser.add_argument(
+        "--top", type=int, default=10, help="Number of slowest imports shown"
+    )
+    parser.add_argument(
+        "--run",
+        action="store_true",
+        help="Import the whole script instead of its import statements",
+    )
+    args = parser.parse_args(argv)
+
+    script = Path(args.script).resolve()
+    paths = [str(Path(__file__).resolve().parents[1]), str(script.parent)]
+    code = f"import {script.stem}" if args.run else script_imports(script)
+    runs = [measure(code, paths) for _ in range(max(1, args.repeat))]
+    summary = summarize(runs, args.top)
+
+    print(f"Startup imports of {script.name}: {summary['total_seconds']:.3f}s")
+    for module, seconds in summary["slowest"]:
+        print(f"  {seconds:8.3f}s  {module}")
+    if summary["eager_lazy_modules"]:
+        print(f"Imported at startup: {', '.join(summary['eager_lazy_modules'])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,15 @@
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
-from cryptography.hazmat.primitives.serialization import Encoding
-from cryptography.hazmat.primitives.serialization import PublicFormat
-from cryptography.hazmat.backends import default_backend
 from datetime import timedelta, timezone, datetime
-import base64
-import hashlib
 import logging
-import os
+import threading
+import time
+import weakref
 from log.logger import get_logger as _logger
+from security.key_material import (
+    KeyMaterial,
+    fingerprint_of,
+    get_key_material,
+)
+from security.token_store import StoredToken, TokenStore, token_store
 
 # This class relies on the PyJWT module (https://pypi.org/project/PyJWT/).
 import jwt
@@ -28,26 +30,31 @@ ISSUE_TIME = "iat"
 SUBJECT = "sub"
 
 
-# If you generated an encrypted private key, implement this method to return
-# the passphrase for decrypting your private key. As an example, this function
-# prompts the user for the passphrase.
-def get_private_key_passphrase():
-    private_key_passphrase = os.getenv("PRIVATE_KEY_PASSPHRASE")
-
-    if private_key_passphrase is not None:
-        return private_key_passphrase
-
-    raise Exception(
-        f"Key is encrypted please add the passphrase via 'PRIVATE_KEY_PASSPHRASE'."
-    )
+def _renew_in_background(generator_ref: "weakref.ref[JWTGenerator]"):
+    """
+    Timer callback renewing the token, it only holds a weak reference so a discarded
+    generator is not kept alive by its timer.
+    """
+    generator = generator_ref()
+    if generator is not None:
+        generator.renew()
 
 
 class JWTGenerator(object):
     """
     Creates and signs a JWT with the specified private key file, username, and account identifier. The JWTGenerator keeps the
     generated token and only regenerates the token if a specified period of time has passed.
+
+    The token is shared by all the threads, it is read without locking and, unless background renewal is disabled,
+    renewed by a timer ahead of its expiry so requests never pay the RSA signing cost.
+
+    Tokens are also shared through a TokenStore, by default within the process. With a file store on a shared volume
+    one process (the leader) signs the renewed token and the other processes and replicas read it.
     """
 
+    # Seconds to wait for the leader to store a renewed token before signing one.
+    LEADER_WAIT = 2.0
+
     LIFETIME = timedelta(minutes=59)  # The tokens will have a 59 minute lifetime
     RENEWAL_DELTA = timedelta(minutes=54)  # Tokens will be renewed after 54 minutes
     ALGORITHM = "RS256"  # Tokens will be generated using RSA with SHA256
@@ -59,6 +66,8 @@ class JWTGenerator(object):
         private_key_file_path: Text,
         lifetime: timedelta = LIFETIME,
         renewal_delay: timedelta = RENEWAL_DELTA,
+        background_renewal: bool = True,
+        token_store: TokenStore = token_store,
     ):
         """
         __init__ creates an object that generates JWTs for the specified user, account identifier, and private key.
@@ -67,6 +76,9 @@ class JWTGenerator(object):
         :param private_key_file_path: Path to the private key file used for signing the JWTs.
         :param lifetime: The number of minutes (as a timedelta) during which the key will be valid.
         :param renewal_delay: The number of minutes (as a timedelta) from now after which the JWT generator should renew the JWT.
+        :param background_renewal: Sign the first token now and renew it on a background timer, otherwise the token is
+            signed on first use and renewed when it is requested after the renewal time.
+        :param token_store: The store sharing the tokens with the other generators of the same user and key.
         """
 
         logger.info(
@@ -86,22 +98,36 @@ class JWTGenerator(object):
         self.lifetime = lifetime
         self.renewal_delay = renewal_delay
         self.private_key_file_path = private_key_file_path
-        self.renew_time = datetime.now(timezone.utc)
-        self.token = None
+        self.background_renewal = background_renewal
+        self.token_store = token_store
+        # the token, its renewal time and the version of the key that signed it are replaced
+        # together so they are read without a lock
+        self._state = (None, datetime.now(timezone.utc), 0)
+        self._lock = threading.Lock()
+        self._timer = None
 
-        # Load the private key from the specified file.
-        with open(self.private_key_file_path, "rb") as pem_in:
-            pemlines = pem_in.read()
-            try:
-                # Try to access the private key without a passphrase.
-                self.private_key = load_pem_private_key(
-                    pemlines, None, default_backend()
-                )
-            except TypeError:
-                # If that fails, provide the passphrase returned from get_private_key_passphrase().
-                self.private_key = load_pem_private_key(
-                    pemlines, get_private_key_passphrase().encode(), default_backend()
-                )
+        # The private key and its fingerprint are loaded once and shared by all the generators
+        # of the key file, the file is watched for rotation.
+        self.key_material: KeyMaterial = get_key_material(self.private_key_file_path)
+
+        if self.background_renewal:
+            self.renew()
+
+    @property
+    def private_key(self):
+        return self.key_material.private_key
+
+    @property
+    def public_key_fp(self) -> Text:
+        return self.key_material.jwt_fingerprint
+
+    @property
+    def token(self) -> Text:
+        return self._state[0]
+
+    @property
+    def renew_time(self) -> datetime:
+        return self._state[1]
 
     def prepare_account_name_for_jwt(self, raw_account: Text) -> Text:
         """
@@ -128,55 +154,181 @@ class JWTGenerator(object):
         """
         Generates a new JWT. If a JWT has been already been generated earlier, return the previously generated token unless the
         specified renewal time has passed.
+        With background renewal a token past its renewal time is still returned while it is valid, the renewal is
+        left to the timer.
         :return: the new token
         """
+        token, renew_time, key_version = self._state
+        now = datetime.now(timezone.utc)
+        # a rotated key invalidates the token signed by the previous key
+        self.key_material.refresh()
+        if key_version != self.key_material.version:
+            return self.renew()
+        if token is not None and (
+            renew_time > now
+            or (self.background_renewal and renew_time + self.grace_period > now)
+        ):
+            return token
+        return self.renew(now)
+
+    @property
+    def grace_period(self) -> timedelta:
+        """
+        Time between the renewal of a token and its expiry.
+        """
+        return max(self.lifetime - self.renewal_delay, timedelta(0))
+
+    def renew(self, due: datetime = None) -> Text:
+        """
+        Renews the token using the current key and, with background renewal, schedules the next renewal.
+        The token is read from the token store if another generator renewed it, otherwise it is signed.
+        :param due: Only renew if the current token is due for renewal at this time, defaults to always renew.
+        :return: the current token
+        """
+        with self._lock:
+            token, renew_time, key_version = self._state
+            # another thread renewed the token while this one waited for the lock
+            if (
+                due is not None
+                and token is not None
+                and renew_time > due
+                and key_version == self.key_material.version
+            ):
+                return token
+            try:
+                token, renew_time, key_version = self._fetch_or_sign()
+                self._state = (token, renew_time, key_version)
+            except Exception as e:
+                expired = renew_time + self.grace_period <= datetime.now(timezone.utc)
+                if token is None or expired or not self.background_renewal:
+                    raise
+                # the current token is still valid, try again before it expires
+                logger.warning("Error renewing the JWT, retrying in a minute: %s", e)
+                self._schedule(timedelta(minutes=1))
+                return token
+            if self.background_renewal:
+                self._schedule(
+                    max(renew_time - datetime.now(timezone.utc), timedelta(seconds=1))
+                )
+            return token
+
+    def _fetch_or_sign(self):
+        """
+        Reads the renewed token from the token store or, if elected leader or the leader does not
+        store one in time, signs it.
+        :return: the token, the time it should be renewed and the version of the key that signed it
+        """
+        key_material = self.key_material.snapshot()
+        # tokens are only shared between the generators of the same user and key
+        key = f"{self.qualified_username}.SHA256:{key_material.fingerprint}"
+
+        def fetch():
+            stored = self.token_store.get(key)
+            if stored is not None and stored.renew_at > time.time():
+                logger.debug("Using the JWT renewed by another generator")
+                return (
+                    stored.token,
+                    datetime.fromtimestamp(stored.renew_at, timezone.utc),
+                    key_material.version,
+                )
+            return None
+
+        fetched = fetch()
+        if fetched is not None:
+            return fetched
+
+        with self.token_store.leader(key) as leader:
+            if leader:
+                # the previous leader may have stored it while this one was elected
+                fetched = fetch()
+                if fetched is not None:
+                    return fetched
+                signed = self._sign(key_material)
+                try:
+                    self.token_store.put(
+                        key,
+                        StoredToken(
+                            signed[0],
+                            signed[1].timestamp(),
+                            (
+                                signed[1] - self.renewal_delay + self.lifetime
+                            ).timestamp(),
+                        ),
+                    )
+                except Exception as e:
+                    logger.warning("Error storing the JWT: %s", e)
+                return signed
+
+        # another generator is renewing the token
+        waited_until = time.monotonic() + self.LEADER_WAIT
+        while time.monotonic() < waited_until:
+            time.sleep(0.05)
+            fetched = fetch()
+            if fetched is not None:
+                return fetched
+        logger.warning("No JWT was stored by the leader in time, signing one")
+        return self._sign(key_material)
+
+    def _schedule(self, delay: timedelta):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = threading.Timer(
+            delay.total_seconds(), _renew_in_background, args=(weakref.ref(self),)
+        )
+        self._timer.daemon = True
+        self._timer.start()
+
+    def close(self):
+        """
+        Stops the background renewal.
+        """
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+    def _sign(self, key_material):
+        """
+        Signs a token valid for the lifetime of this generator.
+        :param key_material: The snapshot of the key material to sign with.
+        :return: the token, the time it should be renewed and the version of the key that signed it
+        """
         now = datetime.now(timezone.utc)  # Fetch the current time
+        logger.info("Generating a new token, the renewal time was %s", self.renew_time)
 
-        # If the token has expired or doesn't exist, regenerate the token.
-        if self.token is None or self.renew_time <= now:
-            logger.info(
-                "Generating a new token because the present time (%s) is later than the renewal time (%s)",
-                now,
-                self.renew_time,
-            )
-            # Calculate the next time we need to renew the token.
-            self.renew_time = now + self.renewal_delay
-
-            # Prepare the fields for the claims.
-            # Generate the public key fingerprint for the issuer in the claims.
-            public_key_fp = self.calculate_public_key_fingerprint(self.private_key)
-
-            # Create our claims
-            claims = {
-                # Set the issuer to the fully qualified username concatenated with the public key fingerprint.
-                ISSUER: self.qualified_username + "." + public_key_fp,
-                # Set the subject to the fully qualified username.
-                SUBJECT: self.qualified_username,
-                # Set the issue time to now.
-                ISSUE_TIME: now,
-                # Set the expiration time, based on the lifetime specified for this object.
-                EXPIRE_TIME: now + self.lifetime,
-            }
-
-            # Regenerate the actual token
-            token = jwt.encode(
-                claims, key=self.private_key, algorithm=JWTGenerator.ALGORITHM
-            )
-            # If you are using a version of PyJWT prior to 2.0, jwt.encode returns a byte string, rather than a string.
-            # If the token is a byte string, convert it to a string.
-            if isinstance(token, bytes):
-                token = token.decode("utf-8")
-            self.token = token
-            logger.info(
+        # Create our claims
+        claims = {
+            # Set the issuer to the fully qualified username concatenated with the public key fingerprint.
+            ISSUER: self.qualified_username + ".SHA256:" + key_material.fingerprint,
+            # Set the subject to the fully qualified username.
+            SUBJECT: self.qualified_username,
+            # Set the issue time to now.
+            ISSUE_TIME: now,
+            # Set the expiration time, based on the lifetime specified for this object.
+            EXPIRE_TIME: now + self.lifetime,
+        }
+
+        # Regenerate the actual token
+        token = jwt.encode(
+            claims, key=key_material.private_key, algorithm=JWTGenerator.ALGORITHM
+        )
+        # If you are using a version of PyJWT prior to 2.0, jwt.encode returns a byte string, rather than a string.
+        # If the token is a byte string, convert it to a string.
+        if isinstance(token, bytes):
+            token = token.decode("utf-8")
+        # Verifying the token costs another RSA operation, only do it when debugging.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
                 "Generated a JWT with the following claims: %s",
                 jwt.decode(
-                    self.token,
-                    key=self.private_key.public_key(),
+                    token,
+                    key=key_material.public_key,
                     algorithms=[JWTGenerator.ALGORITHM],
                 ),
             )
 
-        return self.token
+        # Calculate the next time we need to renew the token.
+        return token, now + self.renewal_delay, key_material.version
 
     def calculate_public_key_fingerprint(self, private_key: Text) -> Text:
         """
@@ -184,19 +336,7 @@ class JWTGenerator(object):
         :param private_key: private key string
         :return: public key fingerprint
         """
-        # Get the raw bytes of public key.
-        public_key_raw = private_key.public_key().public_bytes(
-            Encoding.DER, PublicFormat.SubjectPublicKeyInfo
-        )
-
-        # Get the sha256 hash of the raw bytes.
-        sha256hash = hashlib.sha256()
-        sha256hash.update(public_key_raw)
-
-        # Base64-encode the value and prepend the prefix 'SHA256:'.
-        public_key_fp = "SHA256:" + base64.b64encode(sha256hash.digest()).decode(
-            "utf-8"
-        )
+        public_key_fp = "SHA256:" + fingerprint_of(private_key.public_key())
         logger.info("Public key fingerprint is %s", public_key_fp)
 
         return public_key_fp
@@ -0,0 +1,206 @@
+import base64
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from log.logger import get_logger as _logger
+
+logger = _logger("key_material")
+
+
+# If you generated an encrypted private key, implement this method to return
+# the passphrase for decrypting your private key.
+def get_private_key_passphrase():
+    private_key_passphrase = os.getenv("PRIVATE_KEY_PASSPHRASE")
+
+    if private_key_passphrase is not None:
+        return private_key_passphrase
+
+    raise Exception(
+        f"Key is encrypted please add the passphrase via 'PRIVATE_KEY_PASSPHRASE'."
+    )
+
+
+def fingerprint_of(public_key: rsa.RSAPublicKey) -> str:
+    """
+    Calculate the SHA256 fingerprint of an RSA public key, as shown by Snowflake
+    in `RSA_PUBLIC_KEY_FP` without the `SHA256:` prefix.
+
+    Args:
+        public_key: RSA public key object
+
+    Returns:
+        str: Base64 encoded SHA256 hash of the DER encoded public key
+    """
+    key_der = public_key.public_bytes(
+        encoding=serialization.Encoding.DER,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    )
+    return base64.b64encode(hashlib.sha256(key_der).digest()).decode("ascii")
+
+
+def load_private_key(pem: bytes) -> rsa.RSAPrivateKey:
+    """
+    Load a PEM private key, asking for the passphrase if it is encrypted.
+    """
+    try:
+        # Try to access the private key without a passphrase.
+        return serialization.load_pem_private_key(pem, None, default_backend())
+    except TypeError:
+        # If that fails, provide the passphrase returned from get_private_key_passphrase().
+        return serialization.load_pem_private_key(
+            pem, get_private_key_passphrase().encode(), default_backend()
+        )
+
+
+class LoadedKey(NamedTuple):
+    private_key: rsa.RSAPrivateKey
+    public_key: rsa.RSAPublicKey
+    fingerprint: str
+    file_id: Optional[Tuple[int, int, int]]
+    version: int
+
+
+class KeyMaterial:
+    """
+    A private key loaded once along with its public key and fingerprint, the single source
+    of truth for the key pair used to sign JWTs and registered on the Snowflake user.
+
+    The key file is watched for rotation: `refresh()` checks the file at most every
+    `check_interval` seconds and reloads it when it was replaced or modified, bumping `version`.
+
+    Methods:
+        refresh(force: bool = False) -> bool:
+            Reloads the key if the key file changed, returns whether it was reloaded.
+
+        snapshot():
+            The current key material as one consistent tuple.
+
+        private_key, public_key, fingerprint, jwt_fingerprint, version:
+            The current key material.
+    """
+
+    def __init__(
+        self,
+        private_key_file_path: Union[Path, str],
+        check_interval: float = 5.0,
+    ):
+        """
+        Args:
+            private_key_file_path (Path | str): The PEM private key file
+            check_interval (float, optional): Minimum seconds between checks of the key file. Defaults to 5.
+
+        Raises:
+            FileNotFoundError: If the key file doesn't exist
+            ValueError: If the file doesn't contain a valid private key
+        """
+        self.private_key_file_path = Path(private_key_file_path)
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = time.monotonic()
+        self._loaded = self._load(version=1)
+
+    def _file_id(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = self.private_key_file_path.stat()
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            return None
+
+    def _load(self, version: int) -> LoadedKey:
+        file_id = self._file_id()
+        private_key = load_private_key(self.private_key_file_path.read_bytes())
+        public_key = private_key.public_key()
+        fingerprint = fingerprint_of(public_key)
+        logger.info(
+            f"Loaded key {self.private_key_file_path} with fingerprint SHA256:{fingerprint}"
+        )
+        return LoadedKey(private_key, public_key, fingerprint, file_id, version)
+
+    def refresh(self, force: bool = False) -> bool:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            self._checked_at = now
+            loaded = self._loaded
+            if not force and self._file_id() == loaded.file_id:
+                return False
+            try:
+                self._loaded = self._load(version=loaded.version + 1)
+            except Exception as e:
+                # a key file being rotated may be incomplete, keep the current key
+                logger.warning(
+                    f"Error reloading key {self.private_key_file_path}, keeping the current key, {e}"
+                )
+                return False
+            logger.info(f"Key {self.private_key_file_path} was rotated")
+            return True
+
+    def snapshot(self) -> LoadedKey:
+        """
+        The current private key, public key, fingerprint and version, consistent with each other
+        even if the key is rotated meanwhile.
+        """
+        return self._loaded
+
+    @property
+    def private_key(self) -> rsa.RSAPrivateKey:
+        return self._loaded.private_key
+
+    @property
+    def public_key(self) -> rsa.RSAPublicKey:
+        return self._loaded.public_key
+
+    @property
+    def fingerprint(self) -> str:
+        return self._loaded.fingerprint
+
+    @property
+    def jwt_fingerprint(self) -> str:
+        """
+        The fingerprint as used in the issuer of a key pair JWT, `SHA256:<fingerprint>`.
+        """
+        return f"SHA256:{self._loaded.fingerprint}"
+
+    @property
+    def version(self) -> int:
+        return self._loaded.version
+
+
+_lock = threading.Lock()
+_key_materials: Dict[Path, KeyMaterial] = {}
+
+
+def get_key_material(
+    private_key_file_path: Union[Path, str], reload: bool = False
+) -> KeyMaterial:
+    """
+    Return the process wide key material of the private key file, loading it on first use.
+
+    Args:
+        private_key_file_path (Path | str): The PEM private key file
+        reload (bool, optional): Re-read the key file if it was loaded before, e.g. after the key pair was replaced. Defaults to False.
+
+    Returns:
+        KeyMaterial: the shared key material of the file
+    """
+    path = Path(private_key_file_path).expanduser().resolve()
+    key_material = _key_materials.get(path)
+    if key_material is None:
+        with _lock:
+            key_material = _key_materials.get(path)
+            if key_material is None:
+                key_material = KeyMaterial(path)
+                _key_materials[path] = key_material
+                return key_material
+    if reload:
+        key_material.refresh(force=True)
+    return key_material
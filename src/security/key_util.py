@@ -1,11 +1,11 @@
 import hashlib
 from pathlib import Path
 from typing import Union
-from cryptography.hazmat.primitives import serialization, hashes
+from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.backends import default_backend
 from log.logger import get_logger as _logger
-import base64
+from security.key_material import KeyMaterial, fingerprint_of
 
 logger = _logger("key_util")
 
@@ -47,31 +47,19 @@ def load_rsa_public_key(key: Union[Path | str]) -> rsa.RSAPublicKey:
         raise ValueError(f"Failed to load public key: {e}")
 
 
-def get_key_fingerprint(public_key: rsa.RSAPublicKey) -> str:
+def get_key_fingerprint(public_key: Union[rsa.RSAPublicKey, KeyMaterial]) -> str:
     """
     Calculate SHA256 fingerprint of an RSA public key.
 
     Args:
-        public_key: RSA public key object
+        public_key: RSA public key object, or the KeyMaterial whose precomputed fingerprint is returned
 
     Returns:
-        str: SHA256 fingerprint as hex string
+        str: SHA256 fingerprint as base64 string
     """
-    # Get DER encoding of the public key
-    key_der = public_key.public_bytes(
-        encoding=serialization.Encoding.DER,
-        format=serialization.PublicFormat.SubjectPublicKeyInfo,
-    )
-
-    # Calculate Hash
-    digest = hashes.Hash(hashes.SHA256())
-    digest.update(key_der)
-    fingerprint_bytes = digest.finalize()
-
-    # Base64 Encoded FingerPrint
-    base64_fingerprint = base64.b64encode(fingerprint_bytes).decode("ascii")
-
-    return base64_fingerprint
+    if isinstance(public_key, KeyMaterial):
+        return public_key.fingerprint
+    return fingerprint_of(public_key)
 
 
 def match_fingerprints(fp_1: str, fp_2: str) -> bool:
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from pathlib import Path
+from typing import ContextManager, Dict, Iterator, NamedTuple, Optional, Union
+
+from log.logger import get_logger as _logger
+
+logger = _logger("token_store")
+
+try:
+    # flock is only available on POSIX, elsewhere the leader is elected per process
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class StoredToken(NamedTuple):
+    """
+    A signed JWT and its renewal and expiry times as epoch seconds.
+    """
+
+    token: str
+    renew_at: float
+    expires_at: float
+
+
+class TokenStore(ABC):
+    """
+    Shares signed JWTs between JWTGenerators so that one of them renews a token and
+    the others read it.
+
+    Methods:
+        get(key: str) -> Optional[StoredToken]:
+            Returns the stored token, None if there is none or it has expired.
+
+        put(key: str, token: StoredToken) -> None:
+            Stores the token.
+
+        leader(key: str):
+            Context manager yielding whether the caller was elected to renew the token,
+            at most one caller at a time is elected.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[StoredToken]: ...
+
+    @abstractmethod
+    def put(self, key: str, token: StoredToken) -> None: ...
+
+    @abstractmethod
+    def leader(self, key: str) -> ContextManager[bool]: ...
+
+
+class InMemoryTokenStore(TokenStore):
+    """
+    A token store shared by the threads of a process.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, StoredToken] = {}
+        self._leaders: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[StoredToken]:
+        stored = self._tokens.get(key)
+        if stored is None or stored.expires_at <= time.time():
+            return None
+        return stored
+
+    def put(self, key: str, token: StoredToken) -> None:
+        self._tokens[key] = token
+
+    @contextmanager
+    def leader(self, key: str) -> Iterator[bool]:
+        with self._lock:
+            lock = self._leaders.setdefault(key, threading.Lock())
+        acquired = lock.acquire(blocking=False)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                lock.release()
+
+
+class FileTokenStore(TokenStore):
+    """
+    A token store shared by the processes and containers mounting the same directory,
+    e.g. the `snowflake_home` volume.
+
+    Every token is a JSON file, readable by the owner only, replaced atomically. The
+    leader holds an exclusive `flock` on the lock file of the token.
+    """
+
+    def __init__(self, directory: Union[Path, str]):
+        """
+        Args:
+            directory (Path | str): Directory of the token files, created on first use
+        """
+        self.directory = Path(directory).expanduser()
+
+    def _path(self, key: str) -> Path:
+        return self.directory.joinpath(
+            f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.json"
+        )
+
+    def get(self, key: str) -> Optional[StoredToken]:
+        try:
+            with self._path(key).open(mode="r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key or data["expires_at"] <= time.time():
+            return None
+        return StoredToken(data["token"], data["renew_at"], data["expires_at"])
+
+    def put(self, key: str, token: StoredToken) -> None:
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # mkstemp creates the file readable by the owner only
+        fd, tmp_file = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, mode="w") as file:
+                json.dump({"key": key, **token._asdict()}, file)
+            os.replace(tmp_file, self._path(key))
+        except Exception:
+            Path(tmp_file).unlink(missing_ok=True)
+            raise
+
+    @contextmanager
+    def leader(self, key: str) -> Iterator[bool]:
+        if fcntl is None:
+            yield True
+            return
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        with self._path(key).with_suffix(".lock").open(mode="a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def create_token_store(
+    kind: Optional[str] = None, directory: Optional[Union[Path, str]] = None
+) -> TokenStore:
+    """
+    Create a token store.
+
+    Args:
+        kind (str, optional): `memory` or `file`. Defaults to JWT_TOKEN_STORE or `memory`.
+        directory (Path | str, optional): Directory of the `file` store. Defaults to
+            JWT_TOKEN_STORE_DIR or `~/.snowflake/tokens`.
+
+    Returns:
+        TokenStore: the token store
+
+    Raises:
+        ValueError: If the kind of store is unknown
+    """
+    kind = (kind or os.getenv("JWT_TOKEN_STORE", "memory")).strip().lower()
+    match kind:
+        case "memory":
+            return InMemoryTokenStore()
+        case "file":
+            directory = directory or os.getenv(
+                "JWT_TOKEN_STORE_DIR", Path.home().joinpath(".snowflake", "tokens")
+            )
+            logger.debug(f"Sharing JWTs using the files in {directory}")
+            return FileTokenStore(directory)
+        case _:
+            raise ValueError(f"Unknown token store '{kind}', use 'memory' or 'file'")
+
+
+# process wide token store, configured via JWT_TOKEN_STORE and JWT_TOKEN_STORE_DIR
+token_store = create_token_store()
@@ -9,6 +9,7 @@ from security.rsa_keypair_generator import (
 )
 from snowflake.core.user import User
 from security.rsa_keypair_generator import save_public_key
+from security.key_material import KeyMaterial, get_key_material
 from snowflake.core import Root
 from snowflake.snowpark.session import Session
 
@@ -57,6 +58,10 @@ class UserUtil:
                 self._private_key_path,
                 self._public_key_path,
             )
+            # the key pair was replaced, make sure the shared key material has the new key
+            self.key_material: KeyMaterial = get_key_material(
+                self._private_key_path, reload=True
+            )
             self.LOGGER.debug(f"Generated and saved keys")
         except Exception as e:
             self.LOGGER.error(f"Error generating key,{e}")
@@ -76,7 +81,7 @@ class UserUtil:
         if user.rsa_public_key is None:
             self.LOGGER.debug(f"Setting RSA Public Key for user {snowflake_user}")
             user.rsa_public_key = save_public_key(
-                self._private_key.public_key(),
+                self.key_material.public_key,
                 filename=None,  # just returns the as string w/o new lines and BEGIN..END..
             )
         else:
@@ -84,7 +89,7 @@ class UserUtil:
             # https://docs.snowflake.com/en/user-guide/key-pair-auth#configuring-key-pair-rotation
             self.LOGGER.debug(f"Rotating RSA Public Key for user {snowflake_user}")
             user.rsa_public_key_2 = save_public_key(
-                self._private_key.public_key(),
+                self.key_material.public_key,
                 filename=None,  # just returns the as string w/o new lines and BEGIN..END..
             )
 
@@ -92,7 +97,9 @@ class UserUtil:
         self.LOGGER.debug(f"User update successful.")
         # fetch the user and send details for verification and checks
         user: User = self.root.users[snowflake_user].fetch()
-        if is_rotated:
-            return (self._public_key_path, user.rsa_public_key_2_fp, is_rotated)
-        else:
-            return (self._public_key_path, user.rsa_public_key_fp, is_rotated)
+        fingerprint = user.rsa_public_key_2_fp if is_rotated else user.rsa_public_key_fp
+        if fingerprint != self.key_material.jwt_fingerprint:
+            self.LOGGER.warning(
+                f"Fingerprint {fingerprint} of user {snowflake_user} does not match the key {self.key_material.jwt_fingerprint}"
+            )
+        return (self._public_key_path, fingerprint, is_rotated)
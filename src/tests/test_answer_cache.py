@@ -0,0 +1,70 @@
+import logging
+
+import pytest
+
+from handler_tasks.answer_cache import AnswerCache, normalize_question
+
+logger = logging.getLogger("answer_cache_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+MODEL_FILE = "@slack_demo.data.semantic_models/support_tickets_semantic_model.yaml"
+
+
+@pytest.fixture
+def answer():
+    return {
+        "message": {
+            "role": "analyst",
+            "content": [{"type": "sql", "statement": "SELECT 1"}],
+        },
+        "request_id": "1234",
+    }
+
+
+class TestAnswerCache:
+    def test_normalize_question(self):
+        assert normalize_question(
+            "  Breakdown of tickets\n by  Service Type? "
+        ) == normalize_question("breakdown of tickets by service type")
+
+    def test_get_put(self, answer):
+        cache = AnswerCache()
+        assert cache.get("breakdown of tickets", MODEL_FILE) is None
+        cache.put("breakdown of tickets", MODEL_FILE, answer)
+        assert cache.get("Breakdown of tickets?", MODEL_FILE.upper()) == answer
+        assert cache.get("breakdown of tickets", "@other.data.stage/file.yaml") is None
+
+    def test_ttl(self, answer, monkeypatch):
+        cache = AnswerCache(ttl=10)
+        now = 1000.0
+        monkeypatch.setattr("handler_tasks.answer_cache.time.monotonic", lambda: now)
+        cache.put("q", MODEL_FILE, answer)
+        now = 1011.0
+        assert cache.get("q", MODEL_FILE) is None
+        assert len(cache) == 0
+
+    def test_lru_eviction(self, answer):
+        cache = AnswerCache(max_size=2)
+        cache.put("q1", MODEL_FILE, answer)
+        cache.put("q2", MODEL_FILE, answer)
+        # q1 becomes the most recently used
+        assert cache.get("q1", MODEL_FILE) is not None
+        cache.put("q3", MODEL_FILE, answer)
+        assert cache.get("q2", MODEL_FILE) is None
+        assert cache.get("q1", MODEL_FILE) is not None
+        assert cache.get("q3", MODEL_FILE) is not None
+
+    def test_invalidate(self, answer):
+        cache = AnswerCache()
+        other_model_file = (
+            "@other_db.data.semantic_models/support_tickets_semantic_model.yaml"
+        )
+        cache.put("q", MODEL_FILE, answer)
+        cache.put("q", other_model_file, answer)
+        cache.invalidate(MODEL_FILE)
+        assert cache.get("q", MODEL_FILE) is None
+        assert cache.get("q", other_model_file) is not None
+        cache.invalidate()
+        assert len(cache) == 0
@@ -0,0 +1,142 @@
+import importlib
+import logging
+import sys
+from pathlib import Path
+
+import pytest
+
+from handler_tasks.conversation import ConversationStore
+from handler_tasks.semantic_cache import SemanticCache
+
+logger = logging.getLogger("app_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+CHANNEL = "C01"
+USER = "U01"
+
+
+@pytest.fixture(scope="module")
+def bot():
+    """
+    The sync bot, imported without verifying its token with Slack.
+    """
+    with pytest.MonkeyPatch.context() as mp:
+        mp.syspath_prepend(str(Path(__file__).parents[2]))
+        mp.setenv("SLACK_BOT_TOKEN", "xoxb-test")
+        mp.setattr(
+            "slack_sdk.WebClient.auth_test",
+            lambda self, **kwargs: {"bot_id": "B01", "user_id": "U00"},
+        )
+        module = importlib.import_module("app")
+    yield module
+    sys.modules.pop("app", None)
+
+
+class FakeClient:
+    def __init__(self):
+        self.posts = []
+
+    def chat_postMessage(self, **kwargs):
+        self.posts.append(kwargs)
+        return {"channel": kwargs["channel"], "ts": f"100.{len(self.posts)}"}
+
+    def chat_postEphemeral(self, **kwargs):
+        self.posts.append(kwargs)
+
+
+class FakeCortalyst:
+    semantic_model_file = "@demo_db.data.semantic_models/model.yaml"
+
+    def __init__(self):
+        self.histories = []
+
+    def answer(self, question, history=None, on_queued=None):
+        self.histories.append(history)
+        return {"message": {"content": [{"type": "text", "text": f"re: {question}"}]}}
+
+
+class FakeSession:
+    conf = {"account": "acc", "user": "bot", "host": "acc.snowflakecomputing.com"}
+
+
+@pytest.fixture
+def conversation(bot, monkeypatch):
+    cortalyst = FakeCortalyst()
+    monkeypatch.setenv("PRIVATE_KEY_FILE_PATH", "/dev/null")
+    monkeypatch.setattr(bot.snowpark_session, "get", lambda: FakeSession())
+    monkeypatch.setattr(bot.cortalyst_registry, "get", lambda **kwargs: cortalyst)
+    monkeypatch.setattr(bot, "cortex_streaming", False)
+    monkeypatch.setattr(bot, "semantic_cache", SemanticCache(max_size=0))
+    store = ConversationStore()
+    monkeypatch.setattr(bot, "conversation_store", store)
+    # run the jobs right away
+    monkeypatch.setattr(
+        bot, "dispatch", lambda name, key, respond, fn, *args, **kwargs: fn()
+    )
+    return cortalyst
+
+
+class TestConversationThreads:
+    def test_answer_and_follow_up_share_the_thread(self, bot, conversation):
+        client, said = FakeClient(), []
+
+        def say(**kwargs):
+            said.append(kwargs)
+
+        bot.ask_cortex_analyst(
+            CHANNEL, client, say, logger, "How many tickets?", user_id=USER
+        )
+        root = client.posts[0]
+        assert "thread_ts" not in root and "How many tickets?" in root["text"]
+        thread_ts = "100.1"
+        assert all(p["thread_ts"] == thread_ts for p in client.posts[1:])
+        assert said == [{"text": "re: How many tickets?", "thread_ts": thread_ts}]
+
+        # a reply in the thread is a follow-up question answered in context
+        bot.handle_follow_up(
+            {
+                "type": "message",
+                "channel": CHANNEL,
+                "user": USER,
+                "text": "<@U00> and by priority?",
+                "ts": "101.1",
+                "thread_ts": thread_ts,
+            },
+            client,
+            say,
+            logger,
+        )
+        assert conversation.histories[0] is None
+        history = conversation.histories[1]
+        assert [m["role"] for m in history] == ["user", "analyst"]
+        assert history[0]["content"][0]["text"] == "How many tickets?"
+        assert said[-1] == {"text": "re: and by priority?", "thread_ts": thread_ts}
+        assert all(p["thread_ts"] == thread_ts for p in client.posts[1:])
+
+    def test_other_messages_are_ignored(self, bot, conversation):
+        client = FakeClient()
+        bot.conversation_store.append(CHANNEL, "3.1", "How many tickets?", [])
+        for event in [
+            # the bot's own messages in the thread of a conversation
+            {
+                "channel": CHANNEL,
+                "bot_id": "B01",
+                "text": "re: How many tickets?",
+                "ts": "3.2",
+                "thread_ts": "3.1",
+            },
+            # a message outside a thread
+            {"channel": CHANNEL, "user": USER, "text": "hi", "ts": "1.1"},
+            # a reply in a thread without a conversation
+            {
+                "channel": CHANNEL,
+                "user": USER,
+                "text": "hi",
+                "ts": "2.2",
+                "thread_ts": "2.1",
+            },
+        ]:
+            bot.handle_follow_up(event, client, lambda **kwargs: None, logger)
+        assert client.posts == [] and conversation.histories == []
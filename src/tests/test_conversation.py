@@ -0,0 +1,64 @@
+import logging
+
+from handler_tasks.conversation import ConversationStore
+
+logger = logging.getLogger("conversation_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+def sql(statement: str):
+    return [{"type": "sql", "statement": statement}]
+
+
+class TestConversationStore:
+    def test_history_is_per_channel_and_thread(self):
+        store = ConversationStore()
+        store.append("C1", "111.1", "tickets by service type", sql("SELECT 1"))
+        history = store.history("C1", "111.1")
+        assert [m["role"] for m in history] == ["user", "analyst"]
+        assert history[0]["content"][0]["text"] == "tickets by service type"
+        assert store.history("C1", None) == []
+        assert store.history("C2", "111.1") == []
+
+    def test_channel_level_questions_share_no_history(self):
+        store = ConversationStore()
+        # two /cortalyst commands of different users in the same channel
+        store.append("C1", None, "tickets of user 1", sql("SELECT 1"))
+        assert store.history("C1", None) == []
+        store.append("C1", None, "tickets of user 2", sql("SELECT 2"))
+        assert store.history("C1", None) == []
+        assert len(store._conversations) == 0
+
+    def test_history_is_truncated_to_budget(self):
+        store = ConversationStore(max_chars=200)
+        for i in range(5):
+            store.append("C1", "111.1", f"question {i}", sql(f"SELECT {i} FROM t"))
+        history = store.history("C1", "111.1")
+        assert 0 < len(history) < 10
+        assert len(history) % 2 == 0
+        assert history[0]["role"] == "user"
+        assert history[-1]["content"] == sql("SELECT 4 FROM t")
+
+    def test_ttl_and_lru(self, monkeypatch):
+        now = 1000.0
+        monkeypatch.setattr("handler_tasks.conversation.time.time", lambda: now)
+        store = ConversationStore(max_conversations=2, ttl=60)
+        store.append("C1", "111.1", "q", sql("SELECT 1"))
+        store.append("C2", "111.1", "q", sql("SELECT 1"))
+        store.append("C3", "111.1", "q", sql("SELECT 1"))
+        assert store.history("C1", "111.1") == []
+        assert store.history("C3", "111.1") != []
+        now = 1061.0
+        assert store.history("C3", "111.1") == []
+
+    def test_persistence(self, tmp_path):
+        path = tmp_path.joinpath("conversations.json")
+        store = ConversationStore(path=path)
+        store.append("C1", "111.1", "q", sql("SELECT 1"))
+        assert ConversationStore(path=path).history("C1", "111.1") == store.history(
+            "C1", "111.1"
+        )
+        store.clear()
+        assert ConversationStore(path=path).history("C1", "111.1") == []
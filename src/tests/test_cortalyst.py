@@ -6,7 +6,14 @@ import json
 from snowflake.core import Root
 from snowflake.snowpark.session import Session
 
-from handler_tasks.cortalyst import Cortlayst
+from handler_tasks.cortalyst import (
+    Cortlayst,
+    CortlaystRegistry,
+    iter_content_items,
+    iter_sse_events,
+)
+from handler_tasks.async_cortalyst import AsyncCortlayst
+from security.rsa_keypair_generator import gen_key, save_private_key
 
 logger = logging.getLogger("setup_tests")
 logging.basicConfig(
@@ -38,6 +45,98 @@ def cortalyst(session):
     return cortex_analyst
 
 
+@pytest.fixture(scope="module")
+def private_key_file(tmp_path_factory):
+    _pk_file = tmp_path_factory.mktemp("keys").joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return str(_pk_file)
+
+
+class TestCortlaystRegistry:
+    def test_get_returns_warm_client(self, private_key_file):
+        registry = CortlaystRegistry()
+        args = {
+            "account": "myorg-myaccount",
+            "user": "me",
+            "private_key_file_path": private_key_file,
+            "host": "myorg-myaccount.snowflakecomputing.com",
+        }
+        first = registry.get(**args)
+        assert registry.get(**args) is first
+        assert registry.get(**args, database="other_db") is not first
+
+    def test_invalidate(self, private_key_file):
+        registry = CortlaystRegistry()
+        args = {
+            "account": "myorg-myaccount",
+            "user": "me",
+            "private_key_file_path": private_key_file,
+            "host": "myorg-myaccount.snowflakecomputing.com",
+        }
+        first = registry.get(**args)
+        registry.invalidate()
+        assert registry.get(**args) is not first
+
+    def test_client_class(self, private_key_file):
+        registry = CortlaystRegistry(client_class=AsyncCortlayst)
+        cortalyst = registry.get(
+            account="myorg-myaccount",
+            user="me",
+            private_key_file_path=private_key_file,
+            host="myorg-myaccount.snowflakecomputing.com",
+        )
+        assert isinstance(cortalyst, AsyncCortlayst)
+
+
+STREAM = b"""event: status
+data: {"status": "interpreting_question"}
+
+event: message.content.delta
+data: {"index": 0, "type": "text", "text_delta": "This is our interpretation "}
+
+event: message.content.delta
+data: {"index": 0, "type": "text", "text_delta": "of your question"}
+
+event: message.content.delta
+data: {"index": 1, "type": "sql", "statement_delta": "SELECT service_type, "}
+
+event: message.content.delta
+data: {"index": 1, "type": "sql", "statement_delta": "COUNT(*) FROM support_tickets"}
+
+event: done
+data: {}
+
+""".splitlines()
+
+
+class TestStreaming:
+    def test_iter_content_items(self):
+        items = list(iter_content_items(iter_sse_events(STREAM)))
+        assert items == [
+            {"type": "text", "text": "This is our interpretation of your question"},
+            {
+                "type": "sql",
+                "statement": "SELECT service_type, COUNT(*) FROM support_tickets",
+            },
+        ]
+
+    def test_text_is_yielded_before_sql_arrives(self):
+        events = iter_sse_events(STREAM)
+        items = iter_content_items(events)
+        assert next(items)["type"] == "text"
+        # the sql deltas are still pending in the stream
+        assert next(events)[1]["type"] == "sql"
+
+    def test_error_event(self):
+        lines = [
+            "event: error",
+            'data: {"message": "boom", "request_id": "1234"}',
+            "",
+        ]
+        with pytest.raises(Exception, match="boom"):
+            list(iter_content_items(iter_sse_events(lines)))
+
+
 class TestSetup:
     def test_answer(self, cortalyst):
         logger.debug("Answer")
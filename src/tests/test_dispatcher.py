@@ -0,0 +1,157 @@
+import logging
+import threading
+import time
+
+import pytest
+
+from handler_tasks.dispatcher import (
+    FairQueue,
+    JobDispatcher,
+    JobRejectedError,
+    LatencyStats,
+    parse_weights,
+)
+
+logger = logging.getLogger("dispatcher_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture
+def dispatcher():
+    _dispatcher = JobDispatcher(max_workers=1, max_queue=2)
+    yield _dispatcher
+    _dispatcher.shutdown()
+
+
+def wait_until_running(dispatcher, count=1):
+    deadline = time.monotonic() + 5
+    while dispatcher.running < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+class TestJobDispatcher:
+    def test_runs_jobs(self, dispatcher):
+        assert dispatcher.submit("add", lambda a, b: a + b, 1, b=2).result() == 3
+        stats = dispatcher.stats()
+        assert stats["latency"]["add"]["count"] == 1
+        assert stats["running"] == 0
+
+    def test_backpressure(self, dispatcher):
+        release = threading.Event()
+        positions = []
+        running = dispatcher.submit("block", release.wait)
+        wait_until_running(dispatcher)
+        queued = [
+            dispatcher.submit("wait", lambda: None, on_queued=positions.append)
+            for _ in range(2)
+        ]
+        assert positions == [1, 2]
+        assert dispatcher.queued == 2
+        with pytest.raises(JobRejectedError):
+            dispatcher.submit("rejected", lambda: None)
+        release.set()
+        running.result()
+        for future in queued:
+            future.result()
+        assert dispatcher.stats()["latency"]["wait"]["count"] == 2
+
+    def test_failed_job(self, dispatcher):
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            dispatcher.submit("fail", fail).result()
+        assert dispatcher.stats()["latency"]["fail"]["errors"] == 1
+        assert dispatcher.queued == 0
+
+    def test_fair_between_channels(self, dispatcher):
+        dispatcher.max_queue = 10
+        release = threading.Event()
+        order = []
+        running = dispatcher.submit("block", release.wait, key="C1")
+        wait_until_running(dispatcher)
+        futures = [
+            dispatcher.submit("job", order.append, key, key=key)
+            for key in ["C1", "C1", "C1", "C2", "C2"]
+        ]
+        release.set()
+        running.result()
+        for future in futures:
+            future.result()
+        assert order == ["C1", "C2", "C1", "C2", "C1"]
+        assert dispatcher.stats()["keys"] == {}
+
+    def test_queue_per_key(self):
+        dispatcher = JobDispatcher(max_workers=1, max_queue=10, max_queue_per_key=1)
+        release = threading.Event()
+        try:
+            dispatcher.submit("block", release.wait, key="C1")
+            wait_until_running(dispatcher)
+            dispatcher.submit("wait", lambda: None, key="C1")
+            with pytest.raises(JobRejectedError):
+                dispatcher.submit("rejected", lambda: None, key="C1")
+            dispatcher.submit("other", lambda: None, key="C2")
+            assert dispatcher.stats()["keys"]["C1"] == {"queued": 1, "running": 1}
+        finally:
+            release.set()
+            dispatcher.shutdown()
+
+    def test_shutdown_cancels_queued(self):
+        dispatcher = JobDispatcher(max_workers=1, max_queue=10)
+        release = threading.Event()
+        running = dispatcher.submit("block", release.wait)
+        wait_until_running(dispatcher)
+        queued = dispatcher.submit("wait", lambda: None)
+        threading.Timer(0.1, release.set).start()
+        dispatcher.shutdown()
+        assert running.done() and queued.cancelled()
+        assert dispatcher.running == 0
+
+
+class TestFairQueue:
+    def test_weights(self):
+        queue = FairQueue(weights={"C1": 2})
+        for i in range(3):
+            queue.put("C1", f"a{i}")
+            queue.put("C2", f"b{i}")
+        jobs = [queue.get()[1] for _ in range(6)]
+        assert jobs == ["a0", "a1", "b0", "a2", "b1", "b2"]
+
+    def test_running_cap(self):
+        queue = FairQueue(max_running_per_key=1)
+        queue.put("C1", "a0")
+        queue.put("C1", "a1")
+        queue.put("C2", "b0")
+        assert queue.get() == ("C1", "a0")
+        # C1 is at its cap, C2 runs next
+        assert queue.get() == ("C2", "b0")
+        assert not queue.can_run("C1")
+        queue.done("C1")
+        assert queue.get() == ("C1", "a1")
+        assert queue.stats() == {
+            "C1": {"queued": 0, "running": 1},
+            "C2": {"queued": 0, "running": 1},
+        }
+
+    def test_close(self):
+        queue = FairQueue()
+        queue.put("C1", "a0")
+        assert queue.close() == ["a0"]
+        assert queue.get() is None
+
+    def test_parse_weights(self):
+        assert parse_weights("C1=3, C2=0,bad") == {"C1": 3, "C2": 1}
+        assert parse_weights(None) == {}
+
+
+class TestLatencyStats:
+    def test_summary(self):
+        stats = LatencyStats(window=10)
+        for i in range(20):
+            stats.record("job", waited=0, ran=float(i))
+        summary = stats.summary()["job"]
+        assert summary["count"] == 20
+        assert summary["max"] == 19.0
+        assert summary["p50"] == 14.0
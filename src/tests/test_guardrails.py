@@ -0,0 +1,100 @@
+import json
+import logging
+
+import pytest
+
+from handler_tasks.guardrails import (
+    QueryRefusedError,
+    ScanGuard,
+    query_tag,
+    scan_warning,
+    statement_params,
+)
+
+logger = logging.getLogger("guardrails_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class FakeSession:
+    """
+    Answers `EXPLAIN USING JSON` with the global stats of a plan.
+    """
+
+    def __init__(self, partitions_assigned, partitions_total=1000, error=None):
+        self.plan = {
+            "GlobalStats": {
+                "partitionsTotal": partitions_total,
+                "partitionsAssigned": partitions_assigned,
+                "bytesAssigned": partitions_assigned * 16 * 1024**2,
+            },
+            "Operations": [],
+        }
+        self.error = error
+        self.queries = []
+
+    def sql(self, query):
+        self.queries.append(query)
+        return self
+
+    def collect(self, statement_params=None):
+        if self.error is not None:
+            raise self.error
+        return [(json.dumps(self.plan),)]
+
+
+class TestStatementParams:
+    def test_tag(self):
+        tag = json.loads(query_tag("C1", "U1", "How many tickets?"))
+        assert tag["app"] == "cortalyst"
+        assert (tag["channel"], tag["user"]) == ("C1", "U1")
+        assert len(tag["question"]) == 16
+        assert "tickets" not in tag["question"]
+        # trivially different spellings of the question share the hash
+        assert query_tag("C1", "U1", "how many  tickets") == query_tag(
+            "C1", "U1", "How many tickets?"
+        )
+
+    def test_params(self):
+        params = statement_params("C1", "U1", "How many tickets?", timeout=60)
+        assert params["STATEMENT_TIMEOUT_IN_SECONDS"] == "60"
+        assert json.loads(params["QUERY_TAG"])["channel"] == "C1"
+
+    def test_no_timeout(self):
+        assert "STATEMENT_TIMEOUT_IN_SECONDS" not in statement_params(
+            "C1", None, "q", timeout=0
+        )
+
+
+class TestScanGuard:
+    def test_disabled(self):
+        session = FakeSession(partitions_assigned=10**6)
+        assert ScanGuard().check(session, "SELECT 1") is None
+        assert session.queries == []
+
+    def test_within_threshold(self):
+        session = FakeSession(partitions_assigned=10)
+        assert ScanGuard(max_partitions=100).check(session, "SELECT 1;") is None
+        assert session.queries == ["EXPLAIN USING JSON\nSELECT 1"]
+
+    def test_warn(self):
+        session = FakeSession(partitions_assigned=500)
+        estimate = ScanGuard(max_partitions=100).check(session, "SELECT 1")
+        assert estimate.partitions_assigned == 500
+        assert estimate.partitions_total == 1000
+        assert "500 of 1,000 partitions" in scan_warning(estimate, 100)
+
+    def test_refuse(self):
+        session = FakeSession(partitions_assigned=500)
+        with pytest.raises(QueryRefusedError, match="500 of 1000"):
+            ScanGuard(max_partitions=100, mode="refuse").check(session, "SELECT 1")
+
+    def test_explain_error(self):
+        session = FakeSession(partitions_assigned=500, error=RuntimeError("denied"))
+        guard = ScanGuard(max_partitions=100, mode="refuse")
+        assert guard.check(session, "SELECT 1") is None
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            ScanGuard(mode="block")
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+
+import pytest
+import requests
+
+import handler_tasks.http_transport as http_transport
+from handler_tasks.http_transport import (
+    HTTP2Transport,
+    close_async_transport,
+    close_transport,
+    create_transport,
+    get_async_transport,
+    get_transport,
+)
+
+logger = logging.getLogger("http_transport_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture
+def live(monkeypatch):
+    monkeypatch.setattr(http_transport, "_transport", None)
+    monkeypatch.setenv("CORTEX_ANALYST_MODE", "live")
+    monkeypatch.delenv("CORTEX_HTTP2", raising=False)
+    yield
+    close_transport()
+
+
+class TestTransport:
+    def test_pooled_keep_alive(self):
+        transport = create_transport(pool_size=3)
+        assert isinstance(transport, requests.Session)
+        adapter = transport.get_adapter("https://myorg.snowflakecomputing.com")
+        assert adapter._pool_maxsize == 3
+        assert transport.headers["Connection"] == "keep-alive"
+        transport.close()
+
+    def test_shared_until_closed(self, live, monkeypatch):
+        monkeypatch.setenv("CORTEX_HTTP_POOL_SIZE", "4")
+        transport = get_transport()
+        assert get_transport() is transport
+        assert transport.get_adapter("https://a")._pool_maxsize == 4
+        close_transport()
+        assert http_transport._transport is None
+        assert get_transport() is not transport
+
+    def test_http2_falls_back_without_httpx(self, live, monkeypatch):
+        monkeypatch.setattr(http_transport, "httpx", None)
+        monkeypatch.setenv("CORTEX_HTTP2", "true")
+        assert isinstance(get_transport(), requests.Session)
+
+    def test_http2(self, live, monkeypatch):
+        pytest.importorskip("httpx")
+        pytest.importorskip("h2")
+        monkeypatch.setenv("CORTEX_HTTP2", "true")
+        assert isinstance(get_transport(), HTTP2Transport)
+
+    def test_http2_errors(self):
+        httpx = pytest.importorskip("httpx")
+
+        def handler(request):
+            if request.url.path == "/timeout":
+                raise httpx.ReadTimeout("read timed out", request=request)
+            raise httpx.ConnectError("connection refused", request=request)
+
+        transport = HTTP2Transport(httpx.Client(transport=httpx.MockTransport(handler)))
+        with pytest.raises(requests.Timeout):
+            transport.post("https://a/timeout", json={}, timeout=(1, 10))
+        with pytest.raises(requests.ConnectionError):
+            transport.post("https://a/refused", json={})
+        transport.close()
+
+
+class TestAsyncTransport:
+    def test_shared_per_loop(self):
+        async def transports():
+            return get_async_transport(), get_async_transport()
+
+        first, second = asyncio.run(transports())
+        assert first is second
+        other, _ = asyncio.run(transports())
+        assert other is not first
+
+    def test_closed_when_the_loop_shuts_down(self):
+        async def transport():
+            return get_async_transport()
+
+        transports = [asyncio.run(transport()) for _ in range(3)]
+        assert all(t.closed for t in transports)
+        assert not http_transport._async_transports
+
+    def test_close(self):
+        async def closed():
+            transport = get_async_transport()
+            await close_async_transport()
+            assert not http_transport._async_transports
+            # a new transport replaces the closed one
+            assert get_async_transport() is not transport
+            return transport
+
+        assert asyncio.run(closed()).closed
+        assert not http_transport._async_transports
+
+    def test_replay_is_refused(self, monkeypatch):
+        monkeypatch.setenv("CORTEX_ANALYST_MODE", "replay")
+
+        async def transport():
+            return get_async_transport()
+
+        with pytest.raises(RuntimeError):
+            asyncio.run(transport())
+        assert not http_transport._async_transports
+
+    def test_closed_loop_is_forgotten(self):
+        async def transport():
+            return get_async_transport()
+
+        # closed without cancelling its tasks, unlike asyncio.run
+        loop = asyncio.new_event_loop()
+        leaked = loop.run_until_complete(transport())
+        loop.close()
+        assert loop in http_transport._async_transports
+
+        assert asyncio.run(transport()) is not leaked
+        assert loop not in http_transport._async_transports
@@ -0,0 +1,87 @@
+import logging
+
+from slack_sdk.socket_mode.request import SocketModeRequest
+
+from handler_tasks.idempotency import IdempotencyGuard, delivery_id, with_envelope_id
+
+logger = logging.getLogger("idempotency_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class TestDeliveryId:
+    def test_event(self):
+        assert delivery_id({"event_id": "Ev01", "event": {}}) == "event:Ev01"
+
+    def test_command(self):
+        assert delivery_id({"command": "/setup", "trigger_id": "123.456"}) == (
+            "trigger:123.456"
+        )
+
+    def test_block_action(self):
+        body = {
+            "trigger_id": "123.456",
+            "actions": [{"action_id": "ask_cortex_analyst", "action_ts": "1.2"}],
+        }
+        assert delivery_id(body) == "trigger:123.456:1.2"
+
+    def test_none(self):
+        assert delivery_id({"type": "view_closed"}) is None
+
+    def test_envelope(self):
+        request = SocketModeRequest(
+            type="interactive", envelope_id="env-1", payload={"type": "view_closed"}
+        )
+        with_envelope_id(None, request)
+        assert delivery_id(request.payload) == "envelope:env-1"
+        # the IDs of the payload take precedence
+        request = SocketModeRequest(
+            type="slash_commands",
+            envelope_id="env-2",
+            payload={"command": "/setup", "trigger_id": "123.456"},
+        )
+        with_envelope_id(None, request)
+        assert delivery_id(request.payload) == "trigger:123.456"
+
+
+class TestIdempotencyGuard:
+    def test_seen(self):
+        guard = IdempotencyGuard()
+        assert not guard.seen("trigger:1")
+        assert guard.seen("trigger:1")
+        assert not guard.seen("trigger:2")
+
+    def test_ttl(self, monkeypatch):
+        guard = IdempotencyGuard(ttl=10)
+        now = 1000.0
+        monkeypatch.setattr("handler_tasks.idempotency.time.monotonic", lambda: now)
+        guard.seen("trigger:1")
+        now = 1011.0
+        assert not guard.seen("trigger:1")
+        assert len(guard) == 1
+
+    def test_bounded(self):
+        guard = IdempotencyGuard(max_size=2)
+        for delivery in ["trigger:1", "trigger:2", "trigger:3"]:
+            guard.seen(delivery)
+        assert len(guard) == 2
+        assert not guard.seen("trigger:1")
+
+    def test_operation(self):
+        guard = IdempotencyGuard()
+        assert guard.begin("ask:C1:U1:q") == 0
+        assert guard.begin("ask:C1:U1:q") == 1
+        assert guard.begin("ask:C1:U1:q") == 2
+        assert guard.begin("ask:C1:U2:q") == 0
+        guard.end("ask:C1:U1:q")
+        assert guard.begin("ask:C1:U1:q") == 0
+        guard.end(None)
+
+    def test_lost_operation(self, monkeypatch):
+        guard = IdempotencyGuard(operation_ttl=10)
+        now = 1000.0
+        monkeypatch.setattr("handler_tasks.idempotency.time.monotonic", lambda: now)
+        guard.begin("setup:C1:demo_db.data")
+        now = 1011.0
+        assert guard.begin("setup:C1:demo_db.data") == 0
@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import jwt
+import pytest
+
+from security.jwt_generator import JWTGenerator
+from security.rsa_keypair_generator import gen_key, save_private_key
+from security.token_store import FileTokenStore, InMemoryTokenStore
+
+logger = logging.getLogger("jwt_generator_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture(scope="module")
+def private_key_file(tmp_path_factory):
+    _pk_file = tmp_path_factory.mktemp("keys").joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return str(_pk_file)
+
+
+class TestJWTGenerator:
+    def test_token_is_signed_ahead_of_use(self, private_key_file, monkeypatch):
+        generator = JWTGenerator("myorg-myaccount", "me", private_key_file)
+        try:
+            assert generator.token is not None
+            signs = []
+            monkeypatch.setattr(generator, "_sign", lambda *args: signs.append(1))
+            assert generator.generate_token() == generator.token
+            assert signs == []
+            claims = jwt.decode(generator.token, options={"verify_signature": False})
+            assert claims["sub"] == "MYORG-MYACCOUNT.ME"
+            assert claims["iss"] == f"MYORG-MYACCOUNT.ME.{generator.public_key_fp}"
+        finally:
+            generator.close()
+
+    def test_background_renewal(self, private_key_file):
+        generator = JWTGenerator(
+            "myorg-myaccount",
+            "me",
+            private_key_file,
+            lifetime=timedelta(seconds=5),
+            renewal_delay=timedelta(milliseconds=100),
+            token_store=InMemoryTokenStore(),
+        )
+        try:
+            first = generator.renew_time
+            deadline = time.monotonic() + 5
+            while generator.renew_time == first and time.monotonic() < deadline:
+                time.sleep(0.05)
+            assert generator.renew_time > first
+        finally:
+            generator.close()
+
+    def test_renews_on_use_without_background(self, private_key_file):
+        generator = JWTGenerator(
+            "myorg-myaccount",
+            "me",
+            private_key_file,
+            renewal_delay=timedelta(0),
+            background_renewal=False,
+        )
+        assert generator.token is None
+        tokens = set()
+
+        def generate():
+            tokens.add(generator.generate_token())
+
+        threads = [threading.Thread(target=generate) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert None not in tokens
+        assert generator.token in tokens
+
+    def test_shared_token_is_not_signed_again(self, private_key_file, tmp_path):
+        store = FileTokenStore(tmp_path)
+        leader = JWTGenerator(
+            "myorg-myaccount", "me", private_key_file, token_store=store
+        )
+        follower = JWTGenerator(
+            "myorg-myaccount", "me", private_key_file, token_store=store
+        )
+        try:
+            assert follower.token == leader.token
+            assert len(list(tmp_path.glob("*.json"))) == 1
+        finally:
+            leader.close()
+            follower.close()
+
+    def test_follower_waits_for_leader(self, private_key_file, tmp_path):
+        store = FileTokenStore(tmp_path)
+        generator = JWTGenerator(
+            "myorg-myaccount",
+            "me",
+            private_key_file,
+            background_renewal=False,
+            token_store=store,
+        )
+        key = f"{generator.qualified_username}.{generator.public_key_fp}"
+        with store.leader(key) as elected:
+            assert elected
+            with store.leader(key) as other:
+                assert not other
+            generator.LEADER_WAIT = 0.1
+            # the leader did not store a token in time, the follower signs its own
+            assert generator.generate_token() is not None
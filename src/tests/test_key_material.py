@@ -0,0 +1,70 @@
+import logging
+import os
+
+import jwt
+import pytest
+
+from security.jwt_generator import JWTGenerator
+from security.key_material import KeyMaterial, get_key_material
+from security.key_util import get_key_fingerprint
+from security.rsa_keypair_generator import gen_key, save_private_key
+
+logger = logging.getLogger("key_material_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture
+def private_key_file(tmp_path):
+    _pk_file = tmp_path.joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return _pk_file
+
+
+def rotate(private_key_file):
+    rotated = private_key_file.with_suffix(".new")
+    save_private_key(gen_key(key_size=2048), rotated)
+    os.replace(rotated, private_key_file)
+
+
+class TestKeyMaterial:
+    def test_fingerprint(self, private_key_file):
+        key_material = KeyMaterial(private_key_file)
+        assert key_material.fingerprint == get_key_fingerprint(key_material.public_key)
+        assert get_key_fingerprint(key_material) == key_material.fingerprint
+        assert key_material.jwt_fingerprint == f"SHA256:{key_material.fingerprint}"
+
+    def test_shared(self, private_key_file):
+        assert get_key_material(private_key_file) is get_key_material(
+            str(private_key_file)
+        )
+
+    def test_reload(self, private_key_file):
+        key_material = get_key_material(private_key_file, reload=True)
+        assert key_material.version == 1
+        rotate(private_key_file)
+        assert get_key_material(private_key_file, reload=True) is key_material
+        assert key_material.version == 2
+
+    def test_rotation(self, private_key_file):
+        key_material = KeyMaterial(private_key_file, check_interval=0)
+        fingerprint = key_material.fingerprint
+        assert not key_material.refresh()
+        rotate(private_key_file)
+        assert key_material.refresh()
+        assert key_material.version == 2
+        assert key_material.fingerprint != fingerprint
+
+    def test_rotation_renews_token(self, private_key_file):
+        generator = JWTGenerator("myorg-myaccount", "me", str(private_key_file))
+        try:
+            generator.key_material.check_interval = 0
+            rotate(private_key_file)
+            claims = jwt.decode(
+                generator.generate_token(), options={"verify_signature": False}
+            )
+            assert claims["iss"].endswith(generator.key_material.jwt_fingerprint)
+            assert generator.key_material.version == 2
+        finally:
+            generator.close()
@@ -0,0 +1,84 @@
+import logging
+import threading
+
+import pytest
+
+from handler_tasks.answer_cache import AnswerCache
+from handler_tasks.cortalyst import Cortlayst
+from handler_tasks.resilience import (
+    CircuitBreaker,
+    CortexAnalystError,
+    RetryPolicy,
+    Timeouts,
+)
+from loadtest.mock_analyst_server import MockAnalystServer, parse_latency
+from security.rsa_keypair_generator import gen_key, save_private_key
+
+logger = logging.getLogger("mock_analyst_server_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture(scope="module")
+def private_key_file(tmp_path_factory):
+    _pk_file = tmp_path_factory.mktemp("keys").joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return str(_pk_file)
+
+
+@pytest.fixture
+def server():
+    _server = MockAnalystServer(("127.0.0.1", 0), seed=42)
+    thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    thread.start()
+    yield _server
+    _server.shutdown()
+    _server.server_close()
+
+
+def cortalyst(private_key_file, server, max_retries=0):
+    return Cortlayst(
+        account="myorg-myaccount",
+        user="me",
+        private_key_file_path=private_key_file,
+        host="myorg-myaccount.snowflakecomputing.com",
+        answer_cache=AnswerCache(max_size=0),
+        timeouts=Timeouts(connect=1, read=5, total=10),
+        retry_policy=RetryPolicy(max_retries=max_retries, base_delay=0.01),
+        breaker=CircuitBreaker(),
+        base_url=server.base_url,
+    )
+
+
+class TestMockAnalystServer:
+    def test_parse_latency(self):
+        assert parse_latency("fixed:0.5")(None) == 0.5
+        with pytest.raises(ValueError):
+            parse_latency("gaussian:1")
+
+    def test_answer(self, private_key_file, server):
+        ans = cortalyst(private_key_file, server).answer("How many tickets?")
+        text, sql = ans["message"]["content"]
+        assert "How many tickets?" in text["text"]
+        assert "slack_demo.data.support_tickets" in sql["statement"]
+        assert ans["request_id"] is not None
+
+    def test_invalid_token(self, private_key_file, server, monkeypatch):
+        client = cortalyst(private_key_file, server)
+        monkeypatch.setattr(client, "get_token", lambda: "not-a-jwt")
+        with pytest.raises(CortexAnalystError) as e:
+            client.answer("How many tickets?")
+        assert e.value.status_code == 401
+
+    def test_answer_stream(self, private_key_file, server):
+        items = list(cortalyst(private_key_file, server).answer_stream("Any tickets?"))
+        assert [i["type"] for i in items] == ["text", "sql"]
+        assert "Any tickets?" in items[0]["text"]
+
+    def test_error_rate(self, private_key_file, server):
+        server.error_rate = 1.0
+        with pytest.raises(CortexAnalystError) as e:
+            cortalyst(private_key_file, server, max_retries=1).answer("q")
+        assert e.value.status_code in (429, 500, 503)
+        assert server.requests_served == 2
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import threading
+
+import pandas as pd
+import pytest
+import pyarrow as pa
+
+from handler_tasks.blocks import create_df_block
+from handler_tasks.query import (
+    TOTAL_ROWS_COLUMN,
+    QueryCancelledError,
+    QueryJob,
+    order_by_clause,
+    preview_sql,
+    query_preview,
+    query_result,
+    running_queries,
+)
+from handler_tasks.result_cache import ChangeMarkers, ResultCache
+
+logger = logging.getLogger("query_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+QUERY = "SELECT service_type, ticket_count FROM support_tickets -- generated\n;"
+ORDERED_QUERY = (
+    "SELECT t.service_type, COUNT(*) AS ticket_count FROM support_tickets AS t\n"
+    "GROUP BY t.service_type ORDER BY ticket_count DESC, t.service_type LIMIT 20;"
+)
+
+
+class InvalidIdentifierError(Exception):
+    sql_error_code = 904
+
+
+class FakeSession:
+    """
+    Returns the first rows of `df` for preview statements and `df` otherwise.
+    """
+
+    def __init__(self, df):
+        self.df = df
+        self.queries = []
+
+    def sql(self, query):
+        self.queries.append(query)
+        self._query = query
+        return self
+
+    def to_arrow(self):
+        df = self.df
+        if TOTAL_ROWS_COLUMN in self._query:
+            limit = int(self._query.rsplit("LIMIT", 1)[1])
+            df = df.head(limit).assign(**{TOTAL_ROWS_COLUMN: len(self.df)})
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def to_arrow_batches(self):
+        for batch in self.to_arrow().to_batches(max_chunksize=5):
+            yield pa.Table.from_batches([batch])
+
+
+class FakeAsyncJob:
+    def __init__(self, query_id, polls):
+        self.query_id = query_id
+        self.polls = polls
+        self.cancelled = False
+
+    def is_done(self):
+        self.polls -= 1
+        return self.cancelled or self.polls <= 0
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeCursor:
+    def __init__(self, session):
+        self.session = session
+
+    def get_results_from_sfqid(self, query_id):
+        self.session._query = self.session.submitted[query_id]
+
+    def fetch_arrow_all(self, force_return_table=False):
+        return self.session.to_arrow()
+
+    def fetch_arrow_batches(self):
+        return self.session.to_arrow_batches()
+
+    def close(self):
+        pass
+
+
+class FakeAsyncSession(FakeSession):
+    """
+    Submits the queries as jobs done after `polls` status checks.
+    """
+
+    def __init__(self, df, polls=3):
+        super().__init__(df)
+        self.polls = polls
+        self.submitted = {}
+        self.jobs = []
+        self.connection = self
+        self.statement_params = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def collect_nowait(self, statement_params=None):
+        self.statement_params.append(statement_params)
+        query_id = f"01b-{len(self.jobs)}"
+        self.submitted[query_id] = self._query
+        self.jobs.append(FakeAsyncJob(query_id, self.polls))
+        return self.jobs[-1]
+
+
+def no_cache(monkeypatch):
+    monkeypatch.setattr("handler_tasks.result_cache.result_cache", ResultCache(0))
+    monkeypatch.setattr(
+        "handler_tasks.result_cache.change_markers", ChangeMarkers([], interval=0)
+    )
+
+
+class TestQueryPreview:
+    def test_preview_sql(self):
+        statement = preview_sql(QUERY, limit=5)
+        assert statement.startswith("SELECT *, COUNT(*) OVER ()")
+        assert "-- generated\n)" in statement
+        assert ";" not in statement
+        assert statement.endswith("LIMIT 5")
+        assert "ORDER BY" not in statement
+
+    def test_preview_sql_keeps_the_order(self):
+        statement = preview_sql(ORDERED_QUERY, limit=5)
+        assert statement.endswith(") ORDER BY ticket_count DESC, service_type LIMIT 5")
+        assert "LIMIT 20\n)" in statement
+        assert preview_sql(ORDERED_QUERY, limit=5, ordered=False).endswith(") LIMIT 5")
+
+    def test_order_by_clause(self):
+        assert order_by_clause(QUERY) is None
+        assert order_by_clause(ORDERED_QUERY) == "ticket_count DESC, service_type"
+        # the order of a window or subquery doesn't order the result
+        assert (
+            order_by_clause(
+                "SELECT a, ROW_NUMBER() OVER (ORDER BY b) FROM (SELECT * FROM t ORDER BY c)"
+            )
+            is None
+        )
+        assert (
+            order_by_clause("SELECT a FROM t ORDER BY a UNION SELECT b FROM u") is None
+        )
+        assert (
+            order_by_clause(
+                'SELECT * FROM t ORDER BY db.s."T"."a b" NULLS LAST -- x\n;'
+            )
+            == '"a b" NULLS LAST'
+        )
+        assert (
+            order_by_clause("SELECT * FROM t ORDER BY ROUND(t.x * 1.5, 2) OFFSET 3")
+            == "ROUND(x * 1.5, 2)"
+        )
+
+    def test_preview_falls_back_to_unordered(self, monkeypatch):
+        no_cache(monkeypatch)
+        df = pd.DataFrame({"SERVICE_TYPE": list("abc"), "TICKET_COUNT": 1})
+        session = FakeSession(df)
+        to_arrow = session.to_arrow
+
+        def fail_ordered():
+            if ") ORDER BY" in session._query:
+                raise InvalidIdentifierError("invalid identifier 'SERVICE_TYPE'")
+            return to_arrow()
+
+        session.to_arrow = fail_ordered
+        preview, total_rows = query_preview(session, ORDERED_QUERY, "demo_db", "data")
+        assert (preview.num_rows, total_rows) == (3, 3)
+        assert ") ORDER BY" in session.queries[0]
+        assert ") ORDER BY" not in session.queries[-1]
+
+    def test_preview_raises_other_errors(self, monkeypatch):
+        no_cache(monkeypatch)
+        session = FakeSession(pd.DataFrame({"A": [1]}))
+
+        def fail():
+            raise RuntimeError("warehouse suspended")
+
+        session.to_arrow = fail
+        with pytest.raises(RuntimeError):
+            query_preview(session, ORDERED_QUERY, "demo_db", "data")
+        assert len(session.queries) == 1
+
+    def test_preview(self, monkeypatch):
+        no_cache(monkeypatch)
+        df = pd.DataFrame({"SERVICE_TYPE": list("abcdefghijkl"), "TICKET_COUNT": 1})
+        session = FakeSession(df)
+        preview, total_rows = query_preview(session, QUERY, "demo_db", "data", limit=3)
+        assert total_rows == 12
+        assert preview.column_names == ["SERVICE_TYPE", "TICKET_COUNT"]
+        assert preview.num_rows == 3
+        result = query_result(session, QUERY, "demo_db", "data", preview, total_rows)
+        assert result.num_rows == 12
+        assert session.queries[-1] == QUERY
+        result = query_result(
+            session, QUERY, "demo_db", "data", preview, total_rows, ["TICKET_COUNT"]
+        )
+        assert result.column_names == ["TICKET_COUNT"]
+        assert result.num_rows == 12
+
+    def test_small_result(self, monkeypatch):
+        no_cache(monkeypatch)
+        session = FakeSession(pd.DataFrame({"SERVICE_TYPE": ["a"], "TICKET_COUNT": 1}))
+        preview, total_rows = query_preview(session, QUERY, "demo_db", "data")
+        assert query_result(session, QUERY, "demo_db", "data", preview, total_rows) is (
+            preview
+        )
+        assert len(session.queries) == 1
+
+    def test_empty_result(self, monkeypatch):
+        no_cache(monkeypatch)
+        session = FakeSession(pd.DataFrame({"SERVICE_TYPE": [], "TICKET_COUNT": []}))
+        preview, total_rows = query_preview(session, QUERY, "demo_db", "data")
+        assert total_rows == 0 and preview.num_rows == 0
+
+    def test_df_block(self):
+        df = pd.DataFrame({"SERVICE_TYPE": ["a", "b"], "TICKET_COUNT": [1, 2]})
+        summary = create_df_block(df, total_rows=1200)[-1]["elements"][0]["text"]
+        assert summary == "_Showing 2 of 1200 rows_"
+        summary = create_df_block(df)[-1]["elements"][0]["text"]
+        assert summary == "_Total rows: 2_"
+
+    def test_arrow_df_block(self):
+        table = pa.table(
+            {
+                "SERVICE_TYPE": ["a", None],
+                "AVG": [1.234, float("nan")],
+                "N": pa.array([1, 2], pa.int64()),
+            }
+        )
+        text = create_df_block(table)[1]["text"]["text"]
+        assert "| a | 1.23 | 1 |" in text
+        assert "| N/A | N/A | 2 |" in text
+
+
+class TestQueryJob:
+    @pytest.fixture
+    def df(self):
+        return pd.DataFrame({"SERVICE_TYPE": list("abcdefghijkl"), "TICKET_COUNT": 1})
+
+    def test_wait(self, df):
+        session = FakeAsyncSession(df, polls=4)
+        progress = []
+        job = QueryJob(session, QUERY, poll_interval=0.01, progress_after=0)
+        table = job.submit().wait(on_progress=lambda job: progress.append(job.query_id))
+        assert table.num_rows == 12
+        assert progress and set(progress) == {"01b-0"}
+        assert len(running_queries) == 0
+
+    def test_columns(self, df):
+        session = FakeAsyncSession(df, polls=1)
+        table = QueryJob(session, QUERY, ["TICKET_COUNT"]).submit().wait()
+        assert table.column_names == ["TICKET_COUNT"]
+        assert table.num_rows == 12
+
+    def test_cancel(self, df):
+        session = FakeAsyncSession(df, polls=10**6)
+        job = QueryJob(session, QUERY, poll_interval=0.01).submit()
+        waiting = threading.Thread(target=lambda: running_queries.cancel(job.query_id))
+        waiting.start()
+        with pytest.raises(QueryCancelledError):
+            job.wait()
+        waiting.join()
+        assert session.jobs[0].cancelled
+        assert len(running_queries) == 0
+        assert not running_queries.cancel(job.query_id)
+
+    def test_failed_progress(self, df):
+        session = FakeAsyncSession(df, polls=3)
+
+        def fail(job):
+            raise RuntimeError("channel_not_found")
+
+        job = QueryJob(session, QUERY, poll_interval=0.01, progress_after=0)
+        assert job.submit().wait(on_progress=fail).num_rows == 12
+
+    def test_wait_async(self, df):
+        session = FakeAsyncSession(df, polls=3)
+        progress = []
+
+        async def run_blocking(fn, *args):
+            return fn(*args)
+
+        async def on_progress(job):
+            progress.append(job.elapsed)
+
+        job = QueryJob(session, QUERY, poll_interval=0.01, progress_after=0).submit()
+        table = asyncio.run(job.wait_async(run_blocking, on_progress))
+        assert table.num_rows == 12
+        assert progress
+
+    def test_preview(self, df, monkeypatch):
+        no_cache(monkeypatch)
+        session = FakeAsyncSession(df, polls=2)
+
+        def fetch(session, query, columns=None):
+            return QueryJob(session, query, columns, poll_interval=0.01).submit().wait()
+
+        preview, total_rows = query_preview(
+            session, QUERY, "demo_db", "data", limit=3, fetch=fetch
+        )
+        assert (preview.num_rows, total_rows) == (3, 12)
+        result = query_result(
+            session, QUERY, "demo_db", "data", preview, total_rows, fetch=fetch
+        )
+        assert result.num_rows == 12
+        assert len(session.jobs) == 2
+
+    def test_statement_params(self, df):
+        session = FakeAsyncSession(df, polls=1)
+        params = {"STATEMENT_TIMEOUT_IN_SECONDS": "60"}
+        QueryJob(session, QUERY, statement_params=params).submit().wait()
+        assert session.statement_params == [params]
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import threading
+import time
+
+import pytest
+
+from handler_tasks.rate_limit import (
+    AsyncConcurrencyGovernor,
+    ConcurrencyGovernor,
+    CortexLimiter,
+    TokenBucket,
+)
+
+logger = logging.getLogger("rate_limit_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class TestRateLimit:
+    def test_token_bucket(self, monkeypatch):
+        sleeps = []
+        monkeypatch.setattr("handler_tasks.rate_limit.time.sleep", sleeps.append)
+        bucket = TokenBucket(rate=2, burst=2)
+        assert bucket.acquire() == 0
+        assert bucket.acquire() == 0
+        assert 0.4 < bucket.acquire() <= 0.5
+        assert len(sleeps) == 1
+
+    def test_governor_queues_fairly(self):
+        governor = ConcurrencyGovernor(max_in_flight=1)
+        governor.acquire()
+        positions, order = [], []
+
+        def request(name):
+            governor.acquire(on_queued=positions.append)
+            order.append(name)
+            governor.release()
+
+        threads = []
+        for name in ["first", "second", "third"]:
+            thread = threading.Thread(target=request, args=(name,))
+            thread.start()
+            threads.append(thread)
+            # make sure the requests are queued in order
+            while len(positions) < len(threads):
+                time.sleep(0.01)
+
+        assert positions == [1, 2, 3]
+        governor.release()
+        for thread in threads:
+            thread.join(timeout=5)
+        assert order == ["first", "second", "third"]
+        assert governor.in_flight == 0
+
+    def test_limiter_releases_on_error(self):
+        limiter = CortexLimiter(max_in_flight=1)
+        try:
+            with limiter.limit():
+                raise ValueError("boom")
+        except ValueError:
+            pass
+        assert limiter.governor.in_flight == 0
+
+    def test_interrupted_request_leaves_the_queue(self):
+        governor = ConcurrencyGovernor(max_in_flight=1)
+        governor.acquire()
+
+        def interrupt(position):
+            raise KeyboardInterrupt
+
+        with pytest.raises(KeyboardInterrupt):
+            governor.acquire(on_queued=interrupt)
+        assert governor.queued == 0
+        governor.release()
+        acquired = threading.Event()
+        thread = threading.Thread(target=lambda: (governor.acquire(), acquired.set()))
+        thread.start()
+        assert acquired.wait(timeout=5)
+        thread.join()
+        assert governor.in_flight == 1
+
+
+class TestAsyncRateLimit:
+    def test_governor_queues_fairly(self):
+        async def main():
+            governor = AsyncConcurrencyGovernor(max_in_flight=1)
+            await governor.acquire()
+            positions, order = [], []
+
+            async def request(name):
+                async def on_queued(position):
+                    positions.append(position)
+
+                await governor.acquire(on_queued=on_queued)
+                order.append(name)
+                governor.release()
+
+            tasks = []
+            for name in ["first", "second", "third"]:
+                tasks.append(asyncio.create_task(request(name)))
+                await asyncio.sleep(0)
+            assert positions == [1, 2, 3]
+            governor.release()
+            await asyncio.gather(*tasks)
+            assert order == ["first", "second", "third"]
+            assert governor.in_flight == 0
+
+        asyncio.run(main())
+
+    def test_cancelled_request_leaves_the_queue(self):
+        async def main():
+            governor = AsyncConcurrencyGovernor(max_in_flight=1)
+            await governor.acquire()
+            waiting = asyncio.create_task(governor.acquire())
+            await asyncio.sleep(0)
+            assert governor.queued == 1
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert governor.queued == 0
+            governor.release()
+            assert governor.in_flight == 0
+
+        asyncio.run(main())
+
+    def test_cancelled_while_notified(self):
+        async def main():
+            governor = AsyncConcurrencyGovernor(max_in_flight=1)
+            await governor.acquire()
+            notified = asyncio.Event()
+
+            async def on_queued(position):
+                notified.set()
+                await asyncio.sleep(10)
+
+            waiting = asyncio.create_task(governor.acquire(on_queued=on_queued))
+            await notified.wait()
+            waiting.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await waiting
+            assert governor.queued == 0
+            governor.release()
+            # the slot isn't handed over to the cancelled request
+            await asyncio.wait_for(governor.acquire(), timeout=1)
+            assert governor.in_flight == 1
+
+        asyncio.run(main())
+
+    def test_limiter(self, monkeypatch):
+        sleeps = []
+
+        async def sleep(seconds):
+            sleeps.append(seconds)
+
+        monkeypatch.setattr("handler_tasks.rate_limit.asyncio.sleep", sleep)
+
+        async def main():
+            limiter = CortexLimiter(rate=1, burst=1, max_in_flight=1)
+            async with limiter.limit_async():
+                assert limiter.async_governor.in_flight == 1
+            with pytest.raises(ValueError):
+                async with limiter.limit_async():
+                    raise ValueError("boom")
+            assert limiter.async_governor.in_flight == 0
+
+        asyncio.run(main())
+        assert len(sleeps) == 1
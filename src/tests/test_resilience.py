@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from handler_tasks.async_cortalyst import AsyncCortlayst
+from handler_tasks.cortalyst import Cortlayst
+from handler_tasks.rate_limit import CortexLimiter
+from handler_tasks.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    CortexAnalystError,
+    DeadlineExceededError,
+    RetryPolicy,
+    Timeouts,
+    parse_retry_after,
+)
+from security.rsa_keypair_generator import gen_key, save_private_key
+
+logger = logging.getLogger("resilience_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class FakeTransport:
+    """
+    Replays the given responses (or raises the given errors) one per post.
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False):
+        self.calls.append(timeout)
+        resp = self.responses.pop(0)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
+
+def response(status_code: int, text: str = "{}", **headers):
+    return SimpleNamespace(
+        status_code=status_code,
+        text=text,
+        headers={"X-Snowflake-Request-Id": "1234", **headers},
+    )
+
+
+@pytest.fixture(scope="module")
+def private_key_file(tmp_path_factory):
+    _pk_file = tmp_path_factory.mktemp("keys").joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return str(_pk_file)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    _sleeps = []
+    monkeypatch.setattr("handler_tasks.cortalyst.time.sleep", _sleeps.append)
+    return _sleeps
+
+
+class AsyncFakeTransport:
+    """
+    Answers every post with an empty answer, after `started` is set and `release` is.
+    """
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+
+    @asynccontextmanager
+    async def post(self, url, json=None, headers=None, timeout=None):
+        self.started.set()
+        await self.release.wait()
+
+        async def text():
+            return '{"message": {"content": []}}'
+
+        yield SimpleNamespace(
+            status=200, headers={"X-Snowflake-Request-Id": "1234"}, text=text
+        )
+
+
+def cortalyst(
+    private_key_file,
+    transport,
+    breaker=None,
+    total=90.0,
+    limiter=None,
+    client_class=Cortlayst,
+):
+    return client_class(
+        account="myorg-myaccount",
+        user="me",
+        private_key_file_path=private_key_file,
+        host="myorg-myaccount.snowflakecomputing.com",
+        transport=transport,
+        timeouts=Timeouts(connect=1, read=10, total=total),
+        retry_policy=RetryPolicy(max_retries=2, base_delay=0.1),
+        breaker=breaker or CircuitBreaker(),
+        limiter=limiter or CortexLimiter(),
+    )
+
+
+class TestResilience:
+    def test_parse_retry_after(self):
+        assert parse_retry_after("3") == 3.0
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+        assert parse_retry_after("soon") is None
+
+    def test_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=4)
+        assert 0 <= policy.backoff(5) <= 4
+        assert policy.backoff(0, retry_after=7) == 7
+        assert policy.is_retryable(503)
+        assert policy.is_retryable(None)
+        assert not policy.is_retryable(400)
+
+    def test_circuit_breaker(self, monkeypatch):
+        now = 100.0
+        monkeypatch.setattr("handler_tasks.resilience.time.monotonic", lambda: now)
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+        breaker.record_failure()
+        breaker.before_call()
+        breaker.record_failure()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        now = 111.0
+        breaker.before_call()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_unreported_trial_times_out(self, monkeypatch):
+        now = 100.0
+        monkeypatch.setattr("handler_tasks.resilience.time.monotonic", lambda: now)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        now = 111.0
+        # the trial call is let through and never reports, e.g. it is cancelled
+        breaker.before_call()
+        with pytest.raises(CircuitOpenError):
+            breaker.before_call()
+        now = 122.0
+        breaker.before_call()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    def test_trial_with_unexpected_error_reopens(
+        self, private_key_file, sleeps, monkeypatch
+    ):
+        now = 100.0
+        monkeypatch.setattr("handler_tasks.resilience.time.monotonic", lambda: now)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        now = 111.0
+        transport = FakeTransport(ValueError("could not sign the JWT"))
+        with pytest.raises(ValueError):
+            cortalyst(private_key_file, transport, breaker).answer("q")
+        assert breaker.state == CircuitBreaker.OPEN
+        now = 122.0
+        transport = FakeTransport(response(200, '{"message": {"content": []}}'))
+        cortalyst(private_key_file, transport, breaker).answer("q")
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_retries_honour_retry_after(self, private_key_file, sleeps):
+        transport = FakeTransport(
+            response(429, "slow down", **{"Retry-After": "2"}),
+            requests.Timeout("read timed out"),
+            response(200, '{"message": {"content": []}}'),
+        )
+        ans = cortalyst(private_key_file, transport).answer("q")
+        assert ans["request_id"] == "1234"
+        assert sleeps[0] == 2.0
+        assert len(sleeps) == 2
+        assert transport.calls[0] == (1, 10)
+
+    def test_client_errors_are_not_retried(self, private_key_file, sleeps):
+        transport = FakeTransport(response(400, "bad request"))
+        with pytest.raises(CortexAnalystError) as e:
+            cortalyst(private_key_file, transport).answer("q")
+        assert e.value.status_code == 400
+        assert sleeps == []
+
+    def test_retries_exhausted(self, private_key_file, sleeps):
+        breaker = CircuitBreaker(failure_threshold=3)
+        transport = FakeTransport(response(503), response(503), response(503))
+        with pytest.raises(CortexAnalystError) as e:
+            cortalyst(private_key_file, transport, breaker).answer("q")
+        assert e.value.status_code == 503
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            cortalyst(private_key_file, transport, breaker).answer("q")
+
+    def test_deadline(self, private_key_file, sleeps):
+        transport = FakeTransport(response(503, **{"Retry-After": "60"}))
+        with pytest.raises(DeadlineExceededError):
+            cortalyst(private_key_file, transport, total=5).answer("q")
+
+
+class CountingLimiter(CortexLimiter):
+    def __init__(self):
+        super().__init__(max_in_flight=1)
+        self.limited = 0
+
+    def limit(self, on_queued=None):
+        self.limited += 1
+        return super().limit(on_queued)
+
+
+class TestLimiter:
+    def test_every_attempt_is_limited(self, private_key_file, sleeps):
+        limiter = CountingLimiter()
+        transport = FakeTransport(
+            response(503), response(200, '{"message": {"content": []}}')
+        )
+        cortalyst(private_key_file, transport, limiter=limiter).answer("q")
+        assert limiter.limited == 2
+        assert limiter.governor.in_flight == 0
+
+    def test_slot_is_not_held_while_streaming(self, private_key_file):
+        limiter = CountingLimiter()
+        lines = [
+            "event: message.content.delta",
+            'data: {"index": 0, "type": "text", "text_delta": "Hi"}',
+            "",
+            "event: message.content.delta",
+            'data: {"index": 1, "type": "sql", "statement_delta": "SELECT 1"}',
+            "",
+        ]
+        resp = response(200)
+        resp.iter_lines = lambda: iter(lines)
+        resp.close = lambda: None
+        items = cortalyst(
+            private_key_file, FakeTransport(resp), limiter=limiter
+        ).answer_stream("q")
+        assert next(items)["text"] == "Hi"
+        assert limiter.governor.in_flight == 0
+        assert [item["type"] for item in items] == ["sql"]
+
+
+class TestAsyncResilience:
+    def test_cancelled_trial_lets_the_next_call_through(
+        self, private_key_file, monkeypatch
+    ):
+        now = 100.0
+        monkeypatch.setattr("handler_tasks.resilience.time.monotonic", lambda: now)
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10)
+        breaker.record_failure()
+        now = 111.0
+
+        async def main():
+            transport = AsyncFakeTransport()
+            client = cortalyst(
+                private_key_file, transport, breaker, client_class=AsyncCortlayst
+            )
+            trial = asyncio.create_task(client.answer("q"))
+            await transport.started.wait()
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+            # no need to wait for reset_timeout
+            transport.release.set()
+            await client.answer("q")
+
+        asyncio.run(main())
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_headers_are_built_off_the_event_loop(self, private_key_file):
+        threads = []
+
+        async def main():
+            transport = AsyncFakeTransport()
+            transport.release.set()
+            client = cortalyst(private_key_file, transport, client_class=AsyncCortlayst)
+            build_headers = client.build_headers
+
+            def _build_headers():
+                threads.append(threading.current_thread())
+                return build_headers()
+
+            client.build_headers = _build_headers
+            await client.answer("q")
+
+        asyncio.run(main())
+        assert threads and threads[0] is not threading.main_thread()
@@ -0,0 +1,143 @@
+import logging
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from handler_tasks.result_cache import (
+    ChangeMarkers,
+    ResultCache,
+    normalize_sql,
+    query_to_arrow,
+    sql_fingerprint,
+)
+
+logger = logging.getLogger("result_cache_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+QUERY = "SELECT service_type, COUNT(*) AS ticket_count FROM support_tickets GROUP BY 1"
+
+
+@pytest.fixture
+def table():
+    return pa.table({"SERVICE_TYPE": ["Cellular", "Home Internet"], "COUNT": [3, 4]})
+
+
+class FakeSession:
+    """
+    Counts the statements run, the marker query returns the `marker` rows.
+    """
+
+    def __init__(self, df, marker=(("SUPPORT_TICKETS", "2025-01-01"),)):
+        self.df = df
+        self.marker = marker
+        self.queries = []
+
+    def sql(self, query):
+        self.queries.append(query)
+        return self
+
+    def collect(self):
+        if isinstance(self.marker, Exception):
+            raise self.marker
+        return list(self.marker)
+
+    def to_arrow(self):
+        return pa.Table.from_pandas(self.df, preserve_index=False)
+
+    def to_arrow_batches(self):
+        for batch in self.to_arrow().to_batches(max_chunksize=1):
+            yield pa.Table.from_batches([batch])
+
+
+class TestNormalizeSql:
+    def test_normalize(self):
+        assert normalize_sql(
+            "SELECT  Service_Type, COUNT(*) -- per type\n FROM t WHERE x = 1.50;"
+        ) == ("select service_type , count ( * ) from t where x = 1.5")
+
+    def test_literals_kept(self):
+        assert normalize_sql("select 'Home' , \"Q\"") == "select 'Home' , \"Q\""
+        assert sql_fingerprint("select 'Home'") != sql_fingerprint("select 'home'")
+
+    def test_fingerprint(self):
+        assert sql_fingerprint(QUERY) == sql_fingerprint(
+            "select SERVICE_TYPE,count(*) as TICKET_COUNT\nfrom SUPPORT_TICKETS group by 01;"
+        )
+
+
+class TestResultCache:
+    def test_get_put(self, table):
+        cache = ResultCache()
+        assert cache.get(QUERY, "m1") is None
+        cache.put(QUERY, table, "m1")
+        assert cache.get(QUERY.lower(), "m1") is table
+        assert cache.get(QUERY, "m1", namespace="OTHER.DATA") is None
+        assert cache.stats()["hits"] == 1
+
+    def test_marker_changed(self, table):
+        cache = ResultCache()
+        cache.put(QUERY, table, "m1")
+        assert cache.get(QUERY, "m2") is None
+        assert len(cache) == 0 and cache.nbytes == 0
+
+    def test_ttl(self, table, monkeypatch):
+        cache = ResultCache(ttl=10)
+        now = 1000.0
+        monkeypatch.setattr("handler_tasks.result_cache.time.monotonic", lambda: now)
+        cache.put(QUERY, table, "m1")
+        now = 1011.0
+        assert cache.get(QUERY, "m1") is None
+
+    def test_memory_budget(self, table):
+        cache = ResultCache(max_bytes=2 * table.nbytes)
+        for i in range(3):
+            cache.put(f"{QUERY} LIMIT {i + 1}", table, "m1")
+        assert len(cache) == 2
+        assert cache.nbytes == 2 * table.nbytes
+        # least recently used first
+        assert cache.get(f"{QUERY} LIMIT 1", "m1") is None
+        cache.put("SELECT 1", pa.table({"X": list(range(1000))}), "m1")
+        assert cache.get("SELECT 1", "m1") is None
+
+
+class TestQueryToArrow:
+    def test_cached(self):
+        session = FakeSession(pd.DataFrame({"SERVICE_TYPE": ["Cellular"], "N": [1]}))
+        cache = ResultCache()
+        markers = ChangeMarkers(["support_tickets"], interval=60)
+        tables = [
+            query_to_arrow(session, QUERY, "demo_db", "data", None, cache, markers)
+            for _ in range(2)
+        ]
+        assert tables[0].to_pylist() == [{"SERVICE_TYPE": "Cellular", "N": 1}]
+        assert tables[1] is tables[0]
+        # one marker query and one query
+        assert len(session.queries) == 2
+        assert "copy_history" in session.queries[0]
+
+    def test_marker_unavailable(self):
+        session = FakeSession(pd.DataFrame({"X": [1]}), marker=RuntimeError("denied"))
+        cache = ResultCache()
+        markers = ChangeMarkers(["support_tickets"], interval=0)
+        for _ in range(2):
+            query_to_arrow(session, QUERY, "demo_db", "data", None, cache, markers)
+        assert len(cache) == 0
+        assert session.queries.count(QUERY) == 2
+
+    def test_columns(self):
+        df = pd.DataFrame({"SERVICE_TYPE": ["a", "b", "a"], "N": [1, 2, 3], "X": "x"})
+        session = FakeSession(df)
+        cache = ResultCache()
+        markers = ChangeMarkers(["support_tickets"], interval=60)
+        table = query_to_arrow(
+            session, QUERY, "demo_db", "data", ["SERVICE_TYPE", "N"], cache, markers
+        )
+        assert table.column_names == ["SERVICE_TYPE", "N"]
+        assert table.num_rows == 3
+        # the whole result is cached apart from the columns
+        assert query_to_arrow(
+            session, QUERY, "demo_db", "data", None, cache, markers
+        ).column_names == ["SERVICE_TYPE", "N", "X"]
@@ -0,0 +1,123 @@
+import logging
+
+import pytest
+
+from handler_tasks.semantic_cache import SemanticCache, key_terms
+
+logger = logging.getLogger("semantic_cache_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+MODEL_FILE = "@slack_demo.data.semantic_models/support_tickets_semantic_model.yaml"
+QUESTION = "Can you show me a breakdown of customer support tickets by service type - cellular vs business internet?"
+
+
+def answer(statement: str):
+    return {
+        "message": {
+            "role": "analyst",
+            "content": [
+                {"type": "text", "text": "This is our interpretation of your question"},
+                {"type": "sql", "statement": statement},
+            ],
+        },
+        "request_id": "1234",
+    }
+
+
+@pytest.fixture
+def cache():
+    cache = SemanticCache(threshold=0.6)
+    cache.put(QUESTION, MODEL_FILE, answer("SELECT service_type, COUNT(*)"))
+    cache.put(
+        "How many tickets were raised by customers preferring email contact?",
+        MODEL_FILE,
+        answer("SELECT COUNT(*) WHERE contact_preference = 'Email'"),
+    )
+    return cache
+
+
+class TestSemanticCache:
+    def test_paraphrase_returns_sql_only(self, cache):
+        got = cache.get(
+            "breakdown of support tickets by service type, cellular vs business internet",
+            MODEL_FILE,
+        )
+        assert got is not None
+        assert got["message"]["content"] == [
+            {"type": "sql", "statement": "SELECT service_type, COUNT(*)"}
+        ]
+        assert cache.stats()["hits"] == 1
+
+    def test_same_question_returns_whole_answer(self, cache):
+        got = cache.get(QUESTION.upper(), MODEL_FILE)
+        assert got is not None
+        assert len(got["message"]["content"]) == 2
+
+    def test_unrelated_question_misses(self, cache):
+        assert cache.get("What is the weather in Chennai today?", MODEL_FILE) is None
+        assert cache.get(QUESTION, "@other_db.data.stage/model.yaml") is None
+        assert cache.stats()["misses"] == 2
+
+    def test_put_replaces_same_question(self, cache):
+        cache.put(QUESTION, MODEL_FILE, answer("SELECT 1"))
+        assert len(cache) == 2
+        got = cache.get(QUESTION, MODEL_FILE)
+        assert got["message"]["content"][1]["statement"] == "SELECT 1"
+
+    def test_answers_without_sql_are_not_cached(self):
+        cache = SemanticCache()
+        cache.put(
+            "hello",
+            MODEL_FILE,
+            {"message": {"content": [{"type": "text", "text": "hi"}]}},
+        )
+        assert len(cache) == 0
+
+    def test_eviction_and_invalidate(self, cache):
+        cache.max_size = 2
+        cache.put("Top customers by number of tickets", MODEL_FILE, answer("SELECT 2"))
+        assert len(cache) == 2
+        cache.invalidate(MODEL_FILE)
+        assert len(cache) == 0
+
+
+OPENED_2023 = (
+    "How many support tickets were opened in 2023 for the Home Internet service type?"
+)
+
+
+class TestKeyTerms:
+    def test_literals_and_terms(self):
+        assert key_terms("Tickets closed in 2023 with 'Email' contact") == {
+            "'email'",
+            "closed",
+            "email",
+            "n:2023",
+        }
+
+    def test_possessive_is_not_quoted(self):
+        assert key_terms("the customer's tickets of the customers' plans") == set()
+
+    def test_numbers_are_canonical(self):
+        assert key_terms("top 10.0 customers") == key_terms("top 10 customers")
+
+    @pytest.mark.parametrize(
+        "question",
+        [
+            OPENED_2023.replace("2023", "2024"),
+            OPENED_2023.replace("opened", "closed"),
+            OPENED_2023.replace("Home Internet", "Business Internet"),
+            OPENED_2023.replace("How many", "Top 5"),
+        ],
+    )
+    def test_different_literal_misses(self, question):
+        cache = SemanticCache()
+        cache.put(OPENED_2023, MODEL_FILE, answer("SELECT 2023"))
+        assert cache.get(question, MODEL_FILE) is None
+        assert cache.get(OPENED_2023.lower(), MODEL_FILE) is not None
+
+    def test_quoted_value_misses(self, cache):
+        question = "How many tickets were raised by customers preferring 'Text Message' contact?"
+        assert cache.get(question, MODEL_FILE) is None
@@ -0,0 +1,44 @@
+import logging
+import threading
+
+import pytest
+
+from handler_tasks.db_setup import DBSetup
+from handler_tasks.session import BackgroundSession
+
+logger = logging.getLogger("session_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class TestBackgroundSession:
+    def test_get_waits(self):
+        opened = threading.Event()
+        session = object()
+
+        def _open():
+            opened.wait(5)
+            return session
+
+        background_session = BackgroundSession(factory=_open).start()
+        assert not background_session.ready
+        with pytest.raises(TimeoutError):
+            background_session.get(timeout=0.05)
+        opened.set()
+        assert background_session.get(timeout=5) is session
+        assert background_session.ready
+
+    def test_error(self):
+        def _open():
+            raise ConnectionError("no connection")
+
+        background_session = BackgroundSession(factory=_open)
+        with pytest.raises(ConnectionError):
+            background_session.get(timeout=5)
+        assert not background_session.ready
+
+    def test_db_setup(self):
+        session = object()
+        db_setup = DBSetup(session=BackgroundSession(factory=lambda: session).get)
+        assert db_setup.session is session
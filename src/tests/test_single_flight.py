@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from handler_tasks.single_flight import AsyncSingleFlight, SingleFlight
+
+logger = logging.getLogger("single_flight_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_are_shared(self):
+        flight = SingleFlight()
+        calls = []
+        started = threading.Event()
+
+        def slow_answer(question):
+            calls.append(question)
+            started.set()
+            time.sleep(0.2)
+            return {"question": question}
+
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            first = pool.submit(flight.do, "q", slow_answer, "q")
+            started.wait()
+            others = [pool.submit(flight.do, "q", slow_answer, "q") for _ in range(4)]
+            results = [first.result()] + [f.result() for f in others]
+
+        assert calls == ["q"]
+        assert all(r is results[0] for r in results)
+
+    def test_errors_are_shared_and_not_cached(self):
+        flight = SingleFlight()
+
+        def failing():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError):
+            flight.do("q", failing)
+        assert flight.do("q", lambda: 42) == 42
+
+    def test_interrupted_call_is_an_error_for_waiters(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def interrupted():
+            started.set()
+            release.wait()
+            raise KeyboardInterrupt
+
+        def lead():
+            with pytest.raises(KeyboardInterrupt):
+                flight.do("q", interrupted)
+
+        leader = threading.Thread(target=lead)
+        leader.start()
+        started.wait()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            waiter = pool.submit(flight.do, "q", interrupted)
+            while not flight._calls["q"].waiters:
+                time.sleep(0.01)
+            release.set()
+            with pytest.raises(RuntimeError):
+                waiter.result(timeout=5)
+        leader.join()
+
+
+class TestAsyncSingleFlight:
+    def test_concurrent_calls_are_shared(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow_answer(question):
+            calls.append(question)
+            await asyncio.sleep(0.05)
+            return {"question": question}
+
+        async def ask():
+            return await asyncio.gather(
+                *[flight.do("q", slow_answer, "q") for _ in range(5)],
+                flight.do("other", slow_answer, "other"),
+            )
+
+        results = asyncio.run(ask())
+        assert calls == ["q", "other"]
+        assert results[:5] == [{"question": "q"}] * 5
+
+    def test_errors_are_shared(self):
+        flight = AsyncSingleFlight()
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        async def ask():
+            return await asyncio.gather(
+                flight.do("q", fail), flight.do("q", fail), return_exceptions=True
+            )
+
+        assert all(isinstance(r, ValueError) for r in asyncio.run(ask()))
+
+    def test_first_caller_cancelled(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow_answer():
+            calls.append("q")
+            await asyncio.sleep(0.05)
+            return 42
+
+        async def ask():
+            first = asyncio.create_task(flight.do("q", slow_answer))
+            await asyncio.sleep(0)
+            others = [
+                asyncio.create_task(flight.do("q", slow_answer)) for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            first.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await first
+            return await asyncio.gather(*others)
+
+        assert asyncio.run(ask()) == [42, 42]
+        assert calls == ["q"]
+
+    def test_call_cancelled_with_its_callers(self):
+        flight = AsyncSingleFlight()
+        cancelled = []
+
+        async def slow_answer():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append("q")
+                raise
+
+        async def ask():
+            callers = [
+                asyncio.create_task(flight.do("q", slow_answer)) for _ in range(2)
+            ]
+            await asyncio.sleep(0)
+            for caller in callers:
+                caller.cancel()
+            await asyncio.gather(*callers, return_exceptions=True)
+            await asyncio.sleep(0)
+            assert not flight._calls
+
+        asyncio.run(ask())
+        assert cancelled == ["q"]
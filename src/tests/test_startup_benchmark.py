@@ -0,0 +1,41 @@
+import logging
+
+from loadtest.startup_benchmark import parse_importtime, script_imports, summarize
+
+logger = logging.getLogger("startup_benchmark_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+REPORT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     json.scanner
+import time:       300 |        420 |   json.decoder
+import time:       200 |        620 | json
+import time:      1000 |       1000 | altair
+Traceback (most recent call last):
+"""
+
+
+class TestStartupBenchmark:
+    def test_parse_importtime(self):
+        times = parse_importtime(REPORT)
+        assert [t.module for t in times] == [
+            "json.scanner",
+            "json.decoder",
+            "json",
+            "altair",
+        ]
+        assert [t.level for t in times] == [2, 1, 0, 0]
+        assert times[2].cumulative_us == 620
+
+    def test_summarize(self):
+        runs = [parse_importtime(REPORT)] * 3
+        summary = summarize(runs, top=1)
+        assert summary["total_seconds"] == 0.00162
+        assert summary["slowest"] == [("altair", 0.001)]
+        assert summary["eager_lazy_modules"] == ["altair"]
+
+    def test_script_imports(self, tmp_path):
+        script = tmp_path.joinpath("bot.py")
+        script.write_text("import os\nfrom json import dumps\n\nprint(os.getcwd())\n")
+        assert script_imports(script) == "import os\nfrom json import dumps"
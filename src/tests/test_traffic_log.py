@@ -0,0 +1,85 @@
+import logging
+import threading
+
+import pytest
+import requests
+
+from handler_tasks.answer_cache import AnswerCache
+from handler_tasks.cortalyst import Cortlayst
+from handler_tasks.resilience import (
+    CircuitBreaker,
+    CortexAnalystError,
+    RetryPolicy,
+    Timeouts,
+)
+from handler_tasks.traffic_log import RecordingTransport, ReplayTransport, TrafficLog
+from loadtest.mock_analyst_server import MockAnalystServer
+from security.rsa_keypair_generator import gen_key, save_private_key
+
+logger = logging.getLogger("traffic_log_tests")
+logging.basicConfig(
+    format="%(levelname)s:%(message)s",
+)
+
+
+@pytest.fixture(scope="module")
+def private_key_file(tmp_path_factory):
+    _pk_file = tmp_path_factory.mktemp("keys").joinpath("snowflake_user.p8")
+    save_private_key(gen_key(key_size=2048), _pk_file)
+    return str(_pk_file)
+
+
+@pytest.fixture
+def server():
+    _server = MockAnalystServer(("127.0.0.1", 0), seed=42)
+    thread = threading.Thread(target=_server.serve_forever, daemon=True)
+    thread.start()
+    yield _server
+    _server.shutdown()
+    _server.server_close()
+
+
+def cortalyst(private_key_file, transport, base_url="http://localhost:8080"):
+    return Cortlayst(
+        account="myorg-myaccount",
+        user="me",
+        private_key_file_path=private_key_file,
+        host="myorg-myaccount.snowflakecomputing.com",
+        transport=transport,
+        answer_cache=AnswerCache(max_size=0),
+        timeouts=Timeouts(connect=1, read=5, total=10),
+        retry_policy=RetryPolicy(max_retries=0),
+        breaker=CircuitBreaker(),
+        base_url=base_url,
+    )
+
+
+class TestTrafficLog:
+    def test_record_and_replay(self, private_key_file, server, tmp_path):
+        log = TrafficLog(tmp_path / "traffic.jsonl")
+        recorder = cortalyst(
+            private_key_file,
+            RecordingTransport(requests.Session(), log),
+            server.base_url,
+        )
+        recorded = recorder.answer("How many tickets?")
+        recorded_items = list(recorder.answer_stream("Any tickets?"))
+
+        records = log.read()
+        assert len(records) == 2
+        assert records[0]["headers"]["X-Snowflake-Request-Id"] == recorded["request_id"]
+        assert records[0]["latency"] >= 0
+        assert "Authorization" not in records[0]["headers"]
+        assert records[1]["lines"]
+
+        server.shutdown()
+        replayer = cortalyst(private_key_file, ReplayTransport(log))
+        assert replayer.answer("How many tickets?") == recorded
+        assert list(replayer.answer_stream("Any tickets?")) == recorded_items
+
+    def test_replay_unknown_request(self, private_key_file, tmp_path):
+        log = TrafficLog(tmp_path / "traffic.jsonl")
+        log.path.touch()
+        with pytest.raises(CortexAnalystError) as e:
+            cortalyst(private_key_file, ReplayTransport(log)).answer("q")
+        assert e.value.status_code == 404